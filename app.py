@@ -1,45 +1,270 @@
+import csv
+import io
 import json
 import os
 import time
+import uuid
 import hmac
+import html
 import hashlib
 import base64
+import random
+import atexit
+import contextlib
+import functools
 import urllib.parse
-from flask import Flask, request, render_template, make_response, jsonify
-import datetime
+from flask import Flask, request, render_template, make_response, jsonify, Response, stream_with_context
 import logging
+import logging.handlers
 from dotenv import load_dotenv
 import traceback
 import re
 import threading
+import queue
+import sqlite3
 import websocket
 import ssl
+import select
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from time import mktime
 from datetime import datetime
 from urllib.parse import urlencode
 from wsgiref.handlers import format_date_time
+from plan_render import render_document
+from structured_output import (
+    StructuredStream, StructuredOutputError, format_instructions, format_example, embedded_data,
+    EMBEDDED_DATA
+)
+from metrics import (
+    metrics, METRIC_GENERATION_REQUESTS, METRIC_SPARK_CALLS, METRIC_SPARK_ERRORS, METRIC_SPARK_INFLIGHT,
+    METRIC_SPARK_CONNECT, METRIC_SPARK_WARM, METRIC_SPARK_WARM_READY, METRIC_SPARK_URL_SIGNATURES,
+    METRIC_SPARK_FIRST_TOKEN, METRIC_SPARK_DURATION, METRIC_FULL_PLAN_DURATION, METRIC_SPARK_OUTPUT_CHARS,
+    METRIC_POOL_IN_USE, METRIC_POOL_WAITING, METRIC_SPARK_TIMEOUT, METRIC_SPARK_TOKENS, METRIC_CACHE_LOOKUPS,
+    METRIC_SIMILAR_LOOKUPS, METRIC_STAGE_INPUT_TOKENS, METRIC_STRUCTURED_OUTPUT_ERRORS
+)
+from request_context import (
+    request_id_var, user_id_var, cancel_token_var, in_current_context, CancelToken, GenerationError
+)
+from html_outline import HtmlStreamExtractor, estimate_tokens, compact_outline
+from response_cache import SparkResponseCache
+from rate_limit import TokenBucket, SparkQuota
+from spark_resilience import SparkUnavailableError, RetryPolicy, CircuitBreaker
+from session_pool import SparkSessionPool
+from plan_store import PlanStore, PLAN_META_FIELDS, PLAN_FIELDS
+from jobs import JobQueueFullError, MemoryJobStore, SQLiteJobStore, JobManager, JOB_FINISHED_STATUSES
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # 加载环境变量
 load_dotenv()
 
-# 配置日志
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app_debug.log"),
-        logging.StreamHandler()
-    ]
-)
+# 日志配置
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "app_debug.log")  # 留空则只输出到控制台
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))  # 单个日志文件大小上限
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))  # 保留的历史日志文件数
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.01))  # DEBUG级别请求体日志的采样率
+
+
+class RequestIdFilter(logging.Filter):
+    """为日志记录附加当前请求ID"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class WebSocketCloseFilter(logging.Filter):
+    """websocket-client 对正常关闭（代码1000）也以ERROR记录"... - goodbye"，降为DEBUG"""
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR and "closed normally" in record.getMessage():
+            record.levelno, record.levelname = logging.DEBUG, "DEBUG"
+            return logging.getLogger(record.name).isEnabledFor(logging.DEBUG)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化JSON日志，每条记录一行"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage()
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """把日志记录放入队列，由后台线程写磁盘；保留异常堆栈供结构化输出"""
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging():
+    """请求线程只入队，文件和控制台输出在QueueListener线程中完成；日志文件按大小轮转"""
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s'))
+    handlers = [console]
+    if LOG_FILE:
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("websocket").addFilter(WebSocketCloseFilter())
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def sample_payload_log():
+    """DEBUG级别的请求体、签名URL等大日志按采样率记录"""
+    return logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_PAYLOAD_SAMPLE_RATE
+
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+
+@app.before_request
+def assign_request_id():
+    """为每个请求分配ID，优先沿用上游传入的 X-Request-ID"""
+    request_id_var.set(request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16])
+    user_id_var.set(request.headers.get('X-User-ID', '').strip()[:32] or "anonymous")
+
+
+@app.after_request
+def expose_request_id(response):
+    response.headers['X-Request-ID'] = request_id_var.get()
+    return response
+
 # 星火AI配置
 APP_ID = os.getenv("XF_APP_ID", "4cabacd2")
 API_SECRET = os.getenv("XF_API_SECRET", "OTZmMjQ0NTNhMzEyMGU3ZmQ3NjE5YmRh")
 API_KEY = os.getenv("XF_API_KEY", "7d2cd40dd21e530da80e9069c6e155b8")
-SPARK_URL = "wss://spark-api.xf-yun.com/v1/x1"  # X1模型WebSocket地址
+SPARK_URL = os.getenv("SPARK_URL", "wss://spark-api.xf-yun.com/v1/x1")  # X1模型WebSocket地址，可指向 mock_spark_server.py
+
+# 会话池配置
+SPARK_POOL_SIZE = int(os.getenv("SPARK_POOL_SIZE", 32))  # 最大并发生成数
+SPARK_POOL_MAX_WAITING = int(os.getenv("SPARK_POOL_MAX_WAITING", 64))  # 最大排队请求数
+SPARK_POOL_ACQUIRE_TIMEOUT = float(os.getenv("SPARK_POOL_ACQUIRE_TIMEOUT", 30))  # 排队等待超时（秒）
+
+# 上游配额配置：所有星火调用（含重试）共享
+SPARK_RATE_LIMIT = float(os.getenv("SPARK_RATE_LIMIT", 10))  # 每秒最多建立的连接数，0表示不限速
+SPARK_RATE_BURST = int(os.getenv("SPARK_RATE_BURST", 10))  # 允许的突发连接数
+SPARK_MAX_CONNECTIONS = int(os.getenv("SPARK_MAX_CONNECTIONS", 32))  # 同时打开的上游连接数上限
+
+# 连接预热：后台保持若干已完成TLS握手和鉴权的连接，调用时直接发送请求
+SPARK_WARM_CONNECTIONS = int(os.getenv("SPARK_WARM_CONNECTIONS", 0))  # 预热连接数，0表示不预热
+SPARK_WARM_MAX_AGE = float(os.getenv("SPARK_WARM_MAX_AGE", 30))  # 预热连接的最长闲置时间（秒），超过后丢弃重建
+SPARK_WARM_CONNECT_TIMEOUT = float(os.getenv("SPARK_WARM_CONNECT_TIMEOUT", 10))  # 预热建连超时（秒）
+
+# 各阶段的生成参数：max_tokens、temperature，以及积累足够样本前使用的总超时（秒）
+# 超过总超时或帧间空闲超时的调用按失败处理（HTTP 504），已收到的部分内容不作为结果返回
+SPARK_DEFAULT_PROFILE = {"max_tokens": 4096, "temperature": 0.5, "timeout": 60}
+SPARK_PROFILES = {
+    "mindmap": {"max_tokens": 2048, "temperature": 0.5, "timeout": 45},
+    "teaching_flow": {"max_tokens": 6144, "temperature": 0.7, "timeout": 90},
+    "problem_simulation": {"max_tokens": 4096, "temperature": 0.6, "timeout": 75},
+    "evaluation": {"max_tokens": 3072, "temperature": 0.3, "timeout": 60},
+}
+# 可用JSON覆盖部分阶段的参数，如 {"mindmap": {"max_tokens": 1536}}
+for _route, _overrides in json.loads(os.getenv("SPARK_PROFILES", "{}")).items():
+    SPARK_PROFILES[_route] = {**SPARK_PROFILES.get(_route, SPARK_DEFAULT_PROFILE), **_overrides}
+
+# 自适应超时：按各阶段最近成功调用的耗时分位数推算，样本不足时使用上面的固定超时
+SPARK_IDLE_TIMEOUT = float(os.getenv("SPARK_IDLE_TIMEOUT", 20))  # 两帧之间的最长间隔（秒），也是自适应空闲超时的上限
+SPARK_IDLE_TIMEOUT_MIN = float(os.getenv("SPARK_IDLE_TIMEOUT_MIN", 5))  # 自适应空闲超时的下限（秒）
+SPARK_TIMEOUT_MIN = float(os.getenv("SPARK_TIMEOUT_MIN", 20))  # 自适应总超时的下限（秒）
+SPARK_TIMEOUT_MAX = float(os.getenv("SPARK_TIMEOUT_MAX", 180))  # 自适应总超时的上限（秒）
+SPARK_TIMEOUT_PERCENTILE = float(os.getenv("SPARK_TIMEOUT_PERCENTILE", 0.99))  # 参考的耗时分位数
+SPARK_TIMEOUT_FACTOR = float(os.getenv("SPARK_TIMEOUT_FACTOR", 1.5))  # 超时 = 分位数 × 系数
+SPARK_TIMEOUT_WINDOW = int(os.getenv("SPARK_TIMEOUT_WINDOW", 200))  # 每个阶段保留的最近样本数
+SPARK_TIMEOUT_MIN_SAMPLES = int(os.getenv("SPARK_TIMEOUT_MIN_SAMPLES", 20))  # 启用自适应所需的最少样本数
+
+# 流式响应配置
+SSE_KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", 5))  # 无输出时发送心跳的间隔（秒），用于发现客户端断开
+
+# 重试与熔断配置
+SPARK_MAX_RETRIES = int(os.getenv("SPARK_MAX_RETRIES", 2))  # 可重试错误的最大重试次数
+SPARK_RETRY_BASE_DELAY = float(os.getenv("SPARK_RETRY_BASE_DELAY", 0.5))  # 首次重试的退避上限（秒），之后逐次翻倍
+SPARK_RETRY_MAX_DELAY = float(os.getenv("SPARK_RETRY_MAX_DELAY", 8))  # 单次退避上限（秒）
+SPARK_BREAKER_FAILURES = int(os.getenv("SPARK_BREAKER_FAILURES", 5))  # 连续失败多少次后熔断
+SPARK_BREAKER_RESET_TIMEOUT = float(os.getenv("SPARK_BREAKER_RESET_TIMEOUT", 30))  # 熔断后多久放行试探请求（秒）
+
+# 生成结果缓存配置
+SPARK_CACHE_MAX_ENTRIES = int(os.getenv("SPARK_CACHE_MAX_ENTRIES", 512))  # 内存LRU条目上限，0表示关闭
+SPARK_CACHE_TTL = float(os.getenv("SPARK_CACHE_TTL", 86400))  # 缓存有效期（秒）
+SPARK_CACHE_DB = os.getenv("SPARK_CACHE_DB", "")  # SQLite持久层路径，留空则不启用
+SPARK_CACHE_DB_MAX_ENTRIES = int(os.getenv("SPARK_CACHE_DB_MAX_ENTRIES", 10000))  # 持久层条目上限
+
+# 异步任务队列配置
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 8))  # 后台工作线程数
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", 100))  # 最大排队任务数
+JOB_STORE_DB = os.getenv("JOB_STORE_DB", "")  # 任务存储SQLite路径，留空则保存在进程内存中
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", 3600))  # 已结束任务的保留时间（秒）
+
+# 批量生成配置
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 16))  # 单个批次的并发上限
+BATCH_DEFAULT_RATE = float(os.getenv("BATCH_DEFAULT_RATE", 2))  # 默认每秒发起的请求数
+
+# 教案存储配置
+PLAN_STORE_DB = os.getenv("PLAN_STORE_DB", "plans.db")  # 教案存储SQLite路径
+PLAN_PAGE_SIZE = int(os.getenv("PLAN_PAGE_SIZE", 20))  # 教案列表默认每页条数
+PLAN_MAX_PAGE_SIZE = int(os.getenv("PLAN_MAX_PAGE_SIZE", 100))  # 教案列表每页条数上限
+PLAN_SEARCH_CANDIDATES = int(os.getenv("PLAN_SEARCH_CANDIDATES", 2000))  # 检索时参与相关度排序的最新匹配数
+
+# 阶段输入压缩配置：下游阶段的输入由上一阶段的HTML压缩为大纲文本
+STAGE_INPUT_COMPACT = os.getenv("STAGE_INPUT_COMPACT", "true").lower() == "true"  # 是否压缩
+STAGE_INPUT_MAX_TOKENS = int(os.getenv("STAGE_INPUT_MAX_TOKENS", 1200))  # 压缩后大纲的token预算（估算值）
+
+# 生成结果格式：html 由模型直接输出HTML；json 由模型输出紧凑JSON，服务端校验后渲染为HTML
+OUTPUT_FORMATS = ("html", "json")
+SPARK_OUTPUT_FORMAT = os.getenv("SPARK_OUTPUT_FORMAT", "html").lower()  # 默认格式，请求可用 output_format 覆盖
+
+# 相似课程复用配置（需要安装numpy）
+SIMILAR_PLAN_THRESHOLD = float(os.getenv("SIMILAR_PLAN_THRESHOLD", 0.85))  # 余弦相似度阈值，达到即复用已有思维导图
+SIMILAR_PLAN_MAX_ENTRIES = int(os.getenv("SIMILAR_PLAN_MAX_ENTRIES", 10000))  # 索引的最近教案数，0表示关闭
+SIMILAR_PLAN_DIM = int(os.getenv("SIMILAR_PLAN_DIM", 1024))  # n-gram哈希向量维数
+
+# PDF/DOCX导出配置
+EXPORT_RENDER_WORKERS = int(os.getenv("EXPORT_RENDER_WORKERS", 2))  # 渲染进程数
+EXPORT_RENDER_TIMEOUT = float(os.getenv("EXPORT_RENDER_TIMEOUT", 60))  # 单个文档渲染超时（秒），超时后终止渲染进程
+EXPORT_CACHE_MAX_ENTRIES = int(os.getenv("EXPORT_CACHE_MAX_ENTRIES", 64))  # 渲染结果缓存条目上限，0表示关闭
+EXPORT_CACHE_TTL = float(os.getenv("EXPORT_CACHE_TTL", 3600))  # 渲染结果缓存有效期（秒）
 
 # 打印环境变量以验证
 logger.info(f"APP_ID: {APP_ID}")
@@ -47,6 +272,40 @@ logger.info(f"API_KEY: {API_KEY}")
 logger.info(f"API_SECRET: {API_SECRET[:4]}...")  # 只显示前4位避免泄露
 
 
+@functools.lru_cache(maxsize=16)
+def signed_spark_url(spark_url, host, path, api_key, api_secret, date):
+    """带鉴权参数的连接URL
+
+    签名只依赖精确到秒的RFC1123日期，同一秒内发起的连接复用同一个URL，不再重复计算HMAC。
+    """
+    # 拼接字符串
+    signature_origin = "host: " + host + "\n"
+    signature_origin += "date: " + date + "\n"
+    signature_origin += "GET " + path + " HTTP/1.1"
+
+    # 进行hmac-sha256加密
+    signature_sha = hmac.new(
+        api_secret.encode('utf-8'),
+        signature_origin.encode('utf-8'),
+        digestmod=hashlib.sha256
+    ).digest()
+
+    signature_sha_base64 = base64.b64encode(signature_sha).decode(encoding='utf-8')
+
+    authorization_origin = f'api_key="{api_key}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature_sha_base64}"'
+
+    authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
+
+    # 将请求的鉴权参数组合为字典
+    v = {
+        "authorization": authorization,
+        "date": date,
+        "host": host
+    }
+    # 拼接鉴权参数，生成url
+    return spark_url + '?' + urlencode(v)
+
+
 class SparkWebSocket:
     def __init__(self, app_id, api_key, api_secret, spark_url):
         self.app_id = app_id
@@ -56,10 +315,22 @@ class SparkWebSocket:
         self.host = urllib.parse.urlparse(spark_url).netloc
         self.path = urllib.parse.urlparse(spark_url).path
         self.ws = None
-        self.answer = ""
+        self.parts = []
+        self.extractor = HtmlStreamExtractor()
         self.completed = False
+        self.succeeded = False
+        self.route = "unknown"
+        self.error_code = None
+        self.usage = None
+        self.started_at = 0.0
+        self.last_frame_at = 0.0
+        self.max_gap = 0.0
+        self.first_token_at = None
+        self.output_chars = 0
+        self.connect_source = "cold"
         self.lock = threading.Lock()
         self.event = threading.Event()
+        self.chunks = queue.Queue()
 
     def create_url(self):
         """生成星火API所需的WebSocket连接URL"""
@@ -67,47 +338,24 @@ class SparkWebSocket:
         now = datetime.now()
         date = format_date_time(mktime(now.timetuple()))
 
-        # 拼接字符串
-        signature_origin = "host: " + self.host + "\n"
-        signature_origin += "date: " + date + "\n"
-        signature_origin += "GET " + self.path + " HTTP/1.1"
-
-        # 进行hmac-sha256加密
-        signature_sha = hmac.new(
-            self.api_secret.encode('utf-8'),
-            signature_origin.encode('utf-8'),
-            digestmod=hashlib.sha256
-        ).digest()
-
-        signature_sha_base64 = base64.b64encode(signature_sha).decode(encoding='utf-8')
-
-        authorization_origin = f'api_key="{self.api_key}", algorithm="hmac-sha256", headers="host date request-line", signature="{signature_sha_base64}"'
-
-        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
-
-        # 将请求的鉴权参数组合为字典
-        v = {
-            "authorization": authorization,
-            "date": date,
-            "host": self.host
-        }
-        # 拼接鉴权参数，生成url
-        url = self.spark_url + '?' + urlencode(v)
-        logger.debug(f"Generated WebSocket URL: {url}")
+        url = signed_spark_url(self.spark_url, self.host, self.path, self.api_key, self.api_secret, date)
+        if sample_payload_log():
+            logger.debug(f"Generated WebSocket URL: {url}")
         return url
 
-    def gen_params(self, messages):
-        """生成请求参数"""
+    def gen_params(self, messages, route="unknown"):
+        """生成请求参数，max_tokens 和 temperature 取自阶段的生成参数"""
+        profile = spark_profile(route)
         data = {
             "header": {
                 "app_id": self.app_id,
-                "uid": "1234",
+                "uid": user_id_var.get(),
             },
             "parameter": {
                 "chat": {
                     "domain": "x1",  # 修改为x1
-                    "temperature": 0.5,
-                    "max_tokens": 4096,
+                    "temperature": profile["temperature"],
+                    "max_tokens": profile["max_tokens"],
                     "stream": True
                 }
             },
@@ -121,13 +369,20 @@ class SparkWebSocket:
 
     def on_message(self, ws, message):
         """WebSocket消息接收处理"""
+        if ws is not self.ws:
+            # 上一次调用超时后遗留的连接，忽略其消息避免污染当前结果
+            return
+        # 任何帧（包括不含content的推理帧）都说明上游仍在工作
+        now = time.monotonic()
+        self.max_gap = max(self.max_gap, now - self.last_frame_at)
+        self.last_frame_at = now
         try:
             data = json.loads(message)
             code = data['header']['code']
             if code != 0:
                 logger.error(f"API request error: {code}, {data}")
-                self.completed = True
-                self.event.set()
+                self.error_code = str(code)
+                self._finish()
                 return
 
             choices = data["payload"]["choices"]
@@ -135,47 +390,115 @@ class SparkWebSocket:
             # 检查 text 列表是否存在且至少有一个元素，以及元素中是否有 content 键
             if "text" in choices and len(choices["text"]) > 0 and "content" in choices["text"][0]:
                 content = choices["text"][0]["content"]
+                if self.first_token_at is None:
+                    self.first_token_at = time.monotonic()
+                    METRIC_SPARK_FIRST_TOKEN.observe(self.first_token_at - self.started_at, route=self.route)
                 with self.lock:
-                    self.answer += content
+                    self.parts.append(content)
+                    self.extractor.feed(content)
+                self.output_chars += len(content)
+                self.chunks.put(content)
             else:
                 logger.warning("Message does not contain 'content' key.")
 
-            # 状态为2表示结束
+            # 状态为2表示结束，最后一帧附带本次调用的token用量
             if status == 2:
                 logger.debug("API response completed")
-                self.completed = True
-                self.event.set()
+                self.usage = data["payload"].get("usage", {}).get("text")
+                self._finish(succeeded=True)
         except Exception as e:
             logger.error(f"Error processing WebSocket message: {str(e)}")
-            self.completed = True
-            self.event.set()
+            self._finish()
 
     def on_error(self, ws, error):
-        """WebSocket错误处理"""
+        """WebSocket错误处理：先区分遗留连接和正常关闭，只有真正的连接错误记为ERROR"""
+        if ws is not self.ws or self.completed:
+            # 遗留连接或本次调用已结束后的关闭通知，不影响已确定的调用结果
+            logger.debug(f"WebSocket closed: {error}")
+            return
+        if isinstance(error, websocket.WebSocketConnectionClosedException):
+            # 服务端在结束帧之前关闭了连接（包括正常关闭码1000），由 _finish 记为"closed"
+            logger.debug(f"WebSocket closed before completion: {error}")
+            self._finish()
+            return
         logger.error(f"WebSocket error: {error}")
-        self.completed = True
-        self.event.set()
+        self.error_code = self.error_code or "connection"
+        self._finish()
 
     def on_close(self, ws, close_status_code, close_msg):
         """WebSocket连接关闭处理"""
         logger.debug("WebSocket connection closed")
-        self.completed = True
-        self.event.set()
+        if ws is not self.ws:
+            return
+        self._finish()
 
     def on_open(self, ws):
         """WebSocket连接打开处理"""
+        if ws is not self.ws or self.completed:
+            # 握手完成前调用已被取消或超时，不再发送请求
+            ws.close()
+            return
         logger.debug("WebSocket connection opened")
-        data = json.dumps(self.gen_params(self.messages))
+        METRIC_SPARK_CONNECT.observe(time.monotonic() - self.started_at, route=self.route, source=self.connect_source)
+        data = json.dumps(self.gen_params(self.messages, self.route))
         ws.send(data)
-        logger.debug(f"Sent request: {data}")
+        if sample_payload_log():
+            logger.debug(f"Sent request: {data}")
+
+    def _finish(self, succeeded=False):
+        """标记本次调用结束、记录指标并唤醒等待方"""
+        with self.lock:
+            if self.completed:
+                return
+            self.completed = True
+            self.succeeded = succeeded
+        if not succeeded and self.error_code is None:
+            # 连接被关闭但未收到结束标记
+            self.error_code = "closed"
+        METRIC_SPARK_INFLIGHT.dec(route=self.route)
+        METRIC_SPARK_DURATION.observe(time.monotonic() - self.started_at, route=self.route)
+        METRIC_SPARK_OUTPUT_CHARS.observe(self.output_chars, route=self.route)
+        if self.error_code:
+            METRIC_SPARK_ERRORS.inc(route=self.route, code=self.error_code)
+        if self.usage:
+            usage_ledger.record(self.route, user_id_var.get(), self.usage)
+        if succeeded:
+            spark_timeouts.observe(self.route, time.monotonic() - self.started_at, self.max_gap)
+        self.chunks.put(None)
+        self.event.set()
+
+    def _connect(self, messages, route):
+        """重置调用状态，并在后台线程中建立WebSocket连接"""
+        self.route = route
+        self.error_code = None
+        self.usage = None
+        self.started_at = time.monotonic()
+        self.last_frame_at = self.started_at
+        self.max_gap = 0.0
+        self.first_token_at = None
+        self.output_chars = 0
+        METRIC_SPARK_CALLS.inc(route=route)
+        METRIC_SPARK_INFLIGHT.inc(route=route)
 
-    def call_spark_api(self, messages):
-        """调用星火API（流式版本）"""
         self.messages = messages
-        self.answer = ""
+        self.parts = []
+        self.extractor = HtmlStreamExtractor()
         self.completed = False
+        self.succeeded = False
         self.event.clear()
-
+        self.chunks = queue.Queue()  # 增量内容队列，None表示结束
+
+        sock = spark_warmer.take(self.spark_url)
+        if sock is not None:
+            # 预热连接已完成握手，直接在其上发送请求
+            self.ws = sock
+            self.connect_source = "warm"
+            wst = threading.Thread(target=in_current_context(self._run_warm), args=(sock,))
+            wst.daemon = True
+            wst.start()
+            return
+
+        self.connect_source = "cold"
         ws_url = self.create_url()
 
         # 创建WebSocket连接 - 使用正确的回调绑定方式
@@ -188,27 +511,383 @@ class SparkWebSocket:
         )
 
         # 在新线程中运行WebSocket
-        wst = threading.Thread(target=self.ws.run_forever, kwargs={
+        wst = threading.Thread(target=in_current_context(self.ws.run_forever), kwargs={
             "sslopt": {"cert_reqs": ssl.CERT_NONE}
         })
         wst.daemon = True
         wst.start()
 
-        # 等待响应完成或超时
-        self.event.wait(timeout=60)  # 60秒超时
-
-        if not self.completed:
+    def _run_warm(self, sock):
+        """在预热连接上完成一次调用，回调顺序与 WebSocketApp.run_forever 相同"""
+        try:
+            self.on_open(sock)
+            while not self.completed:
+                message = sock.recv()
+                if not message:
+                    break  # 服务端关闭了连接
+                self.on_message(sock, message)
+        except Exception as e:
+            if not self.completed:
+                self.on_error(sock, e)
+        finally:
+            sock.close(timeout=1)
+            self.on_close(sock, None, None)
+
+    @property
+    def answer(self):
+        """本次调用收到的原始内容"""
+        with self.lock:
+            return "".join(self.parts)
+
+    @staticmethod
+    def clean_answer(answer):
+        """清理HTML内容：去掉首个'{'或'<'之前、最后一个'>'之后的说明文字"""
+        extractor = HtmlStreamExtractor()
+        extractor.feed(answer)
+        return extractor.value()
+
+    def _abort(self, reason):
+        """未完成时主动结束本次调用并关闭连接"""
+        if self.completed:
+            return
+        self.error_code = self.error_code or reason
+        self.ws.close()
+        self._finish()
+
+    def _cancel(self, ws):
+        """请求被取消：关闭仍在进行的连接（在取消方线程中执行）"""
+        if ws is self.ws:
+            logger.info("生成已取消，关闭星火连接")
+            self._abort("cancelled")
+
+    def _cancel_scope(self):
+        """本次调用期间响应当前上下文的取消标记"""
+        token = cancel_token_var.get()
+        if token is None:
+            return contextlib.nullcontext()
+        ws = self.ws
+        return token.on_cancel(lambda: self._cancel(ws))
+
+    def _limits(self, route, timeout):
+        """本次调用的 (截止时间, 帧间空闲超时)；未指定timeout时按阶段自适应"""
+        adaptive_timeout, idle_timeout = spark_timeouts.limits(route)
+        return self.started_at + (timeout or adaptive_timeout), idle_timeout
+
+    def _remaining(self, deadline, idle_timeout):
+        """还可以等待的秒数；总时长或帧间隔超限时结束本次调用并返回None"""
+        now = time.monotonic()
+        if now >= deadline:
             logger.warning("API call timed out")
-            self.ws.close()
+            self._abort("timeout")
+            return None
+        idle_deadline = self.last_frame_at + idle_timeout
+        if now >= idle_deadline:
+            logger.warning(f"API stream stalled: no frame for {idle_timeout:.1f}s")
+            self._abort("idle_timeout")
+            return None
+        return min(deadline, idle_deadline) - now
+
+    def call_spark_api(self, messages, timeout=None, route="unknown"):
+        """调用星火API（流式版本）"""
+        self._connect(messages, route)
+        deadline, idle_timeout = self._limits(route, timeout)
+
+        # 等待响应完成、超时、上游停滞或被取消
+        with self._cancel_scope():
+            while not self.completed:
+                remaining = self._remaining(deadline, idle_timeout)
+                if remaining is None:
+                    break
+                self.event.wait(timeout=remaining)
+
+        with self.lock:
+            return self.extractor.value()
+
+    def stream_spark_api(self, messages, timeout=None, route="unknown"):
+        """调用星火API，按到达顺序逐块产出增量内容（生成器）"""
+        self._connect(messages, route)
+        deadline, idle_timeout = self._limits(route, timeout)
+        try:
+            with self._cancel_scope():
+                while True:
+                    remaining = self._remaining(deadline, idle_timeout)
+                    if remaining is None:
+                        break
+                    try:
+                        chunk = self.chunks.get(timeout=remaining)
+                    except queue.Empty:
+                        continue
+                    if chunk is None:
+                        break
+                    yield chunk
+        finally:
+            # 调用方提前结束迭代时关闭连接
+            self._abort("aborted")
+
+
+class SparkConnectionWarmer:
+    """预热连接：后台线程保持 size 个已完成TLS握手和鉴权的WebSocket连接
+
+    星火API只在握手时校验URL签名，连接建立后即可直接发送请求。调用方用 take() 取走一个连接，
+    省去建连、TLS握手和签名的耗时；取走后后台线程随即补充。闲置超过 max_age（须在签名有效期内）
+    或已被服务端关闭的连接会被丢弃。
+
+    每个预热连接建立前从 quota 取得连接名额和速率令牌，闲置期间一直占用该名额：调用方取走连接时
+    已持有自己的名额，预热连接的名额随即归还；有调用在排队等待配额时不再补充，并通过 reclaim()
+    让出闲置的预热连接。
+    """
+
+    def __init__(self, client, size, max_age, connect_timeout=10, quota=None):
+        self.client = client  # 用于生成鉴权URL的 SparkWebSocket
+        self.size = size
+        self.max_age = max_age
+        self.connect_timeout = connect_timeout
+        self.quota = quota
+        self._ready = deque()  # (连接, 建立时间)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def _ensure_thread(self):
+        """首次取用时启动后台线程"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="spark-warmer", daemon=True)
+                self._thread.start()
+
+    def _usable(self, sock, created_at):
+        """连接仍可用：未超龄、未关闭，且没有待读的数据（服务端关闭连接时会先发来关闭帧）"""
+        if time.monotonic() - created_at > self.max_age or not sock.connected:
+            return False
+        try:
+            readable, _, _ = select.select([sock.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def _reserve(self):
+        """为新的预热连接占用配额，配额不足或有调用在排队时返回False"""
+        if self.quota is None:
+            return True
+        if self.quota.stats()["waiting"]:
+            return False
+        return self.quota.try_acquire() == 0
+
+    def _release(self):
+        if self.quota is not None:
+            self.quota.release()
+
+    def _discard(self, sock, result="stale"):
+        METRIC_SPARK_WARM.inc(result=result)
+        try:
+            sock.close(timeout=0)
+        except Exception:
+            pass
+        self._release()
+
+    def reclaim(self):
+        """上游配额用尽时关闭一个闲置的预热连接并归还其名额，返回是否归还了名额"""
+        with self._lock:
+            if not self._ready:
+                return False
+            sock, _ = self._ready.popleft()
+        self._discard(sock, "reclaimed")
+        return True
+
+    def take(self, spark_url):
+        """取出一个可用的预热连接；未启用、地址不同或暂无可用连接时返回None"""
+        if not self.enabled or spark_url != self.client.spark_url:
+            return None
+        self._ensure_thread()
+        try:
+            while True:
+                with self._lock:
+                    if not self._ready:
+                        break
+                    sock, created_at = self._ready.popleft()
+                if self._usable(sock, created_at):
+                    METRIC_SPARK_WARM.inc(result="hit")
+                    # 调用方已持有本次调用的配额，预热连接占用的名额归还
+                    self._release()
+                    return sock
+                self._discard(sock)
+            METRIC_SPARK_WARM.inc(result="miss")
+            return None
+        finally:
+            self._wakeup.set()
+
+    def _connect(self):
+        started_at = time.monotonic()
+        sock = websocket.create_connection(
+            self.client.create_url(),
+            timeout=self.connect_timeout,
+            sslopt={"cert_reqs": ssl.CERT_NONE}
+        )
+        sock.settimeout(None)
+        METRIC_SPARK_CONNECT.observe(time.monotonic() - started_at, route="warmer", source="warmer")
+        return sock
+
+    def _run(self):
+        while True:
+            with self._lock:
+                stale = [entry for entry in self._ready if not self._usable(*entry)]
+                for entry in stale:
+                    self._ready.remove(entry)
+            for sock, _ in stale:
+                self._discard(sock)
+            failed = False
+            while len(self._ready) < self.size:
+                if not self._reserve():
+                    failed = True  # 配额紧张，稍后再补充
+                    break
+                try:
+                    sock = self._connect()
+                except Exception as e:
+                    self._release()
+                    METRIC_SPARK_WARM.inc(result="failed")
+                    logger.warning(f"预热星火连接失败: {str(e)}")
+                    failed = True
+                    break
+                with self._lock:
+                    self._ready.append((sock, time.monotonic()))
+            METRIC_SPARK_WARM_READY.set(len(self._ready))
+            # 连接被取走时立即补充，否则定期检查是否超龄；建连失败后稍后再试
+            self._wakeup.wait(timeout=5 if failed else max(self.max_age / 4, 1))
+            self._wakeup.clear()
+            if failed:
+                time.sleep(1)
+
+
+class UsageLedger:
+    """星火API token用量：按阶段和用户累计（进程内）"""
+
+    FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_route = {}
+        self._by_user = {}
+
+    def _add(self, table, key, usage):
+        entry = table.setdefault(key, {"calls": 0, **{field: 0 for field in self.FIELDS}})
+        entry["calls"] += 1
+        for field in self.FIELDS:
+            entry[field] += int(usage.get(field) or 0)
+
+    def record(self, route, user, usage):
+        """记录一次调用返回的 usage.text"""
+        METRIC_SPARK_TOKENS.inc(int(usage.get("prompt_tokens") or 0), route=route, type="prompt")
+        METRIC_SPARK_TOKENS.inc(int(usage.get("completion_tokens") or 0), route=route, type="completion")
+        with self._lock:
+            self._add(self._by_route, route, usage)
+            self._add(self._by_user, user, usage)
+
+    def stats(self, user=None):
+        with self._lock:
+            if user is not None:
+                return {"user": user, **self._by_user.get(user, {"calls": 0, **{f: 0 for f in self.FIELDS}})}
+            return {
+                "routes": {key: dict(value) for key, value in self._by_route.items()},
+                "users": {key: dict(value) for key, value in self._by_user.items()}
+            }
+
+
+def spark_profile(route):
+    """阶段的生成参数（max_tokens、temperature、timeout）"""
+    return SPARK_PROFILES.get(route, SPARK_DEFAULT_PROFILE)
 
-        # 清理HTML内容
-        cleaned_content = re.sub(r'^[^{<]*', '', self.answer, flags=re.DOTALL)
-        cleaned_content = re.sub(r'[^>]*$', '', cleaned_content, flags=re.DOTALL)
 
-        return cleaned_content
+class AdaptiveTimeouts:
+    """按阶段记录最近成功调用的总耗时和最大帧间隔，以分位数乘系数作为后续调用的超时
 
-# 创建SparkWebSocket实例
-spark_ws = SparkWebSocket(APP_ID, API_KEY, API_SECRET, SPARK_URL)
+    卡住的连接按帧间隔提前结束；整体偏慢的阶段随样本自动放宽总超时，但不超过上限。
+    """
+
+    def __init__(self, window, min_samples, percentile, factor):
+        self.window = window
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.factor = factor
+        self._samples = {}  # route -> deque[(总耗时, 最大帧间隔)]
+        self._lock = threading.Lock()
+
+    def observe(self, route, duration, max_gap):
+        with self._lock:
+            samples = self._samples.setdefault(route, deque(maxlen=self.window))
+            samples.append((duration, max_gap))
+
+    def _quantile(self, values):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(self.percentile * len(values)))]
+
+    def limits(self, route):
+        """返回 (总超时, 帧间空闲超时) 秒数"""
+        with self._lock:
+            samples = list(self._samples.get(route, ()))
+        if len(samples) < self.min_samples:
+            timeout, idle_timeout = spark_profile(route)["timeout"], SPARK_IDLE_TIMEOUT
+        else:
+            timeout = self._quantile([duration for duration, _ in samples]) * self.factor
+            timeout = min(max(timeout, SPARK_TIMEOUT_MIN), SPARK_TIMEOUT_MAX)
+            idle_timeout = self._quantile([gap for _, gap in samples]) * self.factor
+            idle_timeout = min(max(idle_timeout, SPARK_IDLE_TIMEOUT_MIN), SPARK_IDLE_TIMEOUT)
+        METRIC_SPARK_TIMEOUT.set(round(timeout, 3), route=route, kind="total")
+        METRIC_SPARK_TIMEOUT.set(round(idle_timeout, 3), route=route, kind="idle")
+        return timeout, idle_timeout
+
+    def stats(self):
+        with self._lock:
+            routes = list(self._samples)
+        return {route: dict(zip(("timeout", "idle_timeout"), self.limits(route))) for route in routes}
+
+
+usage_ledger = UsageLedger()
+spark_timeouts = AdaptiveTimeouts(
+    SPARK_TIMEOUT_WINDOW, SPARK_TIMEOUT_MIN_SAMPLES, SPARK_TIMEOUT_PERCENTILE, SPARK_TIMEOUT_FACTOR)
+spark_quota = SparkQuota(SPARK_RATE_LIMIT, SPARK_RATE_BURST, SPARK_MAX_CONNECTIONS)
+spark_retry = RetryPolicy(SPARK_MAX_RETRIES, SPARK_RETRY_BASE_DELAY, SPARK_RETRY_MAX_DELAY)
+next_retry_delay = spark_retry.next_delay
+spark_breaker = CircuitBreaker(
+    urllib.parse.urlparse(SPARK_URL).netloc,
+    failure_threshold=SPARK_BREAKER_FAILURES,
+    reset_timeout=SPARK_BREAKER_RESET_TIMEOUT
+)
+
+
+# 生成结果缓存
+spark_cache = SparkResponseCache(
+    max_entries=SPARK_CACHE_MAX_ENTRIES,
+    ttl=SPARK_CACHE_TTL,
+    db_path=SPARK_CACHE_DB,
+    db_max_entries=SPARK_CACHE_DB_MAX_ENTRIES,
+    metric=METRIC_CACHE_LOOKUPS
+)
+
+# 预热连接（SPARK_WARM_CONNECTIONS为0时不启用）
+spark_warmer = SparkConnectionWarmer(
+    SparkWebSocket(APP_ID, API_KEY, API_SECRET, SPARK_URL),
+    size=SPARK_WARM_CONNECTIONS,
+    max_age=SPARK_WARM_MAX_AGE,
+    connect_timeout=SPARK_WARM_CONNECT_TIMEOUT,
+    quota=spark_quota
+)
+spark_quota.reclaim = spark_warmer.reclaim
+
+# 创建星火API会话池
+spark_pool = SparkSessionPool(
+    lambda: SparkWebSocket(APP_ID, API_KEY, API_SECRET, SPARK_URL),
+    size=SPARK_POOL_SIZE,
+    max_waiting=SPARK_POOL_MAX_WAITING,
+    acquire_timeout=SPARK_POOL_ACQUIRE_TIMEOUT,
+    cache=spark_cache,
+    breaker=spark_breaker,
+    quota=spark_quota,
+    retry=spark_retry
+)
 
 
 @app.route('/')
@@ -216,167 +895,678 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/generate_mindmap', methods=['POST'])
-def generate_mindmap():
-    try:
-        logger.info("收到思维导图生成请求")
+# ---------------------------------------------------------------------------
+# 各生成阶段的prompt构建
+# ---------------------------------------------------------------------------
+
+def build_mindmap_prompt(course_title, course_description, teaching_objectives):
+    """构建思维导图生成的prompt"""
+    mindmap_prompt = [
+        {
+            "role": "system",
+            "content": (
+                "你是一个专业的教育辅助AI，擅长生成课程思维导图。"
+                "请根据用户提供的信息生成课程思维导图的HTML代码。"
+                "输出格式要求："
+                "1. 只输出HTML代码，不要包含任何解释"
+                "2. 使用<div class='mindmap'>作为容器"
+                "3. 使用<h3>表示主要主题"
+                "4. 使用<ul>和<li>表示层级结构"
+                "5. 不要包含任何CSS或JavaScript"
+                "6. 思维导图应该包含以下部分: "
+                "   - 课程介绍"
+                "   - 教学目标"
+                "   - 核心概念"
+                "   - 关键知识点"
+                "   - 教学方法"
+                "   - 评估方式"
+            )
+        },
+        {"role": "user", "content": f"课程标题: {course_title}"}
+    ]
 
-        # 获取并验证JSON数据
-        data = request.get_json()
-        if not data:
-            logger.error("请求中缺少JSON数据")
-            return jsonify({"error": "请求中缺少JSON数据"}), 400
+    if course_description:
+        mindmap_prompt.append({"role": "user", "content": f"课程描述: {course_description}"})
+    if teaching_objectives:
+        mindmap_prompt.append({"role": "user", "content": f"教学目标: {teaching_objectives}"})
 
-        # 提取参数
-        course_title = data.get('course_title', '').strip()
-        course_description = data.get('course_description', '').strip()
-        teaching_objectives = data.get('teaching_objectives', '').strip()
+    # 添加格式示例
+    mindmap_prompt.append({
+        "role": "user",
+        "content": "示例格式：<div class='mindmap'><h3>主题1</h3><ul><li>子主题1.1</li></ul></div>"
+    })
+    return mindmap_prompt
+
+
+def build_teaching_flow_prompt(course_title, mindmap):
+    """构建教学流程生成的prompt"""
+    return [
+        {
+            "role": "system",
+            "content": (
+                "你是一个专业的教育设计师，擅长根据思维导图生成详细的教学流程。"
+                "请根据提供的思维导图生成教学流程的HTML代码。"
+                "输出格式要求："
+                "1. 只输出HTML代码，不要包含任何解释"
+                "2. 使用<div class='teaching-flow'>作为容器"
+                "3. 使用<h3>表示教学环节"
+                "4. 使用<p class='time'>表示时间分配"
+                "5. 使用<ul>表示教学活动"
+                "6. 使用<ol>表示教学资源需求"
+                "7. 不要包含任何CSS或JavaScript"
+                "8. 教学流程应该包含以下环节: "
+                "   - 导入环节"
+                "   - 知识讲解"
+                "   - 互动活动"
+                "   - 练习与实践"
+                "   - 总结与评价"
+            )
+        },
+        {"role": "user", "content": f"课程标题: {course_title}"},
+        {"role": "user", "content": f"思维导图内容：\n{mindmap}"},
+        {
+            "role": "user",
+            "content": "示例格式：<div class='teaching-flow'><h3>一、导入环节</h3><p class='time'>时间：5分钟</p><ul><li>活动1</li></ul><p>所需资源：</p><ol><li>资源1</li></ol></div>"
+        }
+    ]
 
-        logger.info(f"课程标题: '{course_title}'")
-        logger.info(f"课程描述: '{course_description[:50]}...'" if course_description else "无课程描述")
-        logger.info(f"教学目标: '{teaching_objectives[:50]}...'" if teaching_objectives else "无教学目标")
-
-        # 验证必要参数
-        if not course_title:
-            logger.error("课程标题不能为空")
-            return jsonify({"error": "课程标题不能为空"}), 400
-
-        # 构建思维导图生成的prompt
-        mindmap_prompt = [
-            {
-                "role": "system",
-                "content": (
-                    "你是一个专业的教育辅助AI，擅长生成课程思维导图。"
-                    "请根据用户提供的信息生成课程思维导图的HTML代码。"
-                    "输出格式要求："
-                    "1. 只输出HTML代码，不要包含任何解释"
-                    "2. 使用<div class='mindmap'>作为容器"
-                    "3. 使用<h3>表示主要主题"
-                    "4. 使用<ul>和<li>表示层级结构"
-                    "5. 不要包含任何CSS或JavaScript"
-                    "6. 思维导图应该包含以下部分: "
-                    "   - 课程介绍"
-                    "   - 教学目标"
-                    "   - 核心概念"
-                    "   - 关键知识点"
-                    "   - 教学方法"
-                    "   - 评估方式"
-                )
-            },
-            {"role": "user", "content": f"课程标题: {course_title}"}
-        ]
 
-        if course_description:
-            mindmap_prompt.append({"role": "user", "content": f"课程描述: {course_description}"})
-        if teaching_objectives:
-            mindmap_prompt.append({"role": "user", "content": f"教学目标: {teaching_objectives}"})
+def build_simulation_prompt(course_title, teaching_flow):
+    """构建问题模拟生成的prompt"""
+    return [
+        {
+            "role": "system",
+            "content": (
+                "你是一个经验丰富的教育分析师，擅长根据教学流程进行问题模拟与预期效果分析。"
+                "请根据提供的教学流程生成问题模拟的HTML代码。"
+                "输出格式要求："
+                "1. 只输出HTML代码，不要包含任何解释"
+                "2. 使用<div class='problem-simulation'>作为容器"
+                "3. 使用<h4>表示各部分标题"
+                "4. 使用<ul>表示列表内容"
+                "5. 使用<script id='chart-data'>包含雷达图数据"
+                "6. 不要包含任何CSS或JavaScript（除了雷达图数据）"
+                "7. 内容应包含以下部分: "
+                "   - 可能出现的问题及解决方案"
+                "   - 学生可能提出的疑问"
+                "   - 预期学习效果"
+                "   - 教学难点分析"
+            )
+        },
+        {"role": "user", "content": f"课程标题: {course_title}"},
+        {"role": "user", "content": f"教学流程内容：\n{teaching_flow}"},
+        {
+            "role": "user",
+            "content": "示例格式：<div class='problem-simulation'><h4>可能出现的问题</h4><ul><li>问题1</li></ul><h4>预期学习效果</h4><ul><li>效果1</li></ul><script id='chart-data'>{'labels':[...], 'datasets':[...]}</script></div>"
+        }
+    ]
+
 
-        # 添加格式示例
-        mindmap_prompt.append({
+def build_evaluation_prompt(course_title, simulation, source="问题模拟"):
+    """构建教学评价生成的prompt；source 为输入内容的名称（推测执行时以教学流程为输入）"""
+    return [
+        {
+            "role": "system",
+            "content": (
+                "你是一个资深教育评估专家，擅长对教学设计进行全面评价并提供优化建议。"
+                f"请根据提供的{source}生成评价的HTML代码。"
+                "输出格式要求："
+                "1. 只输出HTML代码，不要包含任何解释"
+                "2. 使用<div class='evaluation'>作为容器"
+                "3. 使用<h4>表示各部分标题"
+                "4. 使用<ul>表示列表内容"
+                "5. 使用<div id='rating-data'>包含评分数据"
+                "6. 不要包含任何CSS或JavaScript"
+                "7. 内容应包含以下部分: "
+                "   - 教学设计优点"
+                "   - 教学设计改进点"
+                "   - 整体评分（1-10分）"
+                "   - 具体优化建议"
+            )
+        },
+        {"role": "user", "content": f"课程标题: {course_title}"},
+        {"role": "user", "content": f"{source}内容：\n{simulation}"},
+        {
             "role": "user",
-            "content": "示例格式：<div class='mindmap'><h3>主题1</h3><ul><li>子主题1.1</li></ul></div>"
-        })
+            "content": "示例格式：<div class='evaluation'><h4>教学设计优点</h4><ul><li>优点1</li></ul><h4>教学设计改进点</h4><ul><li>改进点1</li></ul><div id='rating-data'>{'score': 4, 'description': '评价描述'}</div></div>"
+        }
+    ]
 
-        logger.info("调用星火API生成思维导图...")
-        mindmap = spark_ws.call_spark_api(mindmap_prompt)
 
-        if mindmap:
-            logger.info(f"成功生成思维导图，长度: {len(mindmap)}")
+def structured_prompt(stage, prompt):
+    """把prompt中的HTML输出要求替换为JSON输出要求，保留角色设定和输入内容"""
+    role, task, _ = prompt[0]["content"].split("。", 2)
+    system = {"role": "system", "content": f"{role}。{task.replace('HTML代码', 'JSON数据')}。{format_instructions(stage)}"}
+    example = {"role": "user", "content": format_example(stage)}
+    return [system, *prompt[1:-1], example]
+
+
+# ---------------------------------------------------------------------------
+# 教案存储：课程信息和四个阶段的生成结果按教案ID保存在SQLite中（PlanStore 见 plan_store.py）
+# ---------------------------------------------------------------------------
+
+plan_store = PlanStore(PLAN_STORE_DB, search_candidates=PLAN_SEARCH_CANDIDATES)
+
+
+# ---------------------------------------------------------------------------
+# 相似课程复用：课程信息相近的请求直接复用已有教案的思维导图，不再调用星火API
+# ---------------------------------------------------------------------------
+
+# 归一化时去掉的字符：标点、括号和空白
+_SIMILAR_STRIP_RE = re.compile(r'[\s\W_]+')
+
+
+class SimilarPlanIndex:
+    """相似课程索引
+
+    课程标题、描述和教学目标分别归一化后取1~3字的n-gram，哈希到定长向量（次线性词频），
+    查询时乘以IDF并按余弦相似度比较。只保留最近 max_entries 个教案，首次查询时从教案存储加载。
+    """
+
+    NGRAM_SIZES = (1, 2, 3)
+
+    def __init__(self, dim, max_entries, loader=None):
+        self.dim = dim
+        self.max_entries = max_entries
+        self._loader = loader
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._vectors = OrderedDict()  # plan_id -> 词频向量
+        self._df = np.zeros(dim, dtype=np.float32) if np is not None else None
+        self._matrix = None  # (plan_id列表, 归一化TF-IDF矩阵, idf)，新增条目后重建
+
+    @property
+    def enabled(self):
+        return np is not None and self.max_entries > 0
+
+    @staticmethod
+    def plan_text(fields):
+        return [fields.get(key) or '' for key in PLAN_META_FIELDS]
+
+    def _vectorize(self, parts):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for part in parts:
+            text = _SIMILAR_STRIP_RE.sub('', part.lower())
+            for size in self.NGRAM_SIZES:
+                for i in range(len(text) - size + 1):
+                    vector[zlib.crc32(text[i:i + size].encode('utf-8')) % self.dim] += 1
+        nonzero = vector > 0
+        vector[nonzero] = 1 + np.log(vector[nonzero])
+        return vector
+
+    def _ensure_loaded(self):
+        """首次使用时加载最近的教案（调用方需持有锁）"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if self._loader is not None:
+            for plan in self._loader(self.max_entries):
+                self._add(plan["id"], self._vectorize(self.plan_text(plan)))
+            logger.info(f"相似课程索引已加载 {len(self._vectors)} 个教案")
+
+    def _add(self, plan_id, vector):
+        """写入向量并淘汰最旧的条目（调用方需持有锁）"""
+        old = self._vectors.pop(plan_id, None)
+        if old is not None:
+            self._df -= old > 0
+        self._vectors[plan_id] = vector
+        self._df += vector > 0
+        while len(self._vectors) > self.max_entries:
+            _, evicted = self._vectors.popitem(last=False)
+            self._df -= evicted > 0
+        self._matrix = None
+
+    def add(self, plan_id, fields):
+        """索引一个教案的课程信息"""
+        if not self.enabled:
+            return
+        vector = self._vectorize(self.plan_text(fields))
+        with self._lock:
+            self._ensure_loaded()
+            self._add(plan_id, vector)
+
+    def search(self, fields, threshold, limit=3):
+        """返回相似度不低于阈值的 [(plan_id, 相似度)]，按相似度降序"""
+        if not self.enabled:
+            return []
+        query = self._vectorize(self.plan_text(fields))
+        with self._lock:
+            self._ensure_loaded()
+            if not self._vectors:
+                return []
+            if self._matrix is None:
+                idf = np.log((1 + len(self._vectors)) / (1 + self._df)) + 1
+                matrix = np.stack(list(self._vectors.values())) * idf
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                self._matrix = (list(self._vectors), matrix, idf)
+            plan_ids, matrix, idf = self._matrix
+
+        query *= idf
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        scores = matrix @ (query / norm)
+        best = np.argsort(scores)[::-1][:limit]
+        return [(plan_ids[i], float(scores[i])) for i in best if scores[i] >= threshold]
+
+
+similar_index = SimilarPlanIndex(SIMILAR_PLAN_DIM, SIMILAR_PLAN_MAX_ENTRIES, loader=plan_store.recent)
+if np is None:
+    logger.info("未安装numpy，相似课程复用已关闭")
+
+
+# ---------------------------------------------------------------------------
+# 生成阶段：请求解析、调用与结果校验
+# ---------------------------------------------------------------------------
+
+def compact_stage_input(stage, html):
+    """压缩下游阶段的输入，返回 (大纲文本, 附加返回字段)；附加字段报告压缩前后的估算token数"""
+    before = estimate_tokens(html)
+    text = compact_outline(html, STAGE_INPUT_MAX_TOKENS) if STAGE_INPUT_COMPACT else html
+    after = estimate_tokens(text) if STAGE_INPUT_COMPACT else before
+    METRIC_STAGE_INPUT_TOKENS.inc(before, route=stage, kind="raw")
+    METRIC_STAGE_INPUT_TOKENS.inc(after, route=stage, kind="compact")
+    logger.info(f"{GENERATION_STAGES[stage]['name']}输入: 约 {before} tokens -> {after} tokens")
+    return text, {"input_tokens": {"before": before, "after": after}}
+
+
+def prepare_mindmap(data):
+    """解析思维导图请求，返回 (prompt, 附加返回字段)"""
+    course_title = data.get('course_title', '').strip()
+    course_description = data.get('course_description', '').strip()
+    teaching_objectives = data.get('teaching_objectives', '').strip()
+
+    logger.info(f"课程标题: '{course_title}'")
+    logger.info(f"课程描述: '{course_description[:50]}...'" if course_description else "无课程描述")
+    logger.info(f"教学目标: '{teaching_objectives[:50]}...'" if teaching_objectives else "无教学目标")
+
+    # 验证必要参数
+    if not course_title:
+        logger.error("课程标题不能为空")
+        raise GenerationError("课程标题不能为空", 400)
+
+    prompt = build_mindmap_prompt(course_title, course_description, teaching_objectives)
+    return prompt, {
+        "course_title": course_title,
+        "course_description": course_description,
+        "teaching_objectives": teaching_objectives
+    }
+
+
+def prepare_teaching_flow(data):
+    """解析教学流程请求，返回 (prompt, 附加返回字段)"""
+    mindmap = data.get('mindmap', '').strip()
+    course_title = data.get('course_title', '课程').strip()
+
+    logger.info(f"课程标题: '{course_title}'")
+    logger.info(f"思维导图长度: {len(mindmap)}")
+
+    if not mindmap:
+        logger.error("思维导图内容不能为空")
+        raise GenerationError("请先生成思维导图", 400)
+
+    outline, extra = compact_stage_input("teaching_flow", mindmap)
+    return build_teaching_flow_prompt(course_title, outline), extra
+
+
+def prepare_simulation(data):
+    """解析问题模拟请求，返回 (prompt, 附加返回字段)"""
+    teaching_flow = data.get('teaching_flow', '').strip()
+    course_title = data.get('course_title', '课程').strip()
+
+    logger.info(f"课程标题: '{course_title}'")
+    logger.info(f"教学流程长度: {len(teaching_flow)}")
+
+    if not teaching_flow:
+        logger.error("教学流程内容不能为空")
+        raise GenerationError("请先生成教学流程", 400)
+
+    outline, extra = compact_stage_input("problem_simulation", teaching_flow)
+    return build_simulation_prompt(course_title, outline), extra
+
+
+def prepare_evaluation(data):
+    """解析教学评价请求，返回 (prompt, 附加返回字段)
+
+    speculative 为真时以教学流程为输入（完整教案推测执行，与问题模拟并发生成）。
+    """
+    simulation = data.get('simulation', '').strip()
+    course_title = data.get('course_title', '课程').strip()
+
+    logger.info(f"课程标题: '{course_title}'")
+    teaching_flow = data.get('teaching_flow', '').strip() if data.get('speculative') else ''
+    if teaching_flow:
+        logger.info(f"推测执行，教学流程长度: {len(teaching_flow)}")
+        outline, extra = compact_stage_input("evaluation", teaching_flow)
+        return build_evaluation_prompt(course_title, outline, source="教学流程"), {**extra, "speculative": True}
+
+    logger.info(f"问题模拟长度: {len(simulation)}")
+
+    if not simulation:
+        logger.error("问题模拟内容不能为空")
+        raise GenerationError("请先生成问题模拟", 400)
+
+    outline, extra = compact_stage_input("evaluation", simulation)
+    return build_evaluation_prompt(course_title, outline), extra
+
+
+def validate_mindmap(mindmap):
+    """验证思维导图HTML格式"""
+    if mindmap.startswith('<div') and mindmap.endswith('</div>'):
+        logger.info("思维导图格式验证通过")
+        return
+    logger.warning(f"无效的思维导图格式: {mindmap[:100]}...")
+    raise GenerationError(
+        "AI返回了无效的思维导图格式",
+        content=mindmap[:500] + "..." if len(mindmap) > 500 else mindmap
+    )
+
+
+# 生成阶段定义：name用于日志和提示，result_key为返回结果字段名；
+# inputs 为完整教案中依赖的上游阶段，speculative_inputs 为推测执行时改用的上游阶段
+GENERATION_STAGES = {
+    "mindmap": {
+        "name": "思维导图",
+        "result_key": "mindmap",
+        "prepare": prepare_mindmap,
+        "validate": validate_mindmap,
+        "inputs": ()
+    },
+    "teaching_flow": {
+        "name": "教学流程",
+        "result_key": "teaching_flow",
+        "prepare": prepare_teaching_flow,
+        "validate": None,
+        "inputs": ("mindmap",)
+    },
+    "problem_simulation": {
+        "name": "问题模拟",
+        "result_key": "simulation",
+        "prepare": prepare_simulation,
+        "validate": None,
+        "inputs": ("teaching_flow",)
+    },
+    "evaluation": {
+        "name": "教学评价",
+        "result_key": "evaluation",
+        "prepare": prepare_evaluation,
+        "validate": None,
+        "inputs": ("problem_simulation",),
+        "speculative_inputs": ("teaching_flow",)
+    }
+}
+
+
+def resolve_output_format(data):
+    """请求使用的生成结果格式，未指定时使用 SPARK_OUTPUT_FORMAT"""
+    output_format = str(data.get('output_format') or SPARK_OUTPUT_FORMAT).lower()
+    if output_format not in OUTPUT_FORMATS:
+        logger.error(f"不支持的输出格式: {output_format}")
+        raise GenerationError(f"不支持的输出格式: {output_format}", 400)
+    return output_format
+
+
+def prepare_stage(stage, data):
+    """解析生成请求，返回 (prompt, 附加返回字段)
+
+    请求带 plan_id 时，未提供的输入从该教案中读取，生成结果会写回教案。
+    """
+    spec = GENERATION_STAGES[stage]
+    output_format = resolve_output_format(data)
+    plan_id = data.get('plan_id')
+    if not plan_id:
+        prompt, extra = spec["prepare"](data)
+    else:
+        plan = plan_store.get(plan_id)
+        if plan is None:
+            logger.error(f"教案不存在: {plan_id}")
+            raise GenerationError("教案不存在", 404)
+        provided = {key: value for key, value in data.items() if value not in (None, '')}
+        prompt, extra = spec["prepare"]({**{key: plan[key] or '' for key in PLAN_FIELDS}, **provided})
+        extra = {**extra, "plan_id": plan_id}
+    if output_format == "json":
+        prompt = structured_prompt(stage, prompt)
+    return prompt, extra
+
+
+def save_plan_stage(stage, payload):
+    """把阶段结果写入教案；思维导图阶段未指定教案时新建一份，并在结果中返回 plan_id"""
+    spec = GENERATION_STAGES[stage]
+    try:
+        plan_id = payload.get("plan_id")
+        if plan_id:
+            fields = {key: value for key, value in payload.items() if key in PLAN_FIELDS}
+            if not plan_store.update(plan_id, **fields):
+                logger.warning(f"教案已删除，{spec['name']}结果未保存: {plan_id}")
+        elif stage == "mindmap":
+            payload["plan_id"] = plan_store.create(**payload)["id"]
+            logger.info(f"已创建教案: {payload['plan_id']}")
+        if stage == "mindmap" and "similar_plan" not in payload:
+            similar_index.add(payload["plan_id"], payload)
+    except sqlite3.Error as e:
+        # 存储失败不影响本次生成结果的返回
+        logger.exception(f"保存{spec['name']}到教案时发生异常: {str(e)}")
+
+
+def find_similar_result(stage, data, extra):
+    """思维导图阶段先查找课程信息相近的已有教案
+
+    找到时返回 (思维导图, 附加返回字段)，附加字段中的 similar_plan 标明复用来源；
+    没有可复用的教案或请求指定 no_cache 时返回None。
+    """
+    if stage != "mindmap" or data.get('no_cache') or not similar_index.enabled:
+        return None
+    for plan_id, score in similar_index.search(extra, SIMILAR_PLAN_THRESHOLD):
+        if plan_id == extra.get("plan_id"):
+            continue
+        plan = plan_store.get(plan_id)
+        if plan and plan["mindmap"]:
+            METRIC_SIMILAR_LOOKUPS.inc(result="hit")
+            logger.info(f"复用相似教案《{plan['course_title']}》的思维导图，相似度 {score:.3f}")
+            similar = {"plan_id": plan_id, "course_title": plan["course_title"], "similarity": round(score, 4)}
+            return plan["mindmap"], {**extra, "similar_plan": similar}
+    METRIC_SIMILAR_LOOKUPS.inc(result="miss")
+    return None
+
+
+def finish_stage(stage, result, extra):
+    """校验生成结果并组装返回数据"""
+    spec = GENERATION_STAGES[stage]
+    if not result:
+        logger.error(f"生成{spec['name']}失败")
+        raise GenerationError(f"生成{spec['name']}失败，请重试")
+
+    logger.info(f"成功生成{spec['name']}，长度: {len(result)}")
+    if spec["validate"]:
+        spec["validate"](result)
+    payload = {spec["result_key"]: result, **extra}
+    try:
+        # 雷达图/评分数据解析为严格JSON单独返回，前端无需再从HTML中解析
+        payload.update(embedded_data(stage, result, extra.get("structured")))
+    except StructuredOutputError as e:
+        logger.warning(f"{spec['name']}内嵌数据解析失败: {str(e)}")
+        payload[EMBEDDED_DATA[stage][3]] = None
+    save_plan_stage(stage, payload)
+    return payload
 
-            # 验证HTML格式
-            if mindmap.startswith('<div') and mindmap.endswith('</div>'):
-                logger.info("思维导图格式验证通过")
-                return jsonify({
-                    "mindmap": mindmap,
-                    "course_title": course_title,
-                    "course_description": course_description,
-                    "teaching_objectives": teaching_objectives
-                })
-            else:
-                logger.warning(f"无效的思维导图格式: {mindmap[:100]}...")
-                return jsonify({
-                    "error": "AI返回了无效的思维导图格式",
-                    "content": mindmap[:500] + "..." if len(mindmap) > 500 else mindmap
-                }), 500
+
+def generate_stage(stage, data):
+    """阻塞式执行一个生成阶段，返回结果字典；失败时抛出GenerationError"""
+    try:
+        output_format = resolve_output_format(data)
+    except GenerationError as e:
+        METRIC_GENERATION_REQUESTS.inc(route=stage, status=e.status)
+        raise
+    if output_format == "json":
+        # 结构化输出需要边接收边校验，复用流式流程（请求数由 stream_stage 记录）
+        for event, payload in stream_stage(stage, data):
+            if event == "done":
+                return payload
+    spec = GENERATION_STAGES[stage]
+    try:
+        prompt, extra = prepare_stage(stage, data)
+
+        reused = find_similar_result(stage, data, extra)
+        if reused is not None:
+            result, extra = reused
         else:
-            logger.error("生成思维导图失败")
-            return jsonify({"error": "生成思维导图失败，请重试"}), 500
+            logger.info(f"调用星火API生成{spec['name']}...")
+            try:
+                result = spark_pool.call_spark_api(prompt, use_cache=not data.get('no_cache'), route=stage)
+            except SparkUnavailableError as e:
+                logger.warning(f"生成{spec['name']}失败: {str(e)}")
+                raise GenerationError(str(e), e.status)
+        payload = finish_stage(stage, result, extra)
+    except GenerationError as e:
+        METRIC_GENERATION_REQUESTS.inc(route=stage, status=e.status)
+        raise
+    METRIC_GENERATION_REQUESTS.inc(route=stage, status=200)
+    return payload
+
+
+def stream_structured(stage, prompt, data):
+    """结构化输出模式：边接收边校验JSON，产出 ("chunk", 渲染好的HTML片段)，返回 (HTML, JSON结果)
+
+    输出一旦不符合格式立即中断本次调用，不再等待剩余内容。
+    """
+    spec = GENERATION_STAGES[stage]
+    logger.info(f"流式调用星火API生成{spec['name']}（JSON）...")
+    stream = StructuredStream(stage)
+    emitted = []
+    chunks = spark_pool.stream_spark_api(prompt, use_cache=not data.get('no_cache'), route=stage, raw=True)
+    try:
+        for chunk in chunks:
+            content = stream.feed(chunk)
+            if content:
+                emitted.append(content)
+                yield "chunk", content
+        result, structured = stream.finish()
+    except SparkUnavailableError as e:
+        logger.warning(f"生成{spec['name']}失败: {str(e)}")
+        raise GenerationError(str(e), e.status)
+    except StructuredOutputError as e:
+        METRIC_STRUCTURED_OUTPUT_ERRORS.inc(route=stage)
+        answer = "".join(stream.raw)
+        logger.warning(f"{spec['name']}JSON格式错误: {str(e)}")
+        raise GenerationError(
+            f"AI返回了无效的{spec['name']}格式",
+            details=str(e),
+            content=answer[:500] + "..." if len(answer) > 500 else answer
+        )
+    finally:
+        chunks.close()
+    # 列表之后的部分（雷达图、评分数据）和容器结束标签
+    tail = result[len("".join(emitted)):]
+    if tail:
+        yield "chunk", tail
+    return result, structured
 
-    except Exception as e:
-        logger.exception(f"生成思维导图时发生异常: {str(e)}\n{traceback.format_exc()}")
-        return jsonify({
-            "error": "服务器内部错误",
-            "details": str(e),
-            "traceback": traceback.format_exc()
-        }), 500
 
+def stream_stage(stage, data):
+    """流式执行一个生成阶段
 
-@app.route('/generate_teaching_flow', methods=['POST'])
-def generate_teaching_flow():
+    依次产出 ("chunk", 增量文本)，最后产出 ("done", 结果字典)；失败时抛出GenerationError。
+    """
+    spec = GENERATION_STAGES[stage]
     try:
-        logger.info("收到教学流程生成请求")
+        prompt, extra = prepare_stage(stage, data)
+
+        reused = find_similar_result(stage, data, extra)
+        if reused is not None:
+            result, extra = reused
+            yield "chunk", result
+        elif resolve_output_format(data) == "json":
+            result, structured = yield from stream_structured(stage, prompt, data)
+            extra = {**extra, "structured": structured}
+        else:
+            logger.info(f"流式调用星火API生成{spec['name']}...")
+            extractor = HtmlStreamExtractor()
+            try:
+                for chunk in spark_pool.stream_spark_api(prompt, use_cache=not data.get('no_cache'), route=stage):
+                    # 只推送已确认的HTML内容，首尾的说明文字不会发给前端
+                    content = extractor.feed(chunk)
+                    if content:
+                        yield "chunk", content
+            except SparkUnavailableError as e:
+                logger.warning(f"生成{spec['name']}失败: {str(e)}")
+                raise GenerationError(str(e), e.status)
+            result = extractor.value()
+        payload = finish_stage(stage, result, extra)
+    except GenerationError as e:
+        METRIC_GENERATION_REQUESTS.inc(route=stage, status=e.status)
+        raise
+    METRIC_GENERATION_REQUESTS.inc(route=stage, status=200)
+    yield "done", payload
+
+
+def sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(produce):
+    """在后台线程执行 produce(emit)，以SSE推送其 emit(event, payload) 的事件
+
+    上游暂无输出时定期发送心跳注释，写入失败即可发现客户端已断开；断开后取消本次生成，
+    关闭仍在进行的星火连接并归还会话。
+    """
+    token = CancelToken()
+    events = queue.Queue()
+
+    def worker():
+        cancel_token_var.set(token)
+        try:
+            produce(lambda event, payload: events.put((event, payload)))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=in_current_context(worker), daemon=True).start()
+
+    def stream():
+        finished = False
+        try:
+            while True:
+                try:
+                    item = events.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is None:
+                    finished = True
+                    return
+                yield sse_event(*item)
+        finally:
+            if not finished and token.cancel("disconnect"):
+                logger.info("客户端已断开，取消生成")
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 禁止反向代理缓冲
+    return response
+
+
+def _generate_response(stage):
+    """阻塞式生成路由的通用处理"""
+    spec = GENERATION_STAGES[stage]
+    try:
+        logger.info(f"收到{spec['name']}生成请求")
 
         # 获取并验证JSON数据
-        data = request.get_json()
+        data = request.get_json(silent=True)
         if not data:
             logger.error("请求中缺少JSON数据")
             return jsonify({"error": "请求中缺少JSON数据"}), 400
+        if not isinstance(data, dict):
+            logger.error(f"请求体不是JSON对象: {type(data).__name__}")
+            return jsonify({"error": "请求体必须是JSON对象"}), 400
 
-        # 提取参数
-        mindmap = data.get('mindmap', '').strip()
-        course_title = data.get('course_title', '课程').strip()
+        return jsonify(generate_stage(stage, data))
 
-        logger.info(f"课程标题: '{course_title}'")
-        logger.info(f"思维导图长度: {len(mindmap)}")
-
-        # 验证必要参数
-        if not mindmap:
-            logger.error("思维导图内容不能为空")
-            return jsonify({"error": "请先生成思维导图"}), 400
-
-        # 构建教学流程生成的prompt
-        flow_prompt = [
-            {
-                "role": "system",
-                "content": (
-                    "你是一个专业的教育设计师，擅长根据思维导图生成详细的教学流程。"
-                    "请根据提供的思维导图生成教学流程的HTML代码。"
-                    "输出格式要求："
-                    "1. 只输出HTML代码，不要包含任何解释"
-                    "2. 使用<div class='teaching-flow'>作为容器"
-                    "3. 使用<h3>表示教学环节"
-                    "4. 使用<p class='time'>表示时间分配"
-                    "5. 使用<ul>表示教学活动"
-                    "6. 使用<ol>表示教学资源需求"
-                    "7. 不要包含任何CSS或JavaScript"
-                    "8. 教学流程应该包含以下环节: "
-                    "   - 导入环节"
-                    "   - 知识讲解"
-                    "   - 互动活动"
-                    "   - 练习与实践"
-                    "   - 总结与评价"
-                )
-            },
-            {"role": "user", "content": f"课程标题: {course_title}"},
-            {"role": "user", "content": f"思维导图内容：\n{mindmap}"},
-            {
-                "role": "user",
-                "content": "示例格式：<div class='teaching-flow'><h3>一、导入环节</h3><p class='time'>时间：5分钟</p><ul><li>活动1</li></ul><p>所需资源：</p><ol><li>资源1</li></ol></div>"
-            }
-        ]
-
-        logger.info("调用星火API生成教学流程...")
-        teaching_flow = spark_ws.call_spark_api(flow_prompt)
-
-        if teaching_flow:
-            logger.info(f"成功生成教学流程，长度: {len(teaching_flow)}")
-            return jsonify({"teaching_flow": teaching_flow})
-        else:
-            logger.error("生成教学流程失败")
-            return jsonify({"error": "生成教学流程失败，请重试"}), 500
+    except GenerationError as e:
+        return jsonify(e.to_dict()), e.status
 
     except Exception as e:
-        logger.exception(f"生成教学流程时发生异常: {str(e)}\n{traceback.format_exc()}")
+        logger.exception(f"生成{spec['name']}时发生异常: {str(e)}\n{traceback.format_exc()}")
         return jsonify({
             "error": "服务器内部错误",
             "details": str(e),
@@ -384,156 +1574,999 @@ def generate_teaching_flow():
         }), 500
 
 
-@app.route('/generate_problem_simulation', methods=['POST'])
-def generate_problem_simulation():
-    try:
-        logger.info("收到问题模拟生成请求")
+def _generate_stream_response(stage):
+    """流式生成路由的通用处理：以SSE逐块推送 chunk 事件，结束时推送 done 或 error 事件"""
+    spec = GENERATION_STAGES[stage]
+    logger.info(f"收到{spec['name']}流式生成请求")
 
-        # 获取并验证JSON数据
-        data = request.get_json()
-        if not data:
-            logger.error("请求中缺少JSON数据")
-            return jsonify({"error": "请求中缺少JSON数据"}), 400
+    data = request.get_json(silent=True)
+    if not data:
+        logger.error("请求中缺少JSON数据")
+        return jsonify({"error": "请求中缺少JSON数据"}), 400
+    if not isinstance(data, dict):
+        logger.error(f"请求体不是JSON对象: {type(data).__name__}")
+        return jsonify({"error": "请求体必须是JSON对象"}), 400
 
-        # 提取参数
-        teaching_flow = data.get('teaching_flow', '').strip()
-        course_title = data.get('course_title', '课程').strip()
+    def produce(emit):
+        try:
+            for event, payload in stream_stage(stage, data):
+                if event == "chunk":
+                    emit("chunk", {"content": payload})
+                else:
+                    emit("done", payload)
+        except GenerationError as e:
+            emit("error", {**e.to_dict(), "status": e.status})
+        except Exception as e:
+            logger.exception(f"流式生成{spec['name']}时发生异常: {str(e)}")
+            emit("error", {"error": "服务器内部错误", "details": str(e), "status": 500})
 
-        logger.info(f"课程标题: '{course_title}'")
-        logger.info(f"教学流程长度: {len(teaching_flow)}")
+    return sse_response(produce)
 
-        # 验证必要参数
-        if not teaching_flow:
-            logger.error("教学流程内容不能为空")
-            return jsonify({"error": "请先生成教学流程"}), 400
-
-        # 构建问题模拟生成的prompt
-        simulation_prompt = [
-            {
-                "role": "system",
-                "content": (
-                    "你是一个经验丰富的教育分析师，擅长根据教学流程进行问题模拟与预期效果分析。"
-                    "请根据提供的教学流程生成问题模拟的HTML代码。"
-                    "输出格式要求："
-                    "1. 只输出HTML代码，不要包含任何解释"
-                    "2. 使用<div class='problem-simulation'>作为容器"
-                    "3. 使用<h4>表示各部分标题"
-                    "4. 使用<ul>表示列表内容"
-                    "5. 使用<script id='chart-data'>包含雷达图数据"
-                    "6. 不要包含任何CSS或JavaScript（除了雷达图数据）"
-                    "7. 内容应包含以下部分: "
-                    "   - 可能出现的问题及解决方案"
-                    "   - 学生可能提出的疑问"
-                    "   - 预期学习效果"
-                    "   - 教学难点分析"
-                )
-            },
-            {"role": "user", "content": f"课程标题: {course_title}"},
-            {"role": "user", "content": f"教学流程内容：\n{teaching_flow}"},
-            {
-                "role": "user",
-                "content": "示例格式：<div class='problem-simulation'><h4>可能出现的问题</h4><ul><li>问题1</li></ul><h4>预期学习效果</h4><ul><li>效果1</li></ul><script id='chart-data'>{'labels':[...], 'datasets':[...]}</script></div>"
-            }
-        ]
 
-        logger.info("调用星火API生成问题模拟...")
-        simulation = spark_ws.call_spark_api(simulation_prompt)
+@app.route('/generate_mindmap', methods=['POST'])
+def generate_mindmap():
+    return _generate_response("mindmap")
 
-        if simulation:
-            logger.info(f"成功生成问题模拟，长度: {len(simulation)}")
-            return jsonify({"simulation": simulation})
-        else:
-            logger.error("生成问题模拟失败")
-            return jsonify({"error": "生成问题模拟失败，请重试"}), 500
 
-    except Exception as e:
-        logger.exception(f"生成问题模拟时发生异常: {str(e)}\n{traceback.format_exc()}")
-        return jsonify({
-            "error": "服务器内部错误",
-            "details": str(e),
-            "traceback": traceback.format_exc()
-        }), 500
+@app.route('/generate_mindmap/stream', methods=['POST'])
+def generate_mindmap_stream():
+    return _generate_stream_response("mindmap")
+
+
+@app.route('/generate_teaching_flow', methods=['POST'])
+def generate_teaching_flow():
+    return _generate_response("teaching_flow")
+
+
+@app.route('/generate_teaching_flow/stream', methods=['POST'])
+def generate_teaching_flow_stream():
+    return _generate_stream_response("teaching_flow")
+
+
+@app.route('/generate_problem_simulation', methods=['POST'])
+def generate_problem_simulation():
+    return _generate_response("problem_simulation")
+
+
+@app.route('/generate_problem_simulation/stream', methods=['POST'])
+def generate_problem_simulation_stream():
+    return _generate_stream_response("problem_simulation")
 
 
 @app.route('/generate_evaluation', methods=['POST'])
 def generate_evaluation():
+    return _generate_response("evaluation")
+
+
+@app.route('/generate_evaluation/stream', methods=['POST'])
+def generate_evaluation_stream():
+    return _generate_stream_response("evaluation")
+
+
+# ---------------------------------------------------------------------------
+# 完整教案流水线：服务端串联四个生成阶段
+# ---------------------------------------------------------------------------
+
+# 完整教案包含的阶段（按依赖的拓扑顺序排列），依赖关系见 GENERATION_STAGES 中的 inputs
+FULL_PLAN_STAGES = ["mindmap", "teaching_flow", "problem_simulation", "evaluation"]
+
+class _UpstreamFailed(Exception):
+    """上游阶段失败，本阶段未执行"""
+
+
+def full_plan_inputs(stage, speculative=False):
+    """阶段在完整教案中依赖的上游阶段"""
+    spec = GENERATION_STAGES[stage]
+    if speculative and spec.get("speculative_inputs"):
+        return spec["speculative_inputs"]
+    return spec["inputs"]
+
+
+def run_full_plan(data, emit, start_on_partial=False, speculative=False):
+    """按阶段依赖关系执行完整教案的各生成阶段，返回合并后的结果字典
+
+    每个阶段在独立线程中等待其上游阶段的输出，互不依赖的阶段并发调用星火API，
+    总耗时取决于依赖链最长的一条而不是各阶段之和。start_on_partial 为真时，上游阶段的容器元素
+    一闭合就把内容交给下游阶段，不再等待其结束标记；speculative 为真时阶段改用 speculative_inputs
+    （评价以教学流程为输入，与问题模拟并发生成）。进度通过 emit(event, payload) 推送：
+    stage_start / chunk / stage_done / error。任一阶段失败时抛出该阶段的GenerationError。
+
+    结果的顶层为 plan_id、speculative 和各阶段的结果字段（mindmap、teaching_flow 等），各阶段的其余
+    返回字段（input_tokens、similar_plan、structured、chart_data 等）保留在 stages[阶段] 下。
+    全部阶段结束后按 FULL_PLAN_STAGES 的顺序组装，结果与各阶段完成的先后无关。
+    """
+    # 先确定教案，各阶段（包括提前启动的下游阶段）都把结果写入同一份教案
+    plan_id = data.get('plan_id')
+    if plan_id:
+        plan = plan_store.get(plan_id)
+        if plan is None:
+            raise GenerationError("教案不存在", 404)
+        provided = {key: value for key, value in data.items() if value not in (None, '')}
+        data = {**{key: plan[key] for key in PLAN_META_FIELDS}, **provided}
+    elif data.get('course_title', '').strip():
+        plan_id = plan_store.create(**{key: data.get(key, '').strip() for key in PLAN_META_FIELDS})["id"]
+        data = {**data, "plan_id": plan_id}
+    course_title = data.get('course_title', '').strip()
+    handoffs = {stage: Future() for stage in FULL_PLAN_STAGES}
+    errors = {}
+    payloads = {}  # 阶段 -> 结果字典，每个线程只写入自己的阶段
+
+    def run(stage):
+        spec = GENERATION_STAGES[stage]
+        handoff = handoffs[stage]
+        inputs = full_plan_inputs(stage, speculative)
+        try:
+            if not inputs:
+                stage_data = data
+            else:
+                stage_data = {
+                    "course_title": course_title or '课程',
+                    "plan_id": plan_id,
+                    "no_cache": data.get('no_cache'),
+                    "output_format": data.get('output_format'),
+                    "speculative": inputs != spec["inputs"]
+                }
+                for upstream in inputs:
+                    try:
+                        stage_data[GENERATION_STAGES[upstream]["result_key"]] = handoffs[upstream].result()
+                    except Exception:
+                        raise _UpstreamFailed()
+
+            emit("stage_start", {"stage": stage})
+            extractor = HtmlStreamExtractor()
+            for event, payload in stream_stage(stage, stage_data):
+                if event == "chunk":
+                    emit("chunk", {"stage": stage, "content": payload})
+                    if start_on_partial and not handoff.done():
+                        extractor.feed(payload)
+                        if extractor.container_closed:
+                            logger.info(f"{spec['name']}容器已闭合，提前启动下游阶段")
+                            handoff.set_result(extractor.container())
+                else:
+                    payloads[stage] = payload
+                    if not handoff.done():
+                        handoff.set_result(payload[spec["result_key"]])
+                    emit("stage_done", {"stage": stage, **payload})
+        except _UpstreamFailed as e:
+            errors[stage] = e
+        except GenerationError as e:
+            errors[stage] = e
+            emit("error", {"stage": stage, **e.to_dict(), "status": e.status})
+        except Exception as e:
+            logger.exception(f"完整教案流水线执行{spec['name']}时发生异常: {str(e)}")
+            errors[stage] = GenerationError("服务器内部错误", details=str(e))
+            emit("error", {"stage": stage, **errors[stage].to_dict(), "status": 500})
+        finally:
+            if not handoff.done():
+                handoff.set_exception(errors.get(stage) or _UpstreamFailed())
+
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=in_current_context(run), args=(stage,), daemon=True)
+        for stage in FULL_PLAN_STAGES
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    METRIC_FULL_PLAN_DURATION.observe(time.monotonic() - started, mode="speculative" if speculative else "serial")
+
+    for stage in FULL_PLAN_STAGES:
+        if isinstance(errors.get(stage), GenerationError):
+            raise errors[stage]
+
+    results = {"plan_id": plan_id, "speculative": speculative, "stages": {}}
+    for stage in FULL_PLAN_STAGES:
+        result_key = GENERATION_STAGES[stage]["result_key"]
+        payload = payloads[stage]
+        results[result_key] = payload[result_key]
+        results["stages"][stage] = {key: value for key, value in payload.items() if key != result_key}
+    return results
+
+
+@app.route('/generate_full_plan', methods=['POST'])
+def generate_full_plan():
+    """一次请求生成完整教案：默认以SSE推送各阶段结果，stream=false时返回JSON"""
+    logger.info("收到完整教案生成请求")
+
+    data = request.get_json(silent=True)
+    if not data:
+        logger.error("请求中缺少JSON数据")
+        return jsonify({"error": "请求中缺少JSON数据"}), 400
+    if not data.get('course_title', '').strip() and not data.get('plan_id'):
+        logger.error("课程标题不能为空")
+        return jsonify({"error": "课程标题不能为空"}), 400
+    if data.get('plan_id') and plan_store.get(data['plan_id']) is None:
+        return jsonify({"error": "教案不存在"}), 404
+
+    start_on_partial = bool(data.get('start_on_partial', False))
+    speculative = bool(data.get('speculative', False))
+
+    if data.get('stream', True) is False:
+        try:
+            return jsonify(run_full_plan(data, lambda event, payload: None, start_on_partial, speculative))
+        except GenerationError as e:
+            return jsonify(e.to_dict()), e.status
+
+    include_chunks = bool(data.get('include_chunks', False))
+
+    def produce(emit):
+        def progress(event, payload):
+            if event != "chunk" or include_chunks:
+                emit(event, payload)
+
+        try:
+            emit("done", run_full_plan(data, progress, start_on_partial, speculative))
+        except GenerationError:
+            pass  # 错误事件已由对应阶段推送
+
+    return sse_response(produce)
+
+
+# ---------------------------------------------------------------------------
+# 异步任务队列：提交后立即返回任务ID，由后台工作线程执行生成（JobManager 见 jobs.py）
+# ---------------------------------------------------------------------------
+
+JOB_TYPES = list(GENERATION_STAGES) + ["full_plan"]
+
+
+def run_job(job_type, payload, on_progress):
+    """执行后台任务：完整教案按阶段推送进度，其余类型执行单个生成阶段"""
+    if job_type == "full_plan":
+        return run_full_plan(
+            payload, on_progress,
+            bool(payload.get('start_on_partial', False)), bool(payload.get('speculative', False))
+        )
+    return generate_stage(job_type, payload)
+
+
+job_manager = JobManager(
+    SQLiteJobStore(JOB_STORE_DB, JOB_RESULT_TTL) if JOB_STORE_DB else MemoryJobStore(JOB_RESULT_TTL),
+    workers=JOB_WORKERS,
+    queue_depth=JOB_QUEUE_DEPTH,
+    runner=run_job
+)
+
+
+def job_view(job):
+    """任务的对外表示（不回传提交时的请求数据）"""
+    return {key: value for key, value in job.items() if key != "payload"}
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """提交生成任务：type 为 mindmap / teaching_flow / problem_simulation / evaluation / full_plan"""
+    data = request.get_json(silent=True)
+    if not data:
+        logger.error("请求中缺少JSON数据")
+        return jsonify({"error": "请求中缺少JSON数据"}), 400
+
+    job_type = data.get('type', '')
+    if job_type not in JOB_TYPES:
+        return jsonify({"error": f"不支持的任务类型: {job_type}", "types": JOB_TYPES}), 400
+
     try:
-        logger.info("收到教学评价生成请求")
+        job = job_manager.submit(job_type, {**data, "user_id": user_id_var.get()})
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 503
 
-        # 获取并验证JSON数据
-        data = request.get_json()
-        if not data:
-            logger.error("请求中缺少JSON数据")
-            return jsonify({"error": "请求中缺少JSON数据"}), 400
+    return jsonify({
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+        "stream_url": f"/jobs/{job['id']}/stream",
+        "cancel_url": f"/jobs/{job['id']}/cancel"
+    }), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询任务状态和结果"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    return jsonify(job_view(job))
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消排队中或运行中的任务"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    if job["status"] in JOB_FINISHED_STATUSES:
+        return jsonify({"error": "任务已结束，无法取消", "status": job["status"]}), 409
+    if not job_manager.cancel(job_id):
+        return jsonify({"error": "任务不在当前进程中运行，无法取消", "status": job["status"]}), 409
+    return jsonify(job_view(job_manager.get(job_id))), 202
+
+
+@app.route('/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    """以SSE推送任务状态变化，任务结束后推送 done 或 error 事件"""
+    if job_manager.get(job_id) is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+
+    def events():
+        last = None
+        while True:
+            job = job_manager.get(job_id)
+            if job is None:
+                yield sse_event("error", {"error": "任务不存在或已过期", "status": 404})
+                return
+            state = (job["status"], len(job["progress"] or []))
+            if state != last:
+                last = state
+                yield sse_event("status", {"status": job["status"], "progress": job["progress"]})
+            if job["status"] == "succeeded":
+                yield sse_event("done", job["result"])
+                return
+            if job["status"] in ("failed", "cancelled"):
+                yield sse_event("error", job["error"])
+                return
+            job_manager.wait_for_change(timeout=1.0)
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# ---------------------------------------------------------------------------
+# 批量生成：导入整套课程，按并发上限和速率限制生成思维导图
+# ---------------------------------------------------------------------------
+
+def parse_course_rows(text, fmt=None):
+    """解析CSV或JSONL格式的课程列表，返回包含 course_title 等字段的字典列表
+
+    格式错误时抛出ValueError，JSONL的错误信息带行号。
+    """
+    if fmt is None:
+        fmt = "jsonl" if text.lstrip().startswith("{") else "csv"
+
+    if fmt == "jsonl":
+        rows = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"第{number}行不是有效的JSON: {str(e)}")
+            if not isinstance(row, dict):
+                raise ValueError(f"第{number}行不是JSON对象")
+            rows.append(row)
+    elif fmt == "csv":
+        rows = list(csv.DictReader(io.StringIO(text.lstrip('\ufeff'))))
+    else:
+        raise ValueError(f"不支持的文件格式: {fmt}")
+
+    return [
+        {
+            "course_title": (row.get('course_title') or '').strip(),
+            "course_description": (row.get('course_description') or '').strip(),
+            "teaching_objectives": (row.get('teaching_objectives') or '').strip()
+        }
+        for row in rows
+    ]
 
-        # 提取参数
-        simulation = data.get('simulation', '').strip()
-        course_title = data.get('course_title', '课程').strip()
 
-        logger.info(f"课程标题: '{course_title}'")
-        logger.info(f"问题模拟长度: {len(simulation)}")
+def run_batch(courses, on_result, concurrency=4, rate=BATCH_DEFAULT_RATE):
+    """并发生成一批课程的思维导图
+
+    最多 concurrency 个请求同时进行，每秒最多发起 rate 个；每完成一门课程即调用
+    on_result(记录)，记录按完成顺序产生，index 为其在输入中的位置。返回成功数。
+    当前上下文的取消标记触发后，尚未开始的课程不再生成，进行中的调用随之关闭。
+    """
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    limiter = TokenBucket(rate, burst=concurrency)
+    result_lock = threading.Lock()
+    succeeded = 0
+
+    def generate(index, course):
+        nonlocal succeeded
+        token = cancel_token_var.get()
+        if token is not None and token.cancelled:
+            return
+        limiter.acquire()
+        started = time.time()
+        record = {"index": index, "course_title": course["course_title"]}
+        try:
+            record.update(generate_stage("mindmap", course))
+            record["status"] = "ok"
+        except GenerationError as e:
+            record.update({"status": "error", **e.to_dict()})
+        except Exception as e:
+            logger.exception(f"批量生成第{index}门课程时发生异常: {str(e)}")
+            record.update({"status": "error", "error": "服务器内部错误", "details": str(e)})
+        record["elapsed"] = round(time.time() - started, 3)
+        with result_lock:
+            if record["status"] == "ok":
+                succeeded += 1
+            on_result(record)
+
+    logger.info(f"开始批量生成: {len(courses)} 门课程，并发 {concurrency}，速率 {rate}/秒")
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        for index, course in enumerate(courses):
+            executor.submit(in_current_context(generate), index, course)
+    logger.info(f"批量生成结束: 成功 {succeeded}/{len(courses)}")
+    return succeeded
+
+
+@app.route('/batch/generate_mindmap', methods=['POST'])
+def batch_generate_mindmap():
+    """批量生成思维导图：上传CSV/JSONL课程列表，按完成顺序以JSONL流式返回结果"""
+    logger.info("收到批量思维导图生成请求")
+
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8')
+        filename = upload.filename or ''
+    else:
+        text = request.get_data(as_text=True)
+        filename = ''
+
+    fmt = request.args.get('format')
+    if fmt is None and filename:
+        fmt = "jsonl" if filename.endswith(('.jsonl', '.ndjson')) else "csv" if filename.endswith('.csv') else None
 
-        # 验证必要参数
-        if not simulation:
-            logger.error("问题模拟内容不能为空")
-            return jsonify({"error": "请先生成问题模拟"}), 400
-
-        # 构建评价生成的prompt
-        evaluation_prompt = [
-            {
-                "role": "system",
-                "content": (
-                    "你是一个资深教育评估专家，擅长对教学设计进行全面评价并提供优化建议。"
-                    "请根据提供的问题模拟生成评价的HTML代码。"
-                    "输出格式要求："
-                    "1. 只输出HTML代码，不要包含任何解释"
-                    "2. 使用<div class='evaluation'>作为容器"
-                    "3. 使用<h4>表示各部分标题"
-                    "4. 使用<ul>表示列表内容"
-                    "5. 使用<div id='rating-data'>包含评分数据"
-                    "6. 不要包含任何CSS或JavaScript"
-                    "7. 内容应包含以下部分: "
-                    "   - 教学设计优点"
-                    "   - 教学设计改进点"
-                    "   - 整体评分（1-10分）"
-                    "   - 具体优化建议"
-                )
-            },
-            {"role": "user", "content": f"课程标题: {course_title}"},
-            {"role": "user", "content": f"问题模拟内容：\n{simulation}"},
-            {
-                "role": "user",
-                "content": "示例格式：<div class='evaluation'><h4>教学设计优点</h4><ul><li>优点1</li></ul><h4>教学设计改进点</h4><ul><li>改进点1</li></ul><div id='rating-data'>{'score': 4, 'description': '评价描述'}</div></div>"
-            }
-        ]
+    try:
+        courses = parse_course_rows(text, fmt)
+        concurrency = int(request.args.get('concurrency', 4))
+        rate = float(request.args.get('rate', BATCH_DEFAULT_RATE))
+    except (ValueError, csv.Error) as e:
+        logger.error(f"批量请求解析失败: {str(e)}")
+        return jsonify({"error": f"课程列表解析失败: {str(e)}"}), 400
+    if not courses:
+        return jsonify({"error": "课程列表为空"}), 400
+
+    token = CancelToken()
+    results = queue.Queue()
+
+    def worker():
+        cancel_token_var.set(token)
+        try:
+            run_batch(courses, results.put, concurrency=concurrency, rate=rate)
+        finally:
+            results.put(None)
 
-        logger.info("调用星火API生成教学评价...")
-        evaluation = spark_ws.call_spark_api(evaluation_prompt)
+    threading.Thread(target=in_current_context(worker), daemon=True).start()
 
-        if evaluation:
-            logger.info(f"成功生成教学评价，长度: {len(evaluation)}")
-            return jsonify({"evaluation": evaluation})
-        else:
-            logger.error("生成教学评价失败")
-            return jsonify({"error": "生成教学评价失败，请重试"}), 500
+    def stream():
+        # 写入结果失败即说明客户端已断开，取消剩余的课程
+        finished = False
+        try:
+            while True:
+                record = results.get()
+                if record is None:
+                    finished = True
+                    return
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        finally:
+            if not finished and token.cancel("disconnect"):
+                logger.info("客户端已断开，取消批量生成")
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus指标"""
+    pool_stats = spark_pool.stats()
+    METRIC_POOL_IN_USE.set(pool_stats["in_use"])
+    METRIC_POOL_WAITING.set(pool_stats["waiting"])
+    spark_timeouts.stats()  # 刷新各阶段当前超时的指标
+    signatures = signed_spark_url.cache_info()
+    METRIC_SPARK_URL_SIGNATURES.set(signatures.hits, result="hit")
+    METRIC_SPARK_URL_SIGNATURES.set(signatures.misses, result="miss")
+
+    response = make_response(metrics.render())
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+@app.route('/usage', methods=['GET'])
+def usage_stats():
+    """星火API token用量（按阶段和用户），传 user 参数只返回该用户的用量"""
+    user = request.args.get('user')
+    return jsonify({**usage_ledger.stats(user), "quota": spark_quota.stats()})
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """生成结果缓存统计"""
+    return jsonify(spark_cache.stats())
+
+
+@app.route('/cache', methods=['DELETE'])
+def clear_cache():
+    """清空生成结果缓存"""
+    spark_cache.clear()
+    logger.info("已清空生成结果缓存")
+    return jsonify({"status": "ok"})
+
+
+# ---------------------------------------------------------------------------
+# 导出文档模板：导入时切分为静态字节片段，导出时按片段流式输出
+# ---------------------------------------------------------------------------
+
+class ExportTemplate:
+    """预先切分的导出文档模板
+
+    模板在导入时按 {{name}} 占位符切分为静态字节片段，渲染时依次产出片段和转义后的值，
+    不必每次重新拼接整篇文档。{{raw:name}} 占位符不转义，用于AI生成的HTML。
+    """
+
+    _SLOT_RE = re.compile(r'\{\{\s*(raw:)?(\w+)\s*\}\}')
+
+    def __init__(self, source):
+        self.segments = []  # bytes 或 (占位符名, 是否原样输出)
+        position = 0
+        for match in self._SLOT_RE.finditer(source):
+            self.segments.append(source[position:match.start()].encode('utf-8'))
+            self.segments.append((match.group(2), bool(match.group(1))))
+            position = match.end()
+        self.segments.append(source[position:].encode('utf-8'))
+
+    def stream(self, **values):
+        """按顺序产出文档的字节片段"""
+        for segment in self.segments:
+            if isinstance(segment, bytes):
+                yield segment
+                continue
+            name, raw = segment
+            value = str(values[name])
+            yield (value if raw else html.escape(value)).encode('utf-8')
+
+    def render(self, **values):
+        return b"".join(self.stream(**values))
+
+
+MINDMAP_EXPORT_CSS = """
+body {
+    font-family: 'Microsoft YaHei', sans-serif;
+    padding: 20px;
+    max-width: 800px;
+    margin: 0 auto;
+    line-height: 1.6;
+    color: #333;
+}
+h1 {
+    color: #165DFF;
+    text-align: center;
+    margin-bottom: 20px;
+    padding-bottom: 10px;
+    border-bottom: 2px solid #dbeafe;
+}
+.mindmap-container {
+    background-color: #f8f9fa;
+    padding: 20px;
+    border-radius: 8px;
+    box-shadow: 0 2px 8px rgba(0,0,0,0.1);
+}
+h3 {
+    color: #1d4ed8;
+    margin-top: 20px;
+    padding-bottom: 5px;
+    border-bottom: 1px solid #dbeafe;
+}
+ul {
+    list-style-type: none;
+    padding-left: 20px;
+}
+li {
+    margin: 8px 0;
+    position: relative;
+    padding-left: 15px;
+}
+li:before {
+    content: "•";
+    position: absolute;
+    left: 0;
+    color: #3b82f6;
+    font-weight: bold;
+}
+ul ul {
+    border-left: 1px dashed #93c5fd;
+    margin-left: 10px;
+}
+.footer {
+    text-align: center;
+    margin-top: 30px;
+    color: #6b7280;
+    font-size: 0.9em;
+}
+"""
+
+FULL_PLAN_EXPORT_CSS = """
+body {
+    font-family: 'Microsoft YaHei', sans-serif;
+    padding: 20px;
+    max-width: 1000px;
+    margin: 0 auto;
+    line-height: 1.6;
+    color: #333;
+}
+h1 {
+    color: #165DFF;
+    text-align: center;
+    padding-bottom: 10px;
+    border-bottom: 2px solid #dbeafe;
+    margin-bottom: 30px;
+}
+h2 {
+    color: #1d4ed8;
+    margin-top: 40px;
+    padding-bottom: 5px;
+    border-bottom: 1px solid #dbeafe;
+}
+.section {
+    background-color: #f8f9fa;
+    padding: 25px;
+    border-radius: 10px;
+    margin-bottom: 30px;
+    box-shadow: 0 2px 5px rgba(0,0,0,0.05);
+}
+.info-box {
+    background-color: #e7f3ff;
+    border-left: 6px solid #2196F3;
+    padding: 15px;
+    margin-bottom: 30px;
+}
+h3 {
+    color: #2563eb;
+    margin-top: 25px;
+}
+h4 {
+    color: #3b82f6;
+    margin-top: 20px;
+}
+ul, ol {
+    padding-left: 25px;
+}
+li {
+    margin-bottom: 10px;
+}
+.time {
+    font-weight: bold;
+    color: #ef4444;
+}
+.chart-placeholder {
+    background-color: #f1f5f9;
+    padding: 20px;
+    text-align: center;
+    border-radius: 5px;
+    margin: 15px 0;
+    font-style: italic;
+    color: #6b7280;
+}
+.summary {
+    background-color: #e7f3ff;
+    padding: 20px;
+    border-radius: 10px;
+    text-align: center;
+    margin-top: 30px;
+}
+.footer {
+    text-align: center;
+    margin-top: 40px;
+    padding-top: 20px;
+    border-top: 1px solid #eee;
+    color: #6b7280;
+    font-size: 0.9em;
+}
+"""
+
+# 导出样式表：name -> (CSS内容, ETag)
+EXPORT_STYLESHEETS = {
+    name: (css, hashlib.sha256(css.encode('utf-8')).hexdigest()[:16])
+    for name, css in (("mindmap", MINDMAP_EXPORT_CSS), ("full_plan", FULL_PLAN_EXPORT_CSS))
+}
+
+
+def export_style_tag(name, standalone):
+    """独立文件内联样式；在线查看时引用可缓存的样式表"""
+    css, etag = EXPORT_STYLESHEETS[name]
+    if standalone:
+        return f"<style>{css}</style>"
+    return f'<link rel="stylesheet" href="/export_assets/{name}.css?v={etag}">'
+
+
+MINDMAP_EXPORT_TEMPLATE = ExportTemplate("""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{course_title}} - 思维导图</title>
+    {{raw:style}}
+</head>
+<body>
+    <h1>{{course_title}}</h1>
+    <div class="mindmap-container">
+        {{raw:mindmap}}
+    </div>
+    <div class="footer">
+        生成时间: {{generated_at}}
+    </div>
+</body>
+</html>
+""")
+
+FULL_PLAN_EXPORT_TEMPLATE = ExportTemplate("""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{course_title}} - 完整教案</title>
+    {{raw:style}}
+</head>
+<body>
+    <h1>{{course_title}} - 完整教案</h1>
+
+    <div class="info-box">
+        <h3>课程描述</h3>
+        <p>{{course_description}}</p>
+
+        <h3>教学目标</h3>
+        <p>{{teaching_objectives}}</p>
+    </div>
+
+    <div class="section">
+        <h2>一、思维导图</h2>
+        {{raw:mindmap}}
+    </div>
+
+    <div class="section">
+        <h2>二、教学流程</h2>
+        {{raw:teaching_flow}}
+    </div>
+
+    <div class="section">
+        <h2>三、问题模拟与预期效果</h2>
+        {{raw:simulation}}
+    </div>
+
+    <div class="section">
+        <h2>四、评价与优化建议</h2>
+        {{raw:evaluation}}
+    </div>
+
+    <div class="summary">
+        <h3>教案总结</h3>
+        <p>本教案由AI辅助生成，设计完整，具有良好的可操作性和创新性。</p>
+        <p>生成时间：{{generated_at}}</p>
+    </div>
+
+    <div class="footer">
+        {{course_title}} - 完整教案 &copy; {{year}}
+    </div>
+</body>
+</html>
+""")
+
+_CHART_SCRIPT_RE = re.compile(r'<script id=["\']chart-data["\']>')
+
+
+def export_attachment(chunks, filename, mimetype='text/html'):
+    """以附件形式流式返回导出文档"""
+    response = Response(chunks, mimetype=mimetype)
+    # 中文文件名按RFC 5987编码，同时提供ASCII回退名
+    extension = filename.rsplit('.', 1)[-1]
+    response.headers['Content-Disposition'] = (
+        f"attachment; filename=\"export.{extension}\"; filename*=UTF-8''{urllib.parse.quote(filename)}"
+    )
+    return response
+
+
+def export_source():
+    """导出内容来源：带 plan_id 时读取已保存的教案，否则读取上传的表单字段
+
+    返回 (字段字典, 教案最后修改时间)，上传的表单没有修改时间；教案不存在时返回 (None, None)。
+    """
+    plan_id = request.args.get('plan_id') or request.form.get('plan_id')
+    if not plan_id:
+        return request.form, None
+    plan = plan_store.get(plan_id)
+    if plan is None:
+        logger.error(f"教案不存在: {plan_id}")
+        return None, None
+    return {key: plan[key] or '' for key in PLAN_FIELDS}, plan["updated_at"]
+
+
+def is_standalone(values):
+    """导出文件默认内联样式；standalone=false 时引用外部样式表
+
+    values 为 request.values：GET导出（?plan_id=...）从查询参数读取，POST导出从表单读取。
+    """
+    return values.get('standalone', 'true').lower() != 'false'
+
+
+# ---------------------------------------------------------------------------
+# 教案管理接口
+# ---------------------------------------------------------------------------
+
+@app.route('/plans', methods=['POST'])
+def create_plan():
+    """新建教案：course_title 必填，可同时保存已有的阶段结果"""
+    data = request.get_json(silent=True)
+    if not data:
+        logger.error("请求中缺少JSON数据")
+        return jsonify({"error": "请求中缺少JSON数据"}), 400
+    if not data.get('course_title', '').strip():
+        return jsonify({"error": "课程标题不能为空"}), 400
+
+    plan = plan_store.create(**{key: data.get(key, '').strip() for key in PLAN_FIELDS})
+    logger.info(f"已创建教案: {plan['id']}")
+    return jsonify(plan), 201
+
+
+@app.route('/plans', methods=['GET'])
+def list_plans():
+    """分页列出教案摘要：title 按前缀筛选，cursor 为上一页返回的 next_cursor"""
+    try:
+        limit = int(request.args.get('limit', PLAN_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "limit 必须是整数"}), 400
+    limit = max(1, min(limit, PLAN_MAX_PAGE_SIZE))
 
-    except Exception as e:
-        logger.exception(f"生成教学评价时发生异常: {str(e)}\n{traceback.format_exc()}")
-        return jsonify({
-            "error": "服务器内部错误",
-            "details": str(e),
-            "traceback": traceback.format_exc()
-        }), 500
+    try:
+        plans, next_cursor = plan_store.list(
+            title=request.args.get('title', '').strip(),
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"plans": plans, "next_cursor": next_cursor})
 
 
-@app.route('/export_mindmap', methods=['POST'])
+@app.route('/plans/search', methods=['GET'])
+def search_plans():
+    """全文检索已保存的教案：q 按空格分词，所有词都须匹配"""
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "检索词不能为空"}), 400
+    try:
+        limit = int(request.args.get('limit', PLAN_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "limit 必须是整数"}), 400
+    limit = max(1, min(limit, PLAN_MAX_PAGE_SIZE))
+
+    started = time.time()
+    plans = plan_store.search(text, limit)
+    logger.info(f"教案检索 '{text}': {len(plans)} 条结果，耗时 {(time.time() - started) * 1000:.1f}ms")
+    return jsonify({"plans": plans})
+
+
+@app.route('/plans/<plan_id>', methods=['GET'])
+def get_plan(plan_id):
+    plan = plan_store.get(plan_id)
+    if plan is None:
+        return jsonify({"error": "教案不存在"}), 404
+    return jsonify(plan)
+
+
+@app.route('/plans/<plan_id>', methods=['PATCH'])
+def update_plan(plan_id):
+    """修改教案的课程信息或阶段结果"""
+    data = request.get_json(silent=True)
+    if not data:
+        logger.error("请求中缺少JSON数据")
+        return jsonify({"error": "请求中缺少JSON数据"}), 400
+
+    fields = {key: data[key] for key in PLAN_FIELDS if key in data}
+    if not fields:
+        return jsonify({"error": "没有可更新的字段", "fields": list(PLAN_FIELDS)}), 400
+    if 'course_title' in fields and not str(fields['course_title'] or '').strip():
+        return jsonify({"error": "课程标题不能为空"}), 400
+    if not plan_store.update(plan_id, **fields):
+        return jsonify({"error": "教案不存在"}), 404
+    return jsonify(plan_store.get(plan_id))
+
+
+@app.route('/plans/<plan_id>', methods=['DELETE'])
+def delete_plan(plan_id):
+    if not plan_store.delete(plan_id):
+        return jsonify({"error": "教案不存在"}), 404
+    logger.info(f"已删除教案: {plan_id}")
+    return jsonify({"status": "ok"})
+
+
+# 完整教案导出格式：format -> (MIME类型, 扩展名)
+EXPORT_FORMATS = {
+    "html": ("text/html", "html"),
+    "pdf": ("application/pdf", "pdf"),
+    "docx": ("application/vnd.openxmlformats-officedocument.wordprocessingml.document", "docx"),
+}
+
+# PDF/DOCX渲染结果缓存，仅保存在内存中
+export_cache = SparkResponseCache(EXPORT_CACHE_MAX_ENTRIES, EXPORT_CACHE_TTL)
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def submit_render(fmt, plan):
+    """提交到渲染进程池（按需创建），排版计算不占用请求线程的GIL；返回 (进程池, Future)"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=EXPORT_RENDER_WORKERS)
+            atexit.register(_render_pool.shutdown, wait=False)
+        return _render_pool, _render_pool.submit(render_document, fmt, plan)
+
+
+def retire_render_pool(pool):
+    """停用进程池并终止其中仍在渲染的进程，下次请求重新创建
+
+    进程池无法取消已开始执行的任务，渲染超时后只能终止进程，否则卡住的渲染会一直占用进程名额。
+    同一进程池中正在排队或渲染的其他文档随之失败，由 render_plan_document 在新进程池中重试。
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def render_plan_document(fmt, plan):
+    """在进程池中渲染PDF/DOCX，结果按输入内容的哈希缓存；超时抛出FutureTimeoutError"""
+    raw = json.dumps({"format": fmt, "plan": plan}, ensure_ascii=False, sort_keys=True)
+    key = hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    content = export_cache.get(key)
+    if content is not None:
+        logger.info(f"导出缓存命中: {fmt}")
+        return content
+
+    started = time.time()
+    for attempt in range(2):
+        pool, future = submit_render(fmt, plan)
+        try:
+            content = future.result(timeout=EXPORT_RENDER_TIMEOUT)
+            break
+        except FutureTimeoutError:
+            retire_render_pool(pool)
+            raise
+        except (BrokenProcessPool, CancelledError):
+            # 其他请求渲染超时已停用该进程池时重试一次；渲染进程异常退出则直接失败
+            retired = _render_pool is not pool
+            retire_render_pool(pool)
+            if not retired or attempt:
+                raise
+            logger.info(f"渲染进程池已被停用，重新提交{fmt}渲染")
+    logger.info(f"{fmt}渲染完成，大小 {len(content)} 字节，耗时 {time.time() - started:.2f}秒")
+    export_cache.set(key, content)
+    return content
+
+
+@app.route('/export_assets/<name>.css', methods=['GET'])
+def export_stylesheet(name):
+    """导出文档的样式表，内容不变时由浏览器缓存"""
+    if name not in EXPORT_STYLESHEETS:
+        return jsonify({"error": "样式表不存在"}), 404
+    css, etag = EXPORT_STYLESHEETS[name]
+    if request.if_none_match.contains(etag):
+        return Response(status=304)
+    response = Response(css, mimetype='text/css')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+
+@app.route('/export_mindmap', methods=['GET', 'POST'])
 def export_mindmap():
     try:
         logger.info("收到思维导图导出请求")
 
-        # 获取表单数据
-        mindmap = request.form.get('mindmap', '').strip()
-        course_title = request.form.get('course_title', '未命名课程').strip()
+        # 获取导出内容
+        source, updated_at = export_source()
+        if source is None:
+            return jsonify({"error": "教案不存在"}), 404
+        mindmap = source.get('mindmap', '').strip()
+        course_title = source.get('course_title', '未命名课程').strip()
 
         logger.info(f"课程标题: '{course_title}'")
         logger.info(f"思维导图长度: {len(mindmap)}")
@@ -542,91 +2575,18 @@ def export_mindmap():
             logger.error("没有可导出的思维导图内容")
             return jsonify({"error": "没有可导出的思维导图"}), 400
 
-        # 创建完整的HTML文档
-        html_content = f"""
-        <!DOCTYPE html>
-        <html lang="zh-CN">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>{course_title} - 思维导图</title>
-            <style>
-                body {{ 
-                    font-family: 'Microsoft YaHei', sans-serif; 
-                    padding: 20px; 
-                    max-width: 800px; 
-                    margin: 0 auto; 
-                    line-height: 1.6;
-                    color: #333;
-                }}
-                h1 {{ 
-                    color: #165DFF; 
-                    text-align: center;
-                    margin-bottom: 20px;
-                    padding-bottom: 10px;
-                    border-bottom: 2px solid #dbeafe;
-                }}
-                .mindmap-container {{ 
-                    background-color: #f8f9fa; 
-                    padding: 20px; 
-                    border-radius: 8px; 
-                    box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-                }}
-                h3 {{ 
-                    color: #1d4ed8; 
-                    margin-top: 20px; 
-                    padding-bottom: 5px; 
-                    border-bottom: 1px solid #dbeafe;
-                }}
-                ul {{ 
-                    list-style-type: none; 
-                    padding-left: 20px; 
-                }}
-                li {{ 
-                    margin: 8px 0; 
-                    position: relative; 
-                    padding-left: 15px; 
-                }}
-                li:before {{ 
-                    content: "•"; 
-                    position: absolute; 
-                    left: 0; 
-                    color: #3b82f6; 
-                    font-weight: bold;
-                }}
-                ul ul {{ 
-                    border-left: 1px dashed #93c5fd; 
-                    margin-left: 10px; 
-                }}
-                .footer {{ 
-                    text-align: center; 
-                    margin-top: 30px; 
-                    color: #6b7280; 
-                    font-size: 0.9em;
-                }}
-            </style>
-        </head>
-        <body>
-            <h1>{course_title}</h1>
-            <div class="mindmap-container">
-                {mindmap}
-            </div>
-            <div class="footer">
-                生成时间: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}
-            </div>
-        </body>
-        </html>
-        """
-
-        # 创建响应
-        response = make_response(html_content)
+        chunks = MINDMAP_EXPORT_TEMPLATE.stream(
+            course_title=course_title,
+            style=export_style_tag("mindmap", is_standalone(request.values)),
+            mindmap=mindmap,
+            generated_at=datetime.now().strftime('%Y-%m-%d %H:%M')
+        )
+
         # 创建安全文件名
         safe_filename = f"{course_title.replace(' ', '_').replace('/', '_')}_思维导图.html"
-        response.headers['Content-Disposition'] = f'attachment; filename="{safe_filename}"'
-        response.headers['Content-Type'] = 'text/html'
 
         logger.info("成功导出思维导图")
-        return response
+        return export_attachment(chunks, safe_filename)
 
     except Exception as e:
         logger.exception(f"导出思维导图时发生异常: {str(e)}\n{traceback.format_exc()}")
@@ -637,19 +2597,28 @@ def export_mindmap():
         }), 500
 
 
-@app.route('/export_full_plan', methods=['POST'])
+@app.route('/export_full_plan', methods=['GET', 'POST'])
 def export_full_plan():
     try:
-        logger.info("收到完整教案导出请求")
-
-        # 获取表单数据
-        course_title = request.form.get('course_title', '未命名课程').strip()
-        course_description = request.form.get('course_description', '').strip()
-        teaching_objectives = request.form.get('teaching_objectives', '').strip()
-        mindmap = request.form.get('mindmap', '').strip()
-        teaching_flow = request.form.get('teaching_flow', '').strip()
-        simulation = request.form.get('simulation', '').strip()
-        evaluation = request.form.get('evaluation', '').strip()
+        # 导出格式：html（默认）、pdf、docx
+        fmt = (request.args.get('format') or request.form.get('format') or 'html').lower()
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({"error": f"不支持的导出格式: {fmt}"}), 400
+        mimetype, extension = EXPORT_FORMATS[fmt]
+
+        logger.info(f"收到完整教案导出请求，格式: {fmt}")
+
+        # 获取导出内容
+        source, updated_at = export_source()
+        if source is None:
+            return jsonify({"error": "教案不存在"}), 404
+        course_title = source.get('course_title', '未命名课程').strip()
+        course_description = source.get('course_description', '').strip()
+        teaching_objectives = source.get('teaching_objectives', '').strip()
+        mindmap = source.get('mindmap', '').strip()
+        teaching_flow = source.get('teaching_flow', '').strip()
+        simulation = source.get('simulation', '').strip()
+        evaluation = source.get('evaluation', '').strip()
 
         logger.info(f"课程标题: '{course_title}'")
         logger.info(f"思维导图长度: {len(mindmap)}")
@@ -668,146 +2637,47 @@ def export_full_plan():
             logger.error(f"教案内容不完整，缺少: {', '.join(missing)}")
             return jsonify({"error": f"教案内容不完整，缺少: {', '.join(missing)}"}), 400
 
-        # 创建完整的HTML文档
-        html_content = f"""
-        <!DOCTYPE html>
-        <html lang="zh-CN">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>{course_title} - 完整教案</title>
-            <style>
-                body {{
-                    font-family: 'Microsoft YaHei', sans-serif;
-                    padding: 20px;
-                    max-width: 1000px;
-                    margin: 0 auto;
-                    line-height: 1.6;
-                    color: #333;
-                }}
-                h1 {{
-                    color: #165DFF;
-                    text-align: center;
-                    padding-bottom: 10px;
-                    border-bottom: 2px solid #dbeafe;
-                    margin-bottom: 30px;
-                }}
-                h2 {{
-                    color: #1d4ed8;
-                    margin-top: 40px;
-                    padding-bottom: 5px;
-                    border-bottom: 1px solid #dbeafe;
-                }}
-                .section {{
-                    background-color: #f8f9fa;
-                    padding: 25px;
-                    border-radius: 10px;
-                    margin-bottom: 30px;
-                    box-shadow: 0 2px 5px rgba(0,0,0,0.05);
-                }}
-                .info-box {{
-                    background-color: #e7f3ff;
-                    border-left: 6px solid #2196F3;
-                    padding: 15px;
-                    margin-bottom: 30px;
-                }}
-                h3 {{
-                    color: #2563eb;
-                    margin-top: 25px;
-                }}
-                h4 {{
-                    color: #3b82f6;
-                    margin-top: 20px;
-                }}
-                ul, ol {{
-                    padding-left: 25px;
-                }}
-                li {{
-                    margin-bottom: 10px;
-                }}
-                .time {{
-                    font-weight: bold;
-                    color: #ef4444;
-                }}
-                .chart-placeholder {{
-                    background-color: #f1f5f9;
-                    padding: 20px;
-                    text-align: center;
-                    border-radius: 5px;
-                    margin: 15px 0;
-                    font-style: italic;
-                    color: #6b7280;
-                }}
-                .summary {{
-                    background-color: #e7f3ff;
-                    padding: 20px;
-                    border-radius: 10px;
-                    text-align: center;
-                    margin-top: 30px;
-                }}
-                .footer {{
-                    text-align: center;
-                    margin-top: 40px;
-                    padding-top: 20px;
-                    border-top: 1px solid #eee;
-                    color: #6b7280;
-                    font-size: 0.9em;
-                }}
-            </style>
-        </head>
-        <body>
-            <h1>{course_title} - 完整教案</h1>
-
-            <div class="info-box">
-                <h3>课程描述</h3>
-                <p>{course_description or '无描述'}</p>
-
-                <h3>教学目标</h3>
-                <p>{teaching_objectives or '无目标描述'}</p>
-            </div>
-
-            <div class="section">
-                <h2>一、思维导图</h2>
-                {mindmap}
-            </div>
-
-            <div class="section">
-                <h2>二、教学流程</h2>
-                {teaching_flow}
-            </div>
-
-            <div class="section">
-                <h2>三、问题模拟与预期效果</h2>
-                {simulation.replace('<script id="chart-data">', '<div class="chart-placeholder">图表数据（在网页版中显示）</div><script id="chart-data" disabled>')}
-            </div>
-
-            <div class="section">
-                <h2>四、评价与优化建议</h2>
-                {evaluation}
-            </div>
-
-            <div class="summary">
-                <h3>教案总结</h3>
-                <p>本教案由AI辅助生成，设计完整，具有良好的可操作性和创新性。</p>
-                <p>生成时间：{datetime.datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')}</p>
-            </div>
-
-            <div class="footer">
-                {course_title} - 完整教案 &copy; {datetime.datetime.now().year}
-            </div>
-        </body>
-        </html>
-        """
-
-        # 创建响应
-        response = make_response(html_content)
-        # 创建安全文件名
-        safe_filename = f"{course_title.replace(' ', '_').replace('/', '_')}_完整教案.html"
-        response.headers['Content-Disposition'] = f'attachment; filename="{safe_filename}"'
-        response.headers['Content-Type'] = 'text/html'
+        safe_title = course_title.replace(' ', '_').replace('/', '_')
+        # 已保存的教案以最后修改时间作为生成时间：同一版本重复下载时内容相同，PDF/DOCX可命中渲染缓存
+        generated = datetime.fromtimestamp(updated_at) if updated_at else datetime.now()
+        generated_at = generated.strftime('%Y年%m月%d日 %H:%M:%S')
+
+        if fmt != 'html':
+            try:
+                content = render_plan_document(fmt, {
+                    "course_title": course_title,
+                    "course_description": course_description,
+                    "teaching_objectives": teaching_objectives,
+                    "mindmap": mindmap,
+                    "teaching_flow": teaching_flow,
+                    "simulation": simulation,
+                    "evaluation": evaluation,
+                    "generated_at": generated_at,
+                })
+            except FutureTimeoutError:
+                logger.error(f"{fmt}渲染超时（{EXPORT_RENDER_TIMEOUT}秒）")
+                return jsonify({"error": "文档渲染超时，请稍后重试"}), 504
+            logger.info("成功导出完整教案")
+            return export_attachment(content, f"{safe_title}_完整教案.{extension}", mimetype)
+
+        chunks = FULL_PLAN_EXPORT_TEMPLATE.stream(
+            course_title=course_title,
+            style=export_style_tag("full_plan", is_standalone(request.values)),
+            course_description=course_description or '无描述',
+            teaching_objectives=teaching_objectives or '无目标描述',
+            mindmap=mindmap,
+            teaching_flow=teaching_flow,
+            simulation=_CHART_SCRIPT_RE.sub(
+                '<div class="chart-placeholder">图表数据（在网页版中显示）</div><script id="chart-data" disabled>',
+                simulation
+            ),
+            evaluation=evaluation,
+            generated_at=generated_at,
+            year=generated.year
+        )
 
         logger.info("成功导出完整教案")
-        return response
+        return export_attachment(chunks, f"{safe_title}_完整教案.html")
 
     except Exception as e:
         logger.exception(f"导出完整教案时发生异常: {str(e)}\n{traceback.format_exc()}")
@@ -823,7 +2693,7 @@ def health_check():
     """健康检查端点"""
     return jsonify({
         "status": "ok",
-        "timestamp": datetime.datetime.now().isoformat(),
+        "timestamp": datetime.now().isoformat(),
         "app": "Teaching Assistant Backend",
         "version": "1.0.0"
     })
@@ -840,4 +2710,6 @@ if __name__ == '__main__':
     logger.info(f"  API_KEY: {API_KEY[:6]}...")
     logger.info(f"  API_SECRET: {API_SECRET[:6]}...")
 
-    app.run(host='0.0.0.0', port=port, debug=debug_mode)
\ No newline at end of file
+    logger.info(f"星火会话池: 并发上限 {SPARK_POOL_SIZE}, 排队上限 {SPARK_POOL_MAX_WAITING}")
+
+    app.run(host='0.0.0.0', port=port, debug=debug_mode, threaded=True)
\ No newline at end of file
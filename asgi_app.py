@@ -0,0 +1,579 @@
+"""ASGI入口：基于asyncio的星火API客户端与生成路由
+
+每个生成请求只占用一个协程，不再为每次调用创建线程，单进程即可同时承载数百个长时间运行的生成。
+依赖 websockets 库（pip install websockets），运行方式：
+
+    uvicorn asgi_app:application --host 0.0.0.0 --port 5000
+
+生成路由（/generate_* 及 /generate_*/stream）由本模块以原生异步方式处理，
+其余路由在安装了 asgiref 时转交给 Flask 应用。
+"""
+import asyncio
+import json
+import os
+import ssl
+import traceback
+import uuid
+
+try:
+    import websockets
+except ImportError:  # 可选依赖，仅ASGI部署需要
+    websockets = None
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+from app import (
+    app as flask_app,
+    logger,
+    sample_payload_log,
+    SparkWebSocket,
+    spark_breaker,
+    spark_cache,
+    spark_quota,
+    spark_timeouts,
+    usage_ledger,
+    next_retry_delay,
+    GENERATION_STAGES,
+    prepare_stage,
+    resolve_output_format,
+    find_similar_result,
+    finish_stage,
+    sse_event,
+    APP_ID,
+    API_KEY,
+    API_SECRET,
+    SPARK_URL,
+)
+from html_outline import HtmlStreamExtractor
+from metrics import (
+    METRIC_SPARK_CALLS,
+    METRIC_SPARK_ERRORS,
+    METRIC_SPARK_INFLIGHT,
+    METRIC_SPARK_CONNECT,
+    METRIC_SPARK_FIRST_TOKEN,
+    METRIC_SPARK_DURATION,
+    METRIC_SPARK_OUTPUT_CHARS,
+    METRIC_QUOTA_WAIT,
+    METRIC_GENERATION_REQUESTS,
+    METRIC_GENERATION_CANCELLED,
+    METRIC_STRUCTURED_OUTPUT_ERRORS,
+)
+from request_context import request_id_var, user_id_var, GenerationError
+from spark_resilience import SparkCallFailedError, SparkPoolBusyError, SparkUnavailableError
+from structured_output import StructuredStream, StructuredOutputError
+
+# 异步客户端并发配置
+SPARK_ASYNC_CONCURRENCY = int(os.getenv("SPARK_ASYNC_CONCURRENCY", 256))  # 最大并发生成数
+SPARK_ASYNC_MAX_WAITING = int(os.getenv("SPARK_ASYNC_MAX_WAITING", 512))  # 最大排队请求数
+
+
+class AsyncSparkClient(SparkWebSocket):
+    """asyncio版星火API客户端
+
+    复用 SparkWebSocket 的 create_url 签名和 gen_params 请求体；调用状态全部保存在协程局部变量中，
+    同一个实例可被任意多个协程并发使用。与同步会话池共用生成结果缓存。
+    """
+
+    def __init__(self, app_id, api_key, api_secret, spark_url, max_concurrency, max_waiting, cache=None):
+        super().__init__(app_id, api_key, api_secret, spark_url)
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.cache = cache
+        self._semaphore = None
+        self._in_use = 0
+        self._waiting = 0
+
+    def _ssl_context(self):
+        """与同步客户端一致：wss连接不校验证书"""
+        if not self.spark_url.startswith("wss://"):
+            return None
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
+    async def _acquire(self):
+        """获取并发名额，排队数超过上限时拒绝"""
+        if self._semaphore is None:
+            # 信号量需在事件循环内创建
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        if self._in_use >= self.max_concurrency and self._waiting >= self.max_waiting:
+            logger.warning(f"异步客户端排队已满: 使用中 {self._in_use}, 排队 {self._waiting}")
+            raise SparkPoolBusyError("服务繁忙，请稍后重试")
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_use += 1
+
+    def _release(self):
+        self._in_use -= 1
+        self._semaphore.release()
+
+    async def _acquire_quota(self, route):
+        """等待进程级上游配额（与同步会话池共享），超出配额时排队而不拒绝"""
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        while True:
+            delay = spark_quota.try_acquire()
+            if delay == 0:
+                break
+            await asyncio.sleep(delay)
+        METRIC_QUOTA_WAIT.observe(loop.time() - started_at, route=route)
+
+    def _cache_key(self, messages, use_cache, route):
+        if not use_cache or self.cache is None or not self.cache.enabled:
+            return None
+        chat_params = self.gen_params(messages, route)["parameter"]["chat"]
+        return self.cache.make_key(messages, chat_params)
+
+    async def stream_spark_api(self, messages, timeout=None, use_cache=True, route="unknown", raw=False):
+        """异步调用星火API，按到达顺序逐块产出增量内容；命中缓存时一次性产出完整结果
+
+        与同步会话池相同：经过熔断器，尚未产出内容的可重试失败按指数退避重试，不再重试的失败抛出
+        SparkCallFailedError；raw 为真时缓存模型的原始输出（结构化输出模式），否则缓存提取出的HTML。
+        """
+        key = self._cache_key(messages, use_cache, route)
+        if key:
+            # 持久层为SQLite，查询放到线程池中执行
+            cached = await asyncio.to_thread(self.cache.get, key)
+            if cached is not None:
+                logger.info(f"命中生成结果缓存: {key[:12]}")
+                yield cached
+                return
+
+        if websockets is None:
+            raise RuntimeError("未安装websockets库，无法使用异步客户端")
+
+        parts = []
+        attempt = 0
+        while True:
+            spark_breaker.before_call()
+            outcome = {"error_code": None}
+            produced = False
+            try:
+                async for chunk in self._stream_once(messages, timeout, route, outcome):
+                    produced = True
+                    parts.append(chunk)
+                    yield chunk
+            finally:
+                spark_breaker.record(outcome["error_code"])
+            if outcome["error_code"] is None:
+                break
+            delay = next_retry_delay(outcome["error_code"], attempt, route, produced)
+            if delay is None:
+                # 与同步会话池相同：不再重试的失败不返回已收到的部分内容
+                raise SparkCallFailedError(outcome["error_code"])
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        if key:
+            result = "".join(parts) if raw else self.clean_answer("".join(parts))
+            if result:
+                await asyncio.to_thread(self.cache.set, key, result)
+
+    async def _stream_once(self, messages, timeout, route, outcome):
+        """单次调用星火API；结束时把错误码（成功为None）写入 outcome"""
+        await self._acquire()
+        try:
+            await self._acquire_quota(route)
+        except BaseException:
+            self._release()
+            raise
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        last_frame_at = started_at
+        max_gap = 0.0
+        first_token = True
+        output_chars = 0
+        usage = None
+        error_code = "closed"
+        METRIC_SPARK_CALLS.inc(route=route)
+        METRIC_SPARK_INFLIGHT.inc(route=route)
+        try:
+            adaptive_timeout, idle_timeout = spark_timeouts.limits(route)
+            deadline = started_at + (timeout or adaptive_timeout)
+            ws_url = self.create_url()
+            async with websockets.connect(ws_url, ssl=self._ssl_context(), max_size=None) as ws:
+                logger.debug("WebSocket connection opened")
+                METRIC_SPARK_CONNECT.observe(loop.time() - started_at, route=route, source="cold")
+                data = json.dumps(self.gen_params(messages, route))
+                await ws.send(data)
+                if sample_payload_log():
+                    logger.debug(f"Sent request: {data}")
+
+                while True:
+                    now = loop.time()
+                    remaining = min(deadline, last_frame_at + idle_timeout) - now
+                    try:
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        message = await asyncio.wait_for(ws.recv(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        if loop.time() >= deadline:
+                            logger.warning("API call timed out")
+                            error_code = "timeout"
+                        else:
+                            logger.warning(f"API stream stalled: no frame for {idle_timeout:.1f}s")
+                            error_code = "idle_timeout"
+                        return
+                    # 任何帧（包括不含content的推理帧）都说明上游仍在工作
+                    now = loop.time()
+                    max_gap = max(max_gap, now - last_frame_at)
+                    last_frame_at = now
+
+                    data = json.loads(message)
+                    code = data['header']['code']
+                    if code != 0:
+                        logger.error(f"API request error: {code}, {data}")
+                        error_code = str(code)
+                        return
+
+                    choices = data["payload"]["choices"]
+                    if "text" in choices and len(choices["text"]) > 0 and "content" in choices["text"][0]:
+                        if first_token:
+                            first_token = False
+                            METRIC_SPARK_FIRST_TOKEN.observe(loop.time() - started_at, route=route)
+                        content = choices["text"][0]["content"]
+                        output_chars += len(content)
+                        yield content
+                    else:
+                        logger.warning("Message does not contain 'content' key.")
+
+                    # 状态为2表示结束，最后一帧附带本次调用的token用量
+                    if choices["status"] == 2:
+                        logger.debug("API response completed")
+                        usage = data["payload"].get("usage", {}).get("text")
+                        error_code = None
+                        return
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            logger.error(f"WebSocket error: {e}")
+            error_code = "connection"
+        except GeneratorExit:
+            error_code = "aborted"
+            raise
+        except asyncio.CancelledError:
+            error_code = "cancelled"
+            raise
+        finally:
+            outcome["error_code"] = error_code
+            spark_quota.release()
+            self._release()
+            METRIC_SPARK_INFLIGHT.dec(route=route)
+            METRIC_SPARK_DURATION.observe(loop.time() - started_at, route=route)
+            METRIC_SPARK_OUTPUT_CHARS.observe(output_chars, route=route)
+            if error_code:
+                METRIC_SPARK_ERRORS.inc(route=route, code=error_code)
+            if usage:
+                usage_ledger.record(route, user_id_var.get(), usage)
+            if error_code is None:
+                spark_timeouts.observe(route, loop.time() - started_at, max_gap)
+
+    async def call_spark_api(self, messages, timeout=None, use_cache=True, route="unknown"):
+        """异步调用星火API，返回清理后的完整结果；相同请求优先返回缓存结果"""
+        extractor = HtmlStreamExtractor()
+        async for chunk in self.stream_spark_api(messages, timeout=timeout, use_cache=use_cache, route=route):
+            extractor.feed(chunk)
+        return extractor.value()
+
+    def stats(self):
+        """并发状态"""
+        return {
+            "size": self.max_concurrency,
+            "in_use": self._in_use,
+            "waiting": self._waiting,
+            "max_waiting": self.max_waiting
+        }
+
+
+spark_async = AsyncSparkClient(
+    APP_ID, API_KEY, API_SECRET, SPARK_URL,
+    max_concurrency=SPARK_ASYNC_CONCURRENCY,
+    max_waiting=SPARK_ASYNC_MAX_WAITING,
+    cache=spark_cache
+)
+
+
+# ---------------------------------------------------------------------------
+# 异步生成阶段
+# ---------------------------------------------------------------------------
+
+async def generate_stage_async(stage, data):
+    """异步执行一个生成阶段，返回结果字典；失败时抛出GenerationError
+
+    教案读写、相似教案检索（SQLite、NumPy）等阻塞操作放到线程池中执行，不占用事件循环。
+    """
+    try:
+        output_format = resolve_output_format(data)
+    except GenerationError as e:
+        METRIC_GENERATION_REQUESTS.inc(route=stage, status=e.status)
+        raise
+    if output_format == "json":
+        # 请求数由 stream_stage_async 记录
+        async for event, payload in stream_stage_async(stage, data):
+            if event == "done":
+                return payload
+    spec = GENERATION_STAGES[stage]
+    try:
+        prompt, extra = await asyncio.to_thread(prepare_stage, stage, data)
+
+        reused = await asyncio.to_thread(find_similar_result, stage, data, extra)
+        if reused is not None:
+            result, extra = reused
+        else:
+            logger.info(f"异步调用星火API生成{spec['name']}...")
+            try:
+                result = await spark_async.call_spark_api(prompt, use_cache=not data.get('no_cache'), route=stage)
+            except SparkUnavailableError as e:
+                logger.warning(f"生成{spec['name']}失败: {str(e)}")
+                raise GenerationError(str(e), e.status)
+        payload = await asyncio.to_thread(finish_stage, stage, result, extra)
+    except GenerationError as e:
+        METRIC_GENERATION_REQUESTS.inc(route=stage, status=e.status)
+        raise
+    except asyncio.CancelledError:
+        METRIC_GENERATION_REQUESTS.inc(route=stage, status=499)
+        raise
+    METRIC_GENERATION_REQUESTS.inc(route=stage, status=200)
+    return payload
+
+
+async def stream_stage_async(stage, data):
+    """异步流式执行一个生成阶段，事件格式与 app.stream_stage 相同"""
+    spec = GENERATION_STAGES[stage]
+    try:
+        prompt, extra = await asyncio.to_thread(prepare_stage, stage, data)
+
+        reused = await asyncio.to_thread(find_similar_result, stage, data, extra)
+        if reused is not None:
+            result, extra = reused
+            yield "chunk", result
+        elif resolve_output_format(data) == "json":
+            logger.info(f"异步流式调用星火API生成{spec['name']}（JSON）...")
+            stream = StructuredStream(stage)
+            emitted = []
+            chunks = spark_async.stream_spark_api(prompt, use_cache=not data.get('no_cache'), route=stage, raw=True)
+            try:
+                async for chunk in chunks:
+                    content = stream.feed(chunk)
+                    if content:
+                        emitted.append(content)
+                        yield "chunk", content
+                result, structured = stream.finish()
+            except SparkUnavailableError as e:
+                logger.warning(f"生成{spec['name']}失败: {str(e)}")
+                raise GenerationError(str(e), e.status)
+            except StructuredOutputError as e:
+                METRIC_STRUCTURED_OUTPUT_ERRORS.inc(route=stage)
+                answer = "".join(stream.raw)
+                logger.warning(f"{spec['name']}JSON格式错误: {str(e)}")
+                raise GenerationError(
+                    f"AI返回了无效的{spec['name']}格式",
+                    details=str(e),
+                    content=answer[:500] + "..." if len(answer) > 500 else answer
+                )
+            finally:
+                await chunks.aclose()
+            # 列表之后的部分（雷达图、评分数据）和容器结束标签
+            tail = result[len("".join(emitted)):]
+            if tail:
+                yield "chunk", tail
+            extra = {**extra, "structured": structured}
+        else:
+            logger.info(f"异步流式调用星火API生成{spec['name']}...")
+            extractor = HtmlStreamExtractor()
+            try:
+                async for chunk in spark_async.stream_spark_api(
+                        prompt, use_cache=not data.get('no_cache'), route=stage):
+                    content = extractor.feed(chunk)
+                    if content:
+                        yield "chunk", content
+            except SparkUnavailableError as e:
+                logger.warning(f"生成{spec['name']}失败: {str(e)}")
+                raise GenerationError(str(e), e.status)
+            result = extractor.value()
+        payload = await asyncio.to_thread(finish_stage, stage, result, extra)
+    except GenerationError as e:
+        METRIC_GENERATION_REQUESTS.inc(route=stage, status=e.status)
+        raise
+    except asyncio.CancelledError:
+        METRIC_GENERATION_REQUESTS.inc(route=stage, status=499)
+        raise
+    METRIC_GENERATION_REQUESTS.inc(route=stage, status=200)
+    yield "done", payload
+
+
+# ---------------------------------------------------------------------------
+# ASGI路由层
+# ---------------------------------------------------------------------------
+
+# 路径 -> 生成阶段
+GENERATE_ROUTES = {
+    "/generate_mindmap": "mindmap",
+    "/generate_teaching_flow": "teaching_flow",
+    "/generate_problem_simulation": "problem_simulation",
+    "/generate_evaluation": "evaluation",
+}
+
+
+async def read_body(receive):
+    """读取完整请求体"""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def run_until_disconnect(coro, receive, stage):
+    """执行请求处理协程；客户端先断开时取消它，正在进行的星火连接随之关闭并归还并发名额"""
+    async def wait_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    handler = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(wait_disconnect())
+    await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    if handler.done():
+        watcher.cancel()
+        return handler.result()
+    logger.info("客户端已断开，取消生成")
+    METRIC_GENERATION_CANCELLED.inc(route=stage, reason="disconnect")
+    handler.cancel()
+    try:
+        await handler
+    except asyncio.CancelledError:
+        pass
+
+
+async def handle_generate(stage, scope, receive, send):
+    """阻塞式生成路由：等待完整结果后返回JSON"""
+    spec = GENERATION_STAGES[stage]
+    try:
+        logger.info(f"收到{spec['name']}生成请求")
+        try:
+            data = json.loads(await read_body(receive) or b"null")
+        except ValueError:
+            data = None
+        if not data:
+            logger.error("请求中缺少JSON数据")
+            return await send_json(send, {"error": "请求中缺少JSON数据"}, 400)
+        if not isinstance(data, dict):
+            logger.error(f"请求体不是JSON对象: {type(data).__name__}")
+            return await send_json(send, {"error": "请求体必须是JSON对象"}, 400)
+
+        payload = await run_until_disconnect(generate_stage_async(stage, data), receive, stage)
+        if payload is not None:
+            await send_json(send, payload)
+
+    except GenerationError as e:
+        await send_json(send, e.to_dict(), e.status)
+
+    except Exception as e:
+        logger.exception(f"生成{spec['name']}时发生异常: {str(e)}")
+        await send_json(send, {
+            "error": "服务器内部错误",
+            "details": str(e),
+            "traceback": traceback.format_exc()
+        }, 500)
+
+
+async def handle_generate_stream(stage, scope, receive, send):
+    """流式生成路由：以SSE逐块推送"""
+    spec = GENERATION_STAGES[stage]
+    logger.info(f"收到{spec['name']}流式生成请求")
+    try:
+        data = json.loads(await read_body(receive) or b"null")
+    except ValueError:
+        data = None
+    if not data:
+        logger.error("请求中缺少JSON数据")
+        return await send_json(send, {"error": "请求中缺少JSON数据"}, 400)
+    if not isinstance(data, dict):
+        logger.error(f"请求体不是JSON对象: {type(data).__name__}")
+        return await send_json(send, {"error": "请求体必须是JSON对象"}, 400)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+
+    async def push(event, payload):
+        await send({
+            "type": "http.response.body",
+            "body": sse_event(event, payload).encode("utf-8"),
+            "more_body": True,
+        })
+
+    async def produce():
+        try:
+            async for event, payload in stream_stage_async(stage, data):
+                await push(event, {"content": payload} if event == "chunk" else payload)
+        except GenerationError as e:
+            await push("error", {**e.to_dict(), "status": e.status})
+        except Exception as e:
+            logger.exception(f"流式生成{spec['name']}时发生异常: {str(e)}")
+            await push("error", {"error": "服务器内部错误", "details": str(e), "status": 500})
+        return True
+
+    if await run_until_disconnect(produce(), receive, stage):
+        await send({"type": "http.response.body", "body": b""})
+
+
+# 非生成路由交给Flask处理
+flask_asgi = WsgiToAsgi(flask_app) if WsgiToAsgi else None
+
+
+async def application(scope, receive, send):
+    """ASGI应用入口"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                logger.info(f"ASGI应用启动，异步并发上限: {SPARK_ASYNC_CONCURRENCY}")
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    # 每个请求运行在独立任务中，请求ID只影响本请求的日志
+    headers = dict(scope.get("headers") or [])
+    request_id_var.set(headers.get(b"x-request-id", b"").decode() or uuid.uuid4().hex[:16])
+    user_id_var.set(headers.get(b"x-user-id", b"").decode().strip()[:32] or "anonymous")
+
+    path = scope["path"].rstrip("/")
+    if scope["method"] == "POST":
+        if path in GENERATE_ROUTES:
+            return await handle_generate(GENERATE_ROUTES[path], scope, receive, send)
+        if path.endswith("/stream") and path[:-len("/stream")] in GENERATE_ROUTES:
+            return await handle_generate_stream(GENERATE_ROUTES[path[:-len("/stream")]], scope, receive, send)
+
+    if flask_asgi is not None:
+        return await flask_asgi(scope, receive, send)
+    await send_json(send, {"error": "未找到该路由（其余路由需要安装asgiref）"}, 404)
@@ -0,0 +1,55 @@
+"""批量生成思维导图（命令行入口）
+
+读取CSV或JSONL格式的课程列表（字段：course_title、course_description、teaching_objectives），
+按并发上限和速率限制调用星火API，每完成一门课程即向输出文件追加一行JSON。
+
+示例：
+    python batch_generate.py courses.csv -o mindmaps.jsonl --concurrency 8 --rate 4
+"""
+import argparse
+import json
+import sys
+import time
+
+from app import parse_course_rows, run_batch, BATCH_DEFAULT_RATE, BATCH_MAX_CONCURRENCY
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量生成课程思维导图")
+    parser.add_argument("input", help="课程列表文件（.csv 或 .jsonl）")
+    parser.add_argument("-o", "--output", default="-", help="结果输出文件（JSONL），默认输出到标准输出")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="输入格式，默认按扩展名判断")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help=f"并发请求数（上限 {BATCH_MAX_CONCURRENCY}）")
+    parser.add_argument("--rate", type=float, default=BATCH_DEFAULT_RATE, help="每秒最多发起的请求数，0表示不限速")
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        fmt = "jsonl" if args.input.endswith((".jsonl", ".ndjson")) else "csv"
+
+    with open(args.input, encoding="utf-8-sig") as f:
+        courses = parse_course_rows(f.read(), fmt)
+    if not courses:
+        print("课程列表为空", file=sys.stderr)
+        return 1
+
+    output = sys.stdout if args.output == "-" else open(args.output, "a", encoding="utf-8")
+    started = time.time()
+    try:
+        def write(record):
+            # 逐条写入并刷新，中途中断也能保留已完成的结果
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+
+        succeeded = run_batch(courses, write, concurrency=args.concurrency, rate=args.rate)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"完成 {succeeded}/{len(courses)} 门课程，用时 {time.time() - started:.1f} 秒", file=sys.stderr)
+    return 0 if succeeded == len(courses) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
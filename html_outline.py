@@ -0,0 +1,155 @@
+"""模型输出的HTML处理：流式提取HTML容器，以及把上一阶段的HTML压缩为大纲文本"""
+import math
+import re
+
+from plan_render import html_to_blocks
+
+_TAG_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^>]*?(/?)>')
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class HtmlStreamExtractor:
+    """增量提取模型输出中的HTML
+
+    跳过首个'{'或'<'之前的说明文字，只确认到目前为止最后一个'>'为止的内容，其后的文字暂存
+    （可能是尾部说明）；同时跟踪标签深度，记录首个顶层容器元素闭合的位置。
+    每个字符只扫描一次，流式和阻塞两种调用方式共用。
+    """
+
+    def __init__(self):
+        self._parts = []  # 已确认的片段
+        self._pending = []  # 最后一个'>'之后尚未确认的片段
+        self._started = False
+        self._depth = 0
+        self._value = None
+        self.length = 0
+        self.container_end = -1  # 首个顶层元素闭合处在已确认内容中的下标
+
+    @property
+    def container_closed(self):
+        return self.container_end >= 0
+
+    def feed(self, chunk):
+        """输入一个片段，返回新确认的内容（可能为空串）"""
+        if not self._started:
+            start = min((i for i in (chunk.find('<'), chunk.find('{')) if i >= 0), default=-1)
+            if start < 0:
+                return ""
+            chunk = chunk[start:]
+            self._started = True
+
+        cut = chunk.rfind('>')
+        if cut < 0:
+            self._pending.append(chunk)
+            return ""
+
+        self._pending.append(chunk[:cut + 1])
+        segment = "".join(self._pending)
+        self._pending = [chunk[cut + 1:]] if cut + 1 < len(chunk) else []
+        self._scan(segment)
+        self._parts.append(segment)
+        self._value = None
+        self.length += len(segment)
+        return segment
+
+    def _scan(self, segment):
+        """更新标签深度；片段总以'>'结尾，标签不会跨片段"""
+        if self.container_closed:
+            return
+        for match in _TAG_RE.finditer(segment):
+            closing, name, self_closing = match.groups()
+            if name.lower() in VOID_TAGS or self_closing:
+                continue
+            if closing:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.container_end = self.length + match.end()
+                    return
+            else:
+                self._depth += 1
+
+    def value(self):
+        """到目前为止确认的完整内容"""
+        if self._value is None:
+            self._value = "".join(self._parts)
+        return self._value
+
+    def container(self):
+        """首个顶层容器元素的完整内容，尚未闭合时返回None"""
+        if not self.container_closed:
+            return None
+        return self.value()[:self.container_end]
+
+
+_CJK_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+_WORD_TOKEN_RE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d\u3400-\u9fff\uf900-\ufaff]")
+OUTLINE_HEADINGS = {"h1": "# ", "h2": "# ", "h3": "## ", "h4": "### "}
+OUTLINE_ELLIPSIS_COST = 3  # "……"占位行的估算token数（含换行）
+
+
+def estimate_tokens(text):
+    """粗略估算token数：约1.5个汉字一个token，英文单词、数字和符号各算一个"""
+    return math.ceil(len(_CJK_RE.findall(text)) / 1.5) + len(_WORD_TOKEN_RE.findall(text))
+
+
+def compact_outline(html, max_tokens):
+    """把上一阶段的HTML压缩为大纲文本（标题、段落和缩进的列表条目，去掉标签和图表数据）
+
+    超出token预算时先省略嵌套最深的条目，同一层级从各列表的末尾开始均匀省略，标题始终保留；
+    整个被省略的子列表不留痕迹，只省略了末尾部分的列表以一行"……"占位。只剩标题仍超出预算时从末尾截断。
+    """
+    lines, ranks, positions, list_ids = [], [], [], []
+    open_lists = {}  # 列表层级 -> (列表编号, 已出现的条目数)
+    for kind, text, depth in html_to_blocks(html):
+        if kind in OUTLINE_HEADINGS:
+            lines.append(OUTLINE_HEADINGS[kind] + text)
+            ranks.append(0)
+            positions.append(0)
+            list_ids.append(None)
+            open_lists = {}
+            continue
+        open_lists = {level: value for level, value in open_lists.items() if level <= depth}
+        list_id, count = open_lists.get(depth, (len(lines), 0))
+        open_lists[depth] = (list_id, count + 1)
+        lines.append("  " * max(depth - 1, 0) + ("- " if kind == "li" else "") + text)
+        ranks.append(max(depth, 1))
+        positions.append(count + 1)
+        list_ids.append(list_id)
+
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    kept = {}
+    for list_id in list_ids:
+        kept[list_id] = kept.get(list_id, 0) + 1
+    truncated = set()  # 部分省略、需要占位的列表
+    total = sum(costs)
+    keep = [True] * len(lines)
+    if total > max_tokens:
+        order = sorted(range(len(lines)), key=lambda index: (-ranks[index], -positions[index], -index))
+        for index in order:
+            if total <= max_tokens or ranks[index] == 0:
+                break
+            list_id = list_ids[index]
+            keep[index] = False
+            kept[list_id] -= 1
+            total -= costs[index]
+            if kept[list_id] and list_id not in truncated:
+                truncated.add(list_id)
+                total += OUTLINE_ELLIPSIS_COST
+            elif not kept[list_id] and list_id in truncated:
+                truncated.discard(list_id)
+                total -= OUTLINE_ELLIPSIS_COST
+
+    output = []
+    for index, line in enumerate(lines):
+        if keep[index]:
+            output.append(line)
+        elif list_ids[index] in truncated:
+            truncated.discard(list_ids[index])
+            output.append(line[:len(line) - len(line.lstrip())] + "……")
+    used = 0
+    for count, line in enumerate(output):
+        used += estimate_tokens(line) + 1
+        if used > max_tokens:
+            output = output[:count] + ["……"]
+            break
+    return "\n".join(output)
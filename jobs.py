@@ -0,0 +1,256 @@
+"""异步任务队列：提交后立即返回任务ID，由后台工作线程执行生成"""
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+
+from metrics import METRIC_GENERATION_CANCELLED
+from request_context import (
+    CancelToken, GenerationCancelled, GenerationError, cancel_token_var, request_id_var, user_id_var
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobQueueFullError(Exception):
+    """任务队列已满"""
+
+
+class MemoryJobStore:
+    """进程内任务存储，已结束的任务超过保留时间后清理"""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._purge()
+            self._jobs[job["id"]] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _purge(self):
+        """清理过期任务（调用方需持有锁）"""
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in JOB_FINISHED_STATUSES and job["finished_at"] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """SQLite任务存储，任务状态可跨进程查询"""
+
+    JSON_FIELDS = ("payload", "result", "error", "progress")
+
+    def __init__(self, db_path, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, type TEXT NOT NULL, status TEXT NOT NULL, "
+            "payload TEXT, result TEXT, error TEXT, progress TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_finished ON jobs (status, finished_at)")
+        self._db.commit()
+
+    def _encode(self, fields):
+        return {
+            key: json.dumps(value, ensure_ascii=False) if key in self.JSON_FIELDS and value is not None else value
+            for key, value in fields.items()
+        }
+
+    def create(self, job):
+        row = self._encode(job)
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        with self._lock:
+            self._db.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' for _ in JOB_FINISHED_STATUSES)}) "
+                "AND finished_at < ?",
+                (*JOB_FINISHED_STATUSES, time.time() - self.ttl)
+            )
+            self._db.execute(f"INSERT INTO jobs ({columns}) VALUES ({placeholders})", tuple(row.values()))
+            self._db.commit()
+
+    def update(self, job_id, **fields):
+        row = self._encode(fields)
+        assignments = ", ".join(f"{key} = ?" for key in row)
+        with self._lock:
+            self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*row.values(), job_id))
+            self._db.commit()
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for key in self.JSON_FIELDS:
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        return job
+
+
+class JobManager:
+    """后台任务管理：有界队列 + 固定数量的工作线程
+
+    任务由 runner(任务类型, 请求数据, on_progress) 执行并返回结果，on_progress(event, payload)
+    接收完整教案的阶段进度；runner 抛出的GenerationError按状态码记为失败或取消。
+    """
+
+    def __init__(self, store, workers, queue_depth, runner):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._changed = threading.Condition()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._tokens = {}  # 运行中任务ID -> CancelToken
+        self._tokens_lock = threading.Lock()
+
+    def _ensure_workers(self):
+        """首次提交任务时启动工作线程"""
+        with self._start_lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, job_type, payload):
+        """提交任务，返回任务记录；队列已满时抛出JobQueueFullError"""
+        self._ensure_workers()
+        job = {
+            "id": uuid.uuid4().hex,
+            "type": job_type,
+            "status": "queued",
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "progress": [],
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None
+        }
+        self.store.create(job)
+        try:
+            self._queue.put_nowait(job["id"])
+        except queue.Full:
+            self._update(job["id"], status="failed", error={"error": "任务队列已满", "status": 503},
+                         finished_at=time.time())
+            raise JobQueueFullError("任务队列已满，请稍后重试")
+        logger.info(f"已提交任务 {job['id']}，类型: {job_type}，排队: {self._queue.qsize()}")
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def cancel(self, job_id):
+        """取消未结束的任务：排队中的任务不再执行，运行中的任务关闭上游连接后结束
+
+        返回是否已发出取消；任务在其他进程中运行时无法取消。
+        """
+        with self._tokens_lock:
+            job = self.store.get(job_id)
+            if job is None or job["status"] in JOB_FINISHED_STATUSES:
+                return False
+            token = self._tokens.get(job_id)
+            if token is None:
+                if job["status"] != "queued":
+                    return False
+                self._update(job_id, status="cancelled", error={"error": "任务已取消", "status": 499},
+                             finished_at=time.time())
+                METRIC_GENERATION_CANCELLED.inc(route=job["type"], reason="job")
+                logger.info(f"已取消排队中的任务 {job_id}")
+                return True
+        token.cancel("job")
+        logger.info(f"已取消运行中的任务 {job_id}")
+        return True
+
+    def wait_for_change(self, timeout):
+        """等待任意任务状态变化"""
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def _update(self, job_id, **fields):
+        self.store.update(job_id, **fields)
+        with self._changed:
+            self._changed.notify_all()
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception as e:
+                logger.exception(f"执行任务 {job_id} 时发生异常: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        with self._tokens_lock:
+            job = self.store.get(job_id)
+            if job is None or job["status"] != "queued":
+                return  # 排队期间已被取消
+            token = CancelToken()
+            self._tokens[job_id] = token
+            self._update(job_id, status="running", started_at=time.time())
+        request_id_var.set(job_id[:16])
+        user_id_var.set(job["payload"].get("user_id") or "anonymous")
+        cancel_token_var.set(token)
+        logger.info(f"开始执行任务 {job_id}，类型: {job['type']}")
+
+        progress = []
+
+        def on_progress(event, payload):
+            # 完整教案任务：记录已完成的阶段
+            if event == "stage_done":
+                progress.append(payload["stage"])
+                self._update(job_id, progress=list(progress))
+
+        try:
+            result = self.runner(job["type"], job["payload"], on_progress)
+            self._update(job_id, status="succeeded", result=result, finished_at=time.time())
+            logger.info(f"任务 {job_id} 执行成功")
+        except GenerationCancelled as e:
+            self._update(job_id, status="cancelled", error={**e.to_dict(), "status": e.status},
+                         finished_at=time.time())
+            logger.info(f"任务 {job_id} 已取消")
+        except GenerationError as e:
+            self._update(job_id, status="failed", error={**e.to_dict(), "status": e.status},
+                         finished_at=time.time())
+            logger.warning(f"任务 {job_id} 执行失败: {str(e)}")
+        except Exception as e:
+            self._update(job_id, status="failed", error={"error": "服务器内部错误", "details": str(e), "status": 500},
+                         finished_at=time.time())
+            raise
+        finally:
+            with self._tokens_lock:
+                self._tokens.pop(job_id, None)
+            cancel_token_var.set(None)
+
+    def stats(self):
+        return {"workers": self.workers, "queued": self._queue.qsize(), "max_queued": self._queue.maxsize}
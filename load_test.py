@@ -0,0 +1,210 @@
+"""生成接口压测（命令行入口，仅依赖标准库）
+
+以指定并发模拟用户按页面顺序依次调用四个生成接口（思维导图 -> 教学流程 -> 问题模拟 -> 教学评价），
+下游请求使用上游的真实结果；结束后按接口输出吞吐量和 p50/p95/p99 延迟。
+默认带 no_cache，避免结果缓存和相似教案复用影响测量。配合 mock_spark_server.py 可离线压测：
+
+    python mock_spark_server.py --port 9000 &
+    SPARK_URL=ws://127.0.0.1:9000/v1/x1 python app.py &
+    python load_test.py --url http://127.0.0.1:5000 --concurrency 16 --flows 64
+"""
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# (阶段, 接口路径, 结果字段, 下游请求的输入字段)
+FLOW = [
+    ("mindmap", "/generate_mindmap", "mindmap", "mindmap"),
+    ("teaching_flow", "/generate_teaching_flow", "teaching_flow", "teaching_flow"),
+    ("problem_simulation", "/generate_problem_simulation", "simulation", "simulation"),
+    ("evaluation", "/generate_evaluation", "evaluation", None),
+]
+
+# 跳过上游阶段时下游请求使用的示例输入
+SAMPLE_INPUTS = {
+    "mindmap": "<div class='mindmap'><h3>核心概念</h3><ul><li>概念1</li><li>概念2</li></ul></div>",
+    "teaching_flow": "<div class='teaching-flow'><h3>一、导入环节</h3><p class='time'>时间：5分钟</p>"
+                     "<ul><li>活动1</li></ul></div>",
+    "simulation": "<div class='problem-simulation'><h4>可能出现的问题</h4><ul><li>问题1</li></ul></div>",
+}
+
+
+def percentile(values, fraction):
+    """最近秩法分位数，values 需已排序"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class Recorder:
+    """按阶段记录每次请求的耗时和结果"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {stage: [] for stage, *_ in FLOW}  # 阶段 -> [(耗时, 首字节耗时, 状态码)]
+
+    def add(self, stage, elapsed, first_byte, status):
+        with self._lock:
+            self.samples[stage].append((elapsed, first_byte, status))
+
+    def report(self, wall_time):
+        """汇总结果：{阶段: {requests, errors, throughput, latency{p50,p95,p99,mean}, first_byte{...}}}"""
+        summary = {}
+        for stage, samples in list(self.samples.items()) + [("total", sum(self.samples.values(), []))]:
+            ok = sorted(elapsed for elapsed, _, status in samples if status == 200)
+            first = sorted(first_byte for _, first_byte, status in samples if status == 200 and first_byte is not None)
+            errors = {}
+            for _, _, status in samples:
+                if status != 200:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+            summary[stage] = {
+                "requests": len(samples),
+                "errors": errors,
+                "throughput": round(len(ok) / wall_time, 3) if wall_time else 0.0,
+                "latency": self._distribution(ok),
+                "first_byte": self._distribution(first),
+            }
+        return summary
+
+    @staticmethod
+    def _distribution(values):
+        if not values:
+            return None
+        return {
+            "p50": round(percentile(values, 0.5), 3),
+            "p95": round(percentile(values, 0.95), 3),
+            "p99": round(percentile(values, 0.99), 3),
+            "mean": round(sum(values) / len(values), 3),
+        }
+
+
+def post_json(url, body, timeout):
+    """POST JSON，返回 (状态码, 响应数据, 首字节耗时)"""
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            first = response.read(1)
+            first_byte = time.monotonic() - started
+            return response.status, json.loads(first + response.read()), first_byte
+    except urllib.error.HTTPError as e:
+        return e.code, None, None
+
+
+def post_stream(url, body, timeout, result_key):
+    """POST 流式接口，读取SSE直到 done 或 error 事件，返回 (状态码, 结果数据, 首个片段耗时)"""
+    request = urllib.request.Request(
+        url, data=json.dumps(body).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    started = time.monotonic()
+    first_chunk = None
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            event = None
+            for raw in response:
+                line = raw.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event: "):
+                    event = line[7:]
+                elif line.startswith("data: "):
+                    if event == "chunk" and first_chunk is None:
+                        first_chunk = time.monotonic() - started
+                    elif event == "done":
+                        data = json.loads(line[6:])
+                        return (200 if data.get(result_key) else 502), data, first_chunk
+                    elif event == "error":
+                        return json.loads(line[6:]).get("status", 500), None, first_chunk
+    except urllib.error.HTTPError as e:
+        return e.code, None, None
+    return 599, None, first_chunk  # 连接结束但没有收到 done 事件
+
+
+def run_flow(args, index, recorder):
+    """一个模拟用户依次完成四个阶段；某一阶段失败时放弃后续阶段"""
+    body = {
+        "course_title": f"{args.title} {index}",
+        "course_description": "压测课程",
+        "teaching_objectives": "掌握核心概念",
+        "no_cache": not args.cache,
+    }
+    if args.output_format:
+        body["output_format"] = args.output_format
+    for stage, path, result_key, next_key in FLOW:
+        if args.routes and stage not in args.routes:
+            if next_key:
+                body[next_key] = SAMPLE_INPUTS[next_key]
+            continue
+        started = time.monotonic()
+        try:
+            if args.stream:
+                status, data, first_byte = post_stream(args.url + path + "/stream", body, args.timeout, result_key)
+            else:
+                status, data, first_byte = post_json(args.url + path, body, args.timeout)
+        except (OSError, ValueError):
+            status, data, first_byte = 599, None, None
+        recorder.add(stage, time.monotonic() - started, first_byte, status)
+        if status != 200:
+            return
+        body = {key: body[key] for key in ("course_title", "no_cache", "output_format") if key in body}
+        if next_key:
+            body[next_key] = data[result_key]
+
+
+def print_report(summary, wall_time, flows, concurrency):
+    print(f"完成 {flows} 个流程，并发 {concurrency}，用时 {wall_time:.1f} 秒")
+    print(f"{'阶段':<20}{'请求':>6}{'错误':>6}{'吞吐(次/秒)':>12}{'p50':>9}{'p95':>9}{'p99':>9}{'均值':>9}{'首字节p50':>11}")
+    for stage, item in summary.items():
+        latency = item["latency"] or {}
+        first_byte = item["first_byte"] or {}
+        row = [latency.get(key) for key in ("p50", "p95", "p99", "mean")]
+        print(
+            f"{stage:<20}{item['requests']:>6}{sum(item['errors'].values()):>6}{item['throughput']:>12}"
+            + "".join(f"{value if value is not None else '-':>9}" for value in row)
+            + f"{first_byte.get('p50', '-'):>11}"
+        )
+        if item["errors"]:
+            print(f"{'':<20}错误状态码: {item['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成接口压测")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="应用地址")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行的模拟用户数")
+    parser.add_argument("--flows", type=int, default=32, help="模拟用户完成的流程总数")
+    parser.add_argument("--routes", nargs="+", choices=[stage for stage, *_ in FLOW],
+                        help="只压测指定阶段，跳过的上游阶段以示例内容作为输入")
+    parser.add_argument("--stream", action="store_true", help="调用流式接口，首字节耗时按首个片段计算")
+    parser.add_argument("--cache", action="store_true", help="允许命中结果缓存（默认带 no_cache）")
+    parser.add_argument("--output-format", choices=["html", "json"],
+                        help="请求的生成结果格式（默认使用应用的 SPARK_OUTPUT_FORMAT）")
+    parser.add_argument("--title", default="压测课程", help="课程标题前缀")
+    parser.add_argument("--timeout", type=float, default=300, help="单个请求的超时（秒）")
+    parser.add_argument("--json", action="store_true", help="以JSON输出汇总结果")
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+
+    recorder = Recorder()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(run_flow, args, index, recorder) for index in range(args.flows)]:
+            future.result()
+    wall_time = time.monotonic() - started
+
+    summary = recorder.report(wall_time)
+    if args.json:
+        print(json.dumps({"wall_time": round(wall_time, 3), "concurrency": args.concurrency,
+                          "flows": args.flows, "stages": summary}, ensure_ascii=False, indent=2))
+    else:
+        print_report(summary, wall_time, args.flows, args.concurrency)
+    return 0 if all(not item["errors"] for item in summary.values()) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Prometheus风格的进程内指标：注册表和应用使用的全部指标（/metrics 接口输出）"""
+import threading
+
+
+def _escape_label_value(value):
+    """按Prometheus文本格式转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    """Prometheus风格的指标（counter / gauge / histogram），按标签值分别计数"""
+
+    def __init__(self, name, help_text, kind, label_names=(), buckets=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets or ())
+        self._values = {}  # 标签值元组 -> 数值，histogram为 [各桶计数..., sum, count]
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.label_names, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + "}"
+
+    def render(self):
+        """输出Prometheus文本格式"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{self._format_labels(key)} {value}")
+                continue
+            for bound, count in zip(self.buckets, value):
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', bound))} {count}")
+            lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', '+Inf'))} {value[-1]}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {round(value[-2], 6)}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {value[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Metric(name, help_text, "counter", label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register(Metric(name, help_text, "gauge", label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=()):
+        return self._register(Metric(name, help_text, "histogram", label_names, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+METRIC_GENERATION_REQUESTS = metrics.counter(
+    "generation_requests_total", "生成请求数（按阶段和HTTP状态码）", ("route", "status"))
+METRIC_GENERATION_CANCELLED = metrics.counter(
+    "generation_cancelled_total", "被取消的生成（reason: disconnect 客户端断开 / job 取消任务）", ("route", "reason"))
+METRIC_SPARK_CALLS = metrics.counter(
+    "spark_calls_total", "发往星火API的调用数", ("route",))
+METRIC_SPARK_ERRORS = metrics.counter(
+    "spark_errors_total", "星火API调用错误数（code为header.code或timeout/connection）", ("route", "code"))
+METRIC_SPARK_INFLIGHT = metrics.gauge(
+    "spark_inflight_calls", "正在进行的星火API调用数", ("route",))
+METRIC_SPARK_CONNECT = metrics.histogram(
+    "spark_connect_seconds", "从发起调用到可以发送请求的耗时（source: cold 新建连接 / warm 预热连接 / warmer 预热线程建连）",
+    ("route", "source"), (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+METRIC_SPARK_WARM = metrics.counter(
+    "spark_warm_connections_total",
+    "预热连接的使用情况（hit 取到 / miss 无可用连接 / stale 已失效丢弃 / reclaimed 让出配额 / failed 建连失败）",
+    ("result",))
+METRIC_SPARK_WARM_READY = metrics.gauge("spark_warm_connections_ready", "当前可用的预热连接数")
+METRIC_SPARK_URL_SIGNATURES = metrics.gauge(
+    "spark_url_signatures", "鉴权URL签名次数（result: hit 同一秒内复用 / miss 重新签名）", ("result",))
+METRIC_SPARK_FIRST_TOKEN = metrics.histogram(
+    "spark_first_token_seconds", "从发起调用到收到首个片段的耗时", ("route",),
+    (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60))
+METRIC_SPARK_DURATION = metrics.histogram(
+    "spark_generation_seconds", "单次生成总耗时", ("route",),
+    (1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120))
+METRIC_FULL_PLAN_DURATION = metrics.histogram(
+    "full_plan_seconds", "完整教案端到端耗时（mode为serial/speculative）", ("mode",),
+    (10, 20, 30, 45, 60, 90, 120, 180, 240, 300))
+METRIC_SPARK_OUTPUT_CHARS = metrics.histogram(
+    "spark_output_chars", "单次生成输出字符数", ("route",),
+    (100, 250, 500, 1000, 2000, 4000, 8000, 16000))
+METRIC_POOL_IN_USE = metrics.gauge("spark_pool_in_use", "会话池使用中的会话数")
+METRIC_POOL_WAITING = metrics.gauge("spark_pool_waiting", "会话池排队等待的请求数")
+METRIC_SPARK_RETRIES = metrics.counter(
+    "spark_retries_total", "星火API重试次数（code为触发重试的错误码）", ("route", "code"))
+METRIC_CIRCUIT_STATE = metrics.gauge(
+    "spark_circuit_state", "熔断器状态：0关闭 1半开 2打开", ("upstream",))
+METRIC_CIRCUIT_REJECTIONS = metrics.counter(
+    "spark_circuit_rejections_total", "熔断期间被直接拒绝的调用数", ("upstream",))
+METRIC_QUOTA_WAIT = metrics.histogram(
+    "spark_quota_wait_seconds", "等待上游配额（连接数和速率）的耗时", ("route",),
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+METRIC_QUOTA_WAITING = metrics.gauge("spark_quota_waiting", "排队等待上游配额的调用数")
+METRIC_SPARK_CONNECTIONS = metrics.gauge("spark_connections_active", "已占用的上游连接配额")
+METRIC_SPARK_TIMEOUT = metrics.gauge(
+    "spark_timeout_seconds", "当前使用的星火调用超时（kind为total总时长/idle帧间隔）", ("route", "kind"))
+METRIC_SPARK_TOKENS = metrics.counter(
+    "spark_tokens_total", "星火API消耗的token数（type为prompt/completion）", ("route", "type"))
+METRIC_CACHE_LOOKUPS = metrics.counter(
+    "spark_cache_lookups_total", "生成结果缓存查询次数（result: hit 内存命中 / disk_hit 持久层命中 / miss 未命中）", ("result",))
+METRIC_SIMILAR_LOOKUPS = metrics.counter("similar_plan_lookups_total", "相似教案查询次数", ("result",))
+METRIC_STAGE_INPUT_TOKENS = metrics.counter(
+    "stage_input_tokens_total", "下游阶段输入的估算token数（kind为raw原始HTML/compact压缩后）", ("route", "kind"))
+METRIC_STRUCTURED_OUTPUT_ERRORS = metrics.counter(
+    "structured_output_errors_total", "结构化输出模式下JSON格式校验失败次数", ("route",))
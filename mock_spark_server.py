@@ -0,0 +1,244 @@
+"""本地模拟星火API（命令行入口）
+
+按星火X1的WebSocket协议（header / payload.choices，status 2 为最后一帧并附带usage）返回生成内容，
+用于离线开发和压测，不消耗真实配额。分片大小、帧间延迟和各类故障（错误码、中途断开、停止发送）均可配置。
+按系统提示识别阶段和输出格式：HTML模式返回对应容器的HTML，结构化输出模式（output_format=json）
+返回符合 structured_output.STAGE_FORMATS 的JSON。依赖 websockets 库（pip install websockets）。
+
+示例：
+    python mock_spark_server.py --port 9000 --delay 0.05 --error-rate 0.05
+    SPARK_URL=ws://127.0.0.1:9000/v1/x1 python app.py
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import random
+import sys
+import urllib.parse
+import uuid
+
+try:
+    import websockets
+except ImportError:  # 可选依赖，仅模拟服务需要
+    websockets = None
+
+from structured_output import STAGE_FORMATS
+
+
+# 各阶段的模拟内容：按系统提示中的容器类名（HTML模式）或JSON格式说明识别阶段，(容器, 标题标签, 标题列表)
+STAGE_TEMPLATES = [
+    ("mindmap", "h3", ["课程介绍", "教学目标", "核心概念", "关键知识点", "教学方法", "评估方式"]),
+    ("teaching-flow", "h3", ["一、导入环节", "二、知识讲解", "三、互动活动", "四、练习与实践", "五、总结与评价"]),
+    ("problem-simulation", "h4", ["可能出现的问题及解决方案", "学生可能提出的疑问", "预期学习效果", "教学难点分析"]),
+    ("evaluation", "h4", ["教学设计优点", "教学设计改进点", "具体优化建议"]),
+]
+
+# 与真实服务一致的错误帧：header.code 非0，status 为2
+ERROR_MESSAGES = {
+    10110: "服务繁忙，请稍后再试",
+    10222: "上游请求超时",
+    11200: "授权错误：鉴权失败",
+    11202: "授权错误：秒级流控超限",
+}
+
+
+# 容器类名 -> 结构化输出模式的格式定义
+JSON_FORMATS = {spec["container"]: spec for spec in STAGE_FORMATS.values()}
+
+
+def build_answer(system_prompt, length, rng):
+    """按阶段生成约 length 个字符的回答（前后带一句说明文字，与真实模型的输出习惯一致）"""
+    for container, heading, titles in STAGE_TEMPLATES:
+        if f"class='{container}'" in system_prompt:
+            body = build_html(container, heading, titles, length, rng)
+            break
+        if JSON_FORMATS[container]["instructions"] in system_prompt:
+            body = build_json(container, titles, length, rng)
+            break
+    else:
+        return "好的。" + "这是模拟的回答内容。" * max(1, length // 10)
+    return "以下是生成的内容：\n" + body + "\n希望对您有帮助。"
+
+
+def build_html(container, heading, titles, length, rng):
+    parts = [f"<div class='{container}'>"]
+    size = len(parts[0])
+    index = 0
+    while size < length:
+        title = titles[index % len(titles)]
+        items = "".join(f"<li>{title}要点{index + 1}.{item + 1}：模拟内容</li>" for item in range(rng.randint(2, 4)))
+        part = f"<{heading}>{title}</{heading}>"
+        if container == "teaching-flow":
+            part += f"<p class='time'>时间：{rng.choice([5, 10, 15])}分钟</p>"
+        part += f"<ul>{items}</ul>"
+        parts.append(part)
+        size += len(part)
+        index += 1
+    if container == "problem-simulation":
+        parts.append("<script id='chart-data'>{'labels':['知识理解','实践应用','参与度','思维能力','合作交流'],"
+                     "'datasets':[{'label':'预期效果','data':[8,7,9,7,8]}]}</script>")
+    elif container == "evaluation":
+        parts.append(f"<div id='rating-data'>{{'score': {rng.randint(6, 9)}, 'description': '模拟评分'}}</div>")
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def build_json(container, titles, length, rng):
+    """按 STAGE_FORMATS 的结构生成JSON回答，列表项数量与HTML模式相当"""
+    items = []
+    size = 0
+    index = 0
+    while size < length:
+        title = titles[index % len(titles)]
+        points = [f"{title}要点{index + 1}.{item + 1}：模拟内容" for item in range(rng.randint(2, 4))]
+        if container == "teaching-flow":
+            item = {"title": title, "minutes": rng.choice([5, 10, 15]), "activities": points, "resources": ["模拟资源"]}
+        else:
+            item = {"title": title, "items": points}
+        items.append(item)
+        size += len(json.dumps(item, ensure_ascii=False))
+        index += 1
+    answer = {JSON_FORMATS[container]["list_key"]: items}
+    if container == "problem-simulation":
+        answer["chart"] = {"labels": ["知识理解", "实践应用", "参与度", "思维能力", "合作交流"],
+                           "datasets": [{"label": "预期效果", "data": [8, 7, 9, 7, 8]}]}
+    elif container == "evaluation":
+        answer["rating"] = {"score": rng.randint(6, 9), "description": "模拟评分"}
+    return json.dumps(answer, ensure_ascii=False)
+
+
+def check_signature(path, api_key, api_secret, host):
+    """校验连接URL中的鉴权参数，规则与 app.signed_spark_url 相同"""
+    url = urllib.parse.urlparse(path)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    try:
+        authorization = base64.b64decode(query["authorization"]).decode("utf-8")
+    except (KeyError, ValueError):
+        return False
+    origin = f"host: {query.get('host', host)}\ndate: {query.get('date', '')}\nGET {url.path} HTTP/1.1"
+    signature = base64.b64encode(
+        hmac.new(api_secret.encode("utf-8"), origin.encode("utf-8"), digestmod=hashlib.sha256).digest()
+    ).decode("utf-8")
+    return f'api_key="{api_key}"' in authorization and f'signature="{signature}"' in authorization
+
+
+def frame(sid, seq, status, content=None, usage=None, code=0, message="Success"):
+    header = {"code": code, "message": message, "sid": sid, "status": status}
+    if code:
+        return json.dumps({"header": header}, ensure_ascii=False)
+    payload = {"choices": {"status": status, "seq": seq, "text": [
+        {"content": content or "", "role": "assistant", "index": 0}
+    ]}}
+    if usage:
+        payload["usage"] = {"text": usage}
+    return json.dumps({"header": header, "payload": payload}, ensure_ascii=False)
+
+
+class MockSparkServer:
+    """模拟服务：每个连接接收一次请求，分片返回回答后关闭"""
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+    def _sleep(self, seconds):
+        jitter = self.args.jitter
+        return asyncio.sleep(max(0.0, seconds * (1 + self.rng.uniform(-jitter, jitter))))
+
+    async def handle(self, ws):
+        args = self.args
+        sid = "mock" + uuid.uuid4().hex[:16]
+        request = getattr(ws, "request", None)
+        path = request.path if request is not None else getattr(ws, "path", "")
+
+        if args.api_secret and not check_signature(path, args.api_key, args.api_secret, f"{args.host}:{args.port}"):
+            await ws.send(frame(sid, 0, 2, code=11200, message=ERROR_MESSAGES[11200]))
+            return
+
+        try:
+            params = json.loads(await ws.recv())
+            messages = params["payload"]["message"]["text"]
+        except (ValueError, KeyError, TypeError):
+            await ws.send(frame(sid, 0, 2, code=10163, message="请求参数错误"))
+            return
+
+        roll = self.rng.random()
+        if roll < args.error_rate:
+            await self._sleep(args.first_token_delay)
+            await ws.send(frame(sid, 0, 2, code=args.error_code, message=ERROR_MESSAGES.get(args.error_code, "模拟错误")))
+            return
+        roll -= args.error_rate
+        fault = None
+        if roll < args.disconnect_rate:
+            fault = "disconnect"
+        elif roll < args.disconnect_rate + args.stall_rate:
+            fault = "stall"
+
+        system_prompt = messages[0]["content"] if messages and messages[0].get("role") == "system" else ""
+        answer = build_answer(system_prompt, args.length, self.rng)
+        chunks = [answer[i:i + args.chunk_size] for i in range(0, len(answer), args.chunk_size)]
+        # 故障发生在回答中途，调用方此前已收到部分内容
+        fault_at = len(chunks) // 2 if fault else None
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 2
+
+        await self._sleep(args.first_token_delay)
+        for seq, chunk in enumerate(chunks):
+            if seq == fault_at:
+                if fault == "stall":
+                    await asyncio.sleep(args.stall_seconds)
+                return  # 不发送结束帧直接关闭连接
+            last = seq == len(chunks) - 1
+            usage = None
+            if last:
+                completion_tokens = len(answer) // 2
+                usage = {
+                    "question_tokens": prompt_tokens,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+            await ws.send(frame(sid, seq, 2 if last else 1, chunk, usage))
+            if not last:
+                await self._sleep(args.delay)
+
+    async def serve(self):
+        async with websockets.serve(self.handle, self.args.host, self.args.port, max_size=None):
+            print(f"模拟星火服务已启动: ws://{self.args.host}:{self.args.port}{self.args.path}", file=sys.stderr)
+            await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟星火API WebSocket服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--path", default="/v1/x1", help="仅用于显示连接地址，任意路径均可连接")
+    parser.add_argument("--length", type=int, default=1200, help="每次回答的大致字符数")
+    parser.add_argument("--chunk-size", type=int, default=8, help="每帧的字符数")
+    parser.add_argument("--delay", type=float, default=0.05, help="帧间延迟（秒）")
+    parser.add_argument("--first-token-delay", type=float, default=0.5, help="收到请求到首帧的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟的随机浮动比例")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误码的概率")
+    parser.add_argument("--error-code", type=int, default=10110, help="返回的错误码")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="回答中途断开连接的概率")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="回答中途停止发送的概率")
+    parser.add_argument("--stall-seconds", type=float, default=120, help="停止发送后保持连接的秒数")
+    parser.add_argument("--api-key", default="", help="与 --api-secret 一起指定时校验连接URL的签名")
+    parser.add_argument("--api-secret", default="")
+    parser.add_argument("--seed", type=int, help="随机种子，固定后回答内容和故障序列可复现")
+    args = parser.parse_args()
+
+    if websockets is None:
+        print("未安装websockets库，请先执行 pip install websockets", file=sys.stderr)
+        return 1
+    try:
+        asyncio.run(MockSparkServer(args).serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""完整教案的PDF/DOCX渲染（纯Python，仅依赖标准库）
+
+渲染函数不依赖Flask应用，可以在进程池中执行：
+    render_document("pdf", plan) -> bytes
+plan 包含 course_title、course_description、teaching_objectives 以及
+mindmap、teaching_flow、simulation、evaluation 四个HTML片段，以及文档中显示的 generated_at。
+"""
+import zipfile
+from datetime import datetime
+from html.parser import HTMLParser
+from io import BytesIO
+from xml.sax.saxutils import escape as xml_escape
+
+# 与导出HTML一致的章节顺序
+PLAN_SECTIONS = [
+    ("mindmap", "一、思维导图"),
+    ("teaching_flow", "二、教学流程"),
+    ("simulation", "三、问题模拟与预期效果"),
+    ("evaluation", "四、评价与优化建议"),
+]
+
+# 不输出文字内容的元素（雷达图和评分数据）
+SKIP_IDS = {"chart-data", "rating-data"}
+
+
+class _BlockParser(HTMLParser):
+    """把AI生成的HTML片段转换为块列表 (类型, 文本, 列表层级)"""
+
+    BLOCK_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6", "p", "li", "div"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks = []
+        self._text = []
+        self._kind = "p"
+        self._list_depth = 0
+        self._skip_depth = 0
+
+    def _flush(self):
+        text = " ".join("".join(self._text).split())
+        if text:
+            self.blocks.append((self._kind, text, self._list_depth))
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_depth:
+            self._skip_depth += 1
+            return
+        if tag in ("script", "style") or dict(attrs).get("id") in SKIP_IDS:
+            self._flush()
+            self._skip_depth = 1
+            return
+        if tag in ("ul", "ol"):
+            self._flush()
+            self._list_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+            self._kind = "h4" if tag in ("h5", "h6") else "p" if tag == "div" else tag
+        elif tag == "br":
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if self._skip_depth:
+            self._skip_depth -= 1
+            return
+        if tag in ("ul", "ol"):
+            self._flush()
+            self._list_depth = max(0, self._list_depth - 1)
+            self._kind = "li" if self._list_depth else "p"
+        elif tag in self.BLOCK_TAGS:
+            self._flush()
+            self._kind = "li" if self._list_depth else "p"
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._text.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def html_to_blocks(fragment):
+    """解析HTML片段，返回 [(类型, 文本, 列表层级)]"""
+    parser = _BlockParser()
+    parser.feed(fragment or "")
+    parser.close()
+    return parser.blocks
+
+
+def plan_blocks(plan):
+    """完整教案的块列表，结构与导出的HTML文档一致
+
+    生成时间取自 plan["generated_at"]，由调用方传入，使其参与渲染结果缓存的键。
+    """
+    blocks = [
+        ("h1", f"{plan['course_title']} - 完整教案", 0),
+        ("h3", "课程描述", 0),
+        ("p", plan.get("course_description") or "无描述", 0),
+        ("h3", "教学目标", 0),
+        ("p", plan.get("teaching_objectives") or "无目标描述", 0),
+    ]
+    for key, heading in PLAN_SECTIONS:
+        blocks.append(("h2", heading, 0))
+        blocks.extend(html_to_blocks(plan.get(key, "")))
+    generated_at = plan.get("generated_at") or datetime.now().strftime('%Y年%m月%d日 %H:%M:%S')
+    blocks.append(("p", f"生成时间：{generated_at}", 0))
+    return blocks
+
+
+# ---------------------------------------------------------------------------
+# PDF：使用阅读器内置的 STSong-Light 中文字体（Adobe-GB1），无需嵌入字体文件
+# ---------------------------------------------------------------------------
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4，单位pt
+MARGIN = 56
+
+# 类型 -> (字号, 段前间距, RGB颜色)
+PDF_STYLES = {
+    "h1": (20, 6, (0.09, 0.36, 1.0)),
+    "h2": (16, 18, (0.11, 0.31, 0.85)),
+    "h3": (13, 12, (0.15, 0.39, 0.92)),
+    "h4": (12, 10, (0.23, 0.51, 0.96)),
+    "p": (11, 6, (0.2, 0.2, 0.2)),
+    "li": (11, 4, (0.2, 0.2, 0.2)),
+}
+
+
+def _char_width(char, size):
+    """估算字符宽度：CJK等全角字符占一个字号，其余占半个"""
+    return size if ord(char) > 0x2000 else size * 0.5
+
+
+def _wrap(text, size, width):
+    """按可用宽度折行"""
+    lines, line, used = [], [], 0.0
+    for char in text:
+        char_width = _char_width(char, size)
+        if line and used + char_width > width:
+            lines.append("".join(line))
+            line, used = [], 0.0
+        line.append(char)
+        used += char_width
+    if line:
+        lines.append("".join(line))
+    return lines
+
+
+def _pdf_text(text):
+    """文本编码为UCS-2大端十六进制串（UniGB-UCS2-H），超出BMP的字符替换为问号"""
+    return "".join(f"{ord(char) if ord(char) <= 0xFFFF else 0x3F:04X}" for char in text)
+
+
+def render_pdf(plan):
+    """渲染完整教案PDF"""
+    pages = []
+    commands = []
+    y = PAGE_HEIGHT - MARGIN
+
+    for kind, text, depth in plan_blocks(plan):
+        size, space_before, color = PDF_STYLES.get(kind, PDF_STYLES["p"])
+        indent = 16 * depth
+        if kind == "li":
+            text = "• " + text
+        leading = size * 1.5
+        for index, line in enumerate(_wrap(text, size, PAGE_WIDTH - 2 * MARGIN - indent)):
+            y -= leading + (space_before if index == 0 else 0)
+            if y < MARGIN:
+                pages.append(commands)
+                commands = []
+                y = PAGE_HEIGHT - MARGIN - leading
+            commands.append(
+                f"BT {color[0]} {color[1]} {color[2]} rg /F1 {size} Tf "
+                f"{MARGIN + indent} {y:.1f} Td <{_pdf_text(line)}> Tj ET"
+            )
+    pages.append(commands)
+
+    # 对象编号：1目录 2页面树 3-5字体，之后每页两个对象（页面、内容流）
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        "<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H "
+        "/DescendantFonts [4 0 R] >>",
+        "<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+        "/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> "
+        "/FontDescriptor 5 0 R /DW 1000 /W [1 95 500] >>",
+        "<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880] "
+        "/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>",
+    ]
+    page_refs = []
+    for commands in pages:
+        page_number = len(objects) + 1
+        content = "\n".join(commands).encode("latin-1")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_number + 1} 0 R >>"
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        page_refs.append(f"{page_number} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+
+    output = BytesIO()
+    output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        if isinstance(body, str):
+            body = body.encode("latin-1")
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
+
+
+# ---------------------------------------------------------------------------
+# DOCX：最小化的 WordprocessingML 包
+# ---------------------------------------------------------------------------
+
+# 类型 -> (字号（半磅）, 是否加粗, 颜色)
+DOCX_STYLES = {
+    "h1": (40, True, "165DFF"),
+    "h2": (32, True, "1D4ED8"),
+    "h3": (26, True, "2563EB"),
+    "h4": (24, True, "3B82F6"),
+    "p": (22, False, "333333"),
+    "li": (22, False, "333333"),
+}
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+
+DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+
+def _docx_paragraph(kind, text, depth):
+    size, bold, color = DOCX_STYLES.get(kind, DOCX_STYLES["p"])
+    paragraph_props = '<w:jc w:val="center"/>' if kind == "h1" else ""
+    if kind == "li":
+        text = "• " + text
+        paragraph_props += f'<w:ind w:left="{360 * max(depth, 1)}"/>'
+    run_props = (
+        '<w:rFonts w:ascii="Microsoft YaHei" w:hAnsi="Microsoft YaHei" w:eastAsia="Microsoft YaHei"/>'
+        + ("<w:b/>" if bold else "")
+        + f'<w:color w:val="{color}"/><w:sz w:val="{size}"/><w:szCs w:val="{size}"/>'
+    )
+    return (
+        f"<w:p><w:pPr>{paragraph_props}<w:spacing w:after=\"120\"/></w:pPr>"
+        f"<w:r><w:rPr>{run_props}</w:rPr><w:t xml:space=\"preserve\">{xml_escape(text)}</w:t></w:r></w:p>"
+    )
+
+
+def render_docx(plan):
+    """渲染完整教案DOCX"""
+    body = "".join(_docx_paragraph(kind, text, depth) for kind, text, depth in plan_blocks(plan))
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{body}<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+        '<w:pgMar w:top="1440" w:right="1200" w:bottom="1440" w:left="1200"/></w:sectPr></w:body>'
+        '</w:document>'
+    )
+    output = BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        package.writestr("_rels/.rels", DOCX_RELS)
+        package.writestr("word/document.xml", document)
+    return output.getvalue()
+
+
+RENDERERS = {
+    "pdf": render_pdf,
+    "docx": render_docx,
+}
+
+
+def render_document(fmt, plan):
+    """按格式渲染完整教案，返回文件内容"""
+    return RENDERERS[fmt](plan)
@@ -0,0 +1,222 @@
+"""教案存储：课程信息和四个阶段的生成结果按教案ID保存在SQLite中，支持键集分页和FTS5全文检索"""
+import base64
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+from plan_render import html_to_blocks
+
+PLAN_META_FIELDS = ("course_title", "course_description", "teaching_objectives")
+PLAN_SECTION_FIELDS = ("mindmap", "teaching_flow", "simulation", "evaluation")
+PLAN_FIELDS = PLAN_META_FIELDS + PLAN_SECTION_FIELDS
+PLAN_SEARCH_SECTIONS = ("mindmap", "teaching_flow")  # 参与全文检索的生成内容
+
+# 检索分词：连续的中文字符和连续的字母数字
+_SEARCH_RUN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[0-9A-Za-z]+')
+
+
+def bigram_tokens(text):
+    """检索分词：中文按相邻两字切成二元组，单个汉字保留原样；字母数字按整词小写"""
+    tokens = []
+    for run in _SEARCH_RUN_RE.findall(text or ''):
+        if run.isascii():
+            tokens.append(run.lower())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def build_search_query(text):
+    """把用户输入转换为FTS5查询：空格分隔的每个词都必须出现，词内二元组按短语匹配"""
+    clauses = []
+    for term in text.split():
+        tokens = bigram_tokens(term)
+        if len(tokens) == 1 and len(tokens[0]) == 1 and not tokens[0].isascii():
+            # 单个汉字：匹配以该字开头的二元组
+            clauses.append(f'"{tokens[0]}"*')
+        elif tokens:
+            clauses.append('"' + " ".join(tokens) + '"')
+    return " AND ".join(clauses)
+
+
+class PlanStore:
+    """SQLite教案存储
+
+    列表按 (created_at, id) 做键集分页，翻页代价与页码无关；标题筛选按前缀匹配，
+    两种查询都有对应索引。全文检索使用FTS5，文本预先切分为中文二元组后写入，
+    rowid 与 plans 表一致。
+    """
+
+    def __init__(self, db_path, search_candidates=2000):
+        self.search_candidates = search_candidates  # 检索时参与相关度排序的最新匹配数
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS plans ("
+            "id TEXT PRIMARY KEY, course_title TEXT NOT NULL, course_description TEXT NOT NULL DEFAULT '', "
+            "teaching_objectives TEXT NOT NULL DEFAULT '', mindmap TEXT, teaching_flow TEXT, "
+            "simulation TEXT, evaluation TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_plans_created ON plans (created_at, id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_plans_title_created ON plans (course_title, created_at, id)")
+        indexed = self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'plans_fts'").fetchone()
+        self._db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS plans_fts USING fts5("
+            "course_title, course_description, teaching_objectives, content, "
+            # 单字前缀索引，单个汉字的检索不必扫描全部二元组
+            "tokenize='unicode61', prefix='1')"
+        )
+        if not indexed:
+            # 已有数据库首次启用检索时补建索引
+            for row in self._db.execute("SELECT rowid, * FROM plans").fetchall():
+                self._index(row["rowid"], dict(row))
+        self._db.commit()
+
+    def _index(self, rowid, plan):
+        """写入检索索引（调用方需持有锁并负责提交）"""
+        content = " ".join(
+            text for key in PLAN_SEARCH_SECTIONS for _, text, _ in html_to_blocks(plan.get(key) or "")
+        )
+        columns = [plan.get(key) or "" for key in PLAN_META_FIELDS] + [content]
+        self._db.execute("DELETE FROM plans_fts WHERE rowid = ?", (rowid,))
+        self._db.execute(
+            "INSERT INTO plans_fts (rowid, course_title, course_description, teaching_objectives, content) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (rowid, *(" ".join(bigram_tokens(column)) for column in columns))
+        )
+
+    def create(self, **fields):
+        """新建教案，返回教案字典"""
+        now = time.time()
+        plan = {
+            "id": uuid.uuid4().hex,
+            "course_title": fields.get("course_title") or "未命名课程",
+            "course_description": fields.get("course_description") or "",
+            "teaching_objectives": fields.get("teaching_objectives") or "",
+            **{key: fields.get(key) or None for key in PLAN_SECTION_FIELDS},
+            "created_at": now,
+            "updated_at": now
+        }
+        columns = ", ".join(plan)
+        placeholders = ", ".join("?" for _ in plan)
+        with self._lock:
+            cursor = self._db.execute(f"INSERT INTO plans ({columns}) VALUES ({placeholders})", tuple(plan.values()))
+            self._index(cursor.lastrowid, plan)
+            self._db.commit()
+        return plan
+
+    def update(self, plan_id, **fields):
+        """更新教案字段，教案不存在时返回False"""
+        fields = {
+            key: (value or None) if key in PLAN_SECTION_FIELDS else value
+            for key, value in fields.items() if key in PLAN_FIELDS
+        }
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            cursor = self._db.execute(f"UPDATE plans SET {assignments} WHERE id = ?", (*fields.values(), plan_id))
+            if cursor.rowcount and any(key in fields for key in PLAN_META_FIELDS + PLAN_SEARCH_SECTIONS):
+                row = self._db.execute("SELECT rowid, * FROM plans WHERE id = ?", (plan_id,)).fetchone()
+                self._index(row["rowid"], dict(row))
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def get(self, plan_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM plans WHERE id = ?", (plan_id,)).fetchone()
+        return dict(row) if row else None
+
+    def delete(self, plan_id):
+        with self._lock:
+            self._db.execute("DELETE FROM plans_fts WHERE rowid = (SELECT rowid FROM plans WHERE id = ?)", (plan_id,))
+            cursor = self._db.execute("DELETE FROM plans WHERE id = ?", (plan_id,))
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def encode_cursor(plan):
+        raw = json.dumps([plan["created_at"], plan["id"]])
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """解析分页游标，格式错误时抛出ValueError"""
+        try:
+            created_at, plan_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return float(created_at), str(plan_id)
+        except Exception:
+            raise ValueError("无效的分页游标")
+
+    def list(self, title="", limit=20, cursor=None):
+        """按创建时间倒序列出教案摘要，返回 (教案列表, 下一页游标)"""
+        sections = ", ".join(f"{key} IS NOT NULL AS has_{key}" for key in PLAN_SECTION_FIELDS)
+        sql = f"SELECT id, course_title, created_at, updated_at, {sections} FROM plans"
+        conditions, params = [], []
+        if title:
+            # 前缀范围查询，可以使用标题索引
+            conditions.append("course_title >= ? AND course_title < ?")
+            params += [title, title + "\U0010ffff"]
+        if cursor:
+            created_at, plan_id = self.decode_cursor(cursor)
+            conditions.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params += [created_at, created_at, plan_id]
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+
+        plans = [self._summary(row) for row in rows[:limit]]
+        next_cursor = self.encode_cursor(plans[-1]) if len(rows) > limit else None
+        return plans, next_cursor
+
+    def search(self, text, limit=20):
+        """全文检索教案，按相关度（标题权重最高）返回摘要列表
+
+        常见词可能匹配大量教案，对全部匹配计算bm25代价与匹配数成正比；这里只对最新的
+        search_candidates 条匹配排序，查询耗时与库的规模无关。
+        """
+        query = build_search_query(text)
+        if not query:
+            return []
+        sections = ", ".join(f"p.{key} IS NOT NULL AS has_{key}" for key in PLAN_SECTION_FIELDS)
+        with self._lock:
+            # 候选窗口的下界：按rowid倒序的第N条匹配
+            boundary = self._db.execute(
+                "SELECT rowid FROM plans_fts WHERE plans_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (query, self.search_candidates - 1)
+            ).fetchone()
+            rows = self._db.execute(
+                f"SELECT p.id, p.course_title, p.created_at, p.updated_at, {sections}, ranked.score FROM ("
+                "SELECT rowid, bm25(plans_fts, 10.0, 3.0, 3.0, 1.0) AS score FROM plans_fts "
+                "WHERE plans_fts MATCH ? AND rowid >= ? ORDER BY score LIMIT ?"
+                ") AS ranked JOIN plans p ON p.rowid = ranked.rowid ORDER BY ranked.score",
+                (query, boundary[0] if boundary else 0, limit)
+            ).fetchall()
+        return [self._summary(row) for row in rows]
+
+    def recent(self, limit, section="mindmap"):
+        """最近创建且已有指定阶段结果的教案（仅课程信息），按创建时间正序返回"""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, course_title, course_description, teaching_objectives FROM plans "
+                f"WHERE {section} IS NOT NULL ORDER BY created_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    @staticmethod
+    def _summary(row):
+        """教案摘要：has_<阶段> 列合并为已完成阶段列表"""
+        plan = dict(row)
+        plan["stages"] = [key for key in PLAN_SECTION_FIELDS if plan.pop(f"has_{key}")]
+        return plan
@@ -0,0 +1,127 @@
+"""上游调用配额：令牌桶限速和并发连接数上限"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import METRIC_QUOTA_WAIT, METRIC_QUOTA_WAITING, METRIC_SPARK_CONNECTIONS
+from request_context import check_cancelled
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """令牌桶限速器：按rate匀速补充令牌，最多积累burst个；令牌不足时阻塞等待"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """尝试取得一个令牌：成功返回0，否则返回还需等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """取得一个令牌，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if delay == 0:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+class SparkQuota:
+    """星火API调用配额：并发连接数上限 + 每秒连接数（令牌桶）
+
+    超出配额的调用排队等待而不是被拒绝；同步调用阻塞等待，异步调用通过 try_acquire 轮询。
+    名额用尽时先调用 reclaim（如预热连接的 reclaim），让闲置占用的名额优先让给正在发起的调用。
+    """
+
+    def __init__(self, rate, burst, max_connections):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_connections = max_connections
+        self.reclaim = None  # 释放一个闲置名额，释放了返回True
+        self._active = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+
+    def _full(self):
+        """连接名额已用尽且没有可让出的闲置名额（调用方需持有锁）"""
+        if self._active < self.max_connections:
+            return False
+        return not (self.reclaim and self.reclaim())
+
+    def _take_slot(self):
+        """占用一个连接名额（调用方需持有锁）"""
+        self._active += 1
+        METRIC_SPARK_CONNECTIONS.set(self._active)
+
+    def acquire(self, route):
+        """阻塞直到取得连接名额和速率令牌，返回等待的秒数"""
+        started = time.monotonic()
+        with self._cond:
+            self._waiting += 1
+            METRIC_QUOTA_WAITING.set(self._waiting)
+            try:
+                while self._full():
+                    self._cond.wait(0.5)
+                    check_cancelled(route)
+                self._take_slot()
+            finally:
+                self._waiting -= 1
+                METRIC_QUOTA_WAITING.set(self._waiting)
+        self.bucket.acquire()
+        waited = time.monotonic() - started
+        METRIC_QUOTA_WAIT.observe(waited, route=route)
+        return waited
+
+    def try_acquire(self):
+        """非阻塞地尝试取得连接名额和速率令牌：成功返回0，否则返回建议的等待秒数"""
+        with self._cond:
+            if self._full():
+                return 0.05
+            delay = self.bucket.try_acquire()
+            if delay:
+                return delay
+            self._take_slot()
+            return 0.0
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            METRIC_SPARK_CONNECTIONS.set(self._active)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, route):
+        """在配额内执行一次上游调用"""
+        waited = self.acquire(route)
+        if waited > 0.1:
+            logger.info(f"等待上游配额 {waited:.2f}秒")
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "rate": self.bucket.rate,
+                "max_connections": self.max_connections,
+                "active": self._active,
+                "waiting": self._waiting
+            }
@@ -0,0 +1,106 @@
+"""请求上下文：请求ID、用户、取消标记（CancelToken）以及生成失败/取消的异常
+
+后台线程通过 in_current_context 沿用发起请求时的上下文，取消检查和等待都读取当前上下文的取消标记。
+"""
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import METRIC_GENERATION_CANCELLED
+
+# 当前请求ID，日志记录自动携带
+request_id_var = contextvars.ContextVar("request_id", default="-")
+# 发起请求的用户（X-User-ID请求头），用于用量统计和星火请求的uid
+user_id_var = contextvars.ContextVar("user_id", default="anonymous")
+# 当前生成的取消标记（CancelToken），客户端断开或任务被取消时触发
+cancel_token_var = contextvars.ContextVar("cancel_token", default=None)
+
+
+def in_current_context(target):
+    """让后台线程沿用当前请求的上下文（请求ID）"""
+    return functools.partial(contextvars.copy_context().run, target)
+
+
+class CancelToken:
+    """协作式取消标记：cancel() 时执行已注册的回调（如关闭上游连接），可跨线程使用
+
+    回调在锁内执行，on_cancel 的上下文退出后回调不会再被调用，会话可以安全地交给下一个请求。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._event = threading.Event()
+        self._callbacks = []
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        """触发取消，返回是否为首次取消"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            for callback in self._callbacks:
+                callback()
+        return True
+
+    def wait(self, timeout):
+        """最多等待timeout秒，被取消时提前返回True"""
+        return self._event.wait(timeout)
+
+    @contextmanager
+    def on_cancel(self, callback):
+        """在上下文内注册取消回调；已经取消时立即执行"""
+        with self._lock:
+            if self._event.is_set():
+                callback()
+            else:
+                self._callbacks.append(callback)
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+
+def sleep_unless_cancelled(seconds):
+    """等待指定秒数，当前生成被取消时提前返回"""
+    token = cancel_token_var.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.wait(seconds)
+
+
+class GenerationError(Exception):
+    """生成失败，携带返回给前端的HTTP状态码和附加字段"""
+
+    def __init__(self, message, status=500, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+    def to_dict(self):
+        return {"error": str(self), **self.extra}
+
+
+class GenerationCancelled(GenerationError):
+    """生成被取消（客户端断开或任务被取消），状态码沿用常见的499"""
+
+    def __init__(self, message="生成已取消"):
+        super().__init__(message, 499)
+
+
+def check_cancelled(route):
+    """当前生成已被取消时抛出GenerationCancelled"""
+    token = cancel_token_var.get()
+    if token is not None and token.cancelled:
+        METRIC_GENERATION_CANCELLED.inc(route=route, reason=token.reason)
+        raise GenerationCancelled()
@@ -0,0 +1,134 @@
+"""生成结果缓存：内存LRU + 可选的SQLite持久层"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class SparkResponseCache:
+    """星火生成结果缓存
+
+    以prompt消息列表和对话参数（domain、temperature、max_tokens）的哈希为键；
+    内存中按LRU淘汰，可选SQLite持久层，两层都按TTL过期。指定 metric 时每次查询按结果
+    （hit / disk_hit / miss）累加该计数器。
+    """
+
+    def __init__(self, max_entries, ttl, db_path="", db_max_entries=10000, metric=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_max_entries = db_max_entries
+        self.metric = metric
+        self._entries = OrderedDict()  # key -> (过期时间, 结果)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS spark_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_spark_cache_accessed ON spark_cache (accessed_at)")
+            self._db.commit()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self._db is not None
+
+    @staticmethod
+    def make_key(messages, chat_params):
+        """根据消息列表和对话参数计算缓存键"""
+        chat = {k: v for k, v in chat_params.items() if k != "stream"}
+        raw = json.dumps({"messages": messages, "chat": chat}, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """查询缓存，未命中或已过期返回None"""
+        result, value = self._lookup(key)
+        if self.metric is not None:
+            self.metric.inc(result=result)
+        return value
+
+    def _lookup(self, key):
+        """返回 (查询结果, 缓存值)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return "hit", value
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM spark_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._db.execute("UPDATE spark_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.disk_hits += 1
+                    return "disk_hit", row[0]
+
+            self.misses += 1
+            return "miss", None
+
+    def set(self, key, value):
+        """写入缓存"""
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO spark_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, expires_at, now)
+                )
+                # 清理过期条目，并按最近访问时间淘汰超出上限的条目
+                self._db.execute("DELETE FROM spark_cache WHERE expires_at <= ?", (now,))
+                self._db.execute(
+                    "DELETE FROM spark_cache WHERE key IN ("
+                    "SELECT key FROM spark_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.db_max_entries,)
+                )
+                self._db.commit()
+
+    def _remember(self, key, expires_at, value):
+        """写入内存LRU（调用方需持有锁）"""
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM spark_cache")
+                self._db.commit()
+
+    def stats(self):
+        """缓存命中统计"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "disk_enabled": self._db is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            }
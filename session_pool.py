@@ -0,0 +1,165 @@
+"""星火API会话池：并发上限、排队背压，调用经过缓存、配额、熔断和重试"""
+import contextlib
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+from request_context import check_cancelled, sleep_unless_cancelled
+from spark_resilience import SparkCallFailedError, SparkPoolBusyError
+
+logger = logging.getLogger(__name__)
+
+
+class SparkSessionPool:
+    """SparkWebSocket会话池
+
+    每个会话同一时刻只服务一个请求，调用状态（parts/messages/event）互不干扰；
+    会话全部占用时请求排队等待，排队数超过上限或等待超时则拒绝（背压）。
+    可重试的失败按 retry（RetryPolicy）退避重试，所有调用经过熔断器；
+    不再重试的失败抛出SparkCallFailedError，不完整的结果既不返回也不缓存。
+    """
+
+    def __init__(self, factory, size, max_waiting, acquire_timeout, cache=None, breaker=None, quota=None,
+                 retry=None):
+        self.size = size
+        self.max_waiting = max_waiting
+        self.acquire_timeout = acquire_timeout
+        self._sessions = queue.LifoQueue()
+        for _ in range(size):
+            self._sessions.put(factory())
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_use = 0
+        self.cache = cache
+        self.breaker = breaker
+        self.quota = quota
+        self.retry = retry
+        # 仅用于计算请求参数（缓存键），不发起连接
+        self._reference = factory()
+
+    @contextmanager
+    def session(self):
+        """借出一个空闲会话，使用完毕后自动归还"""
+        with self._lock:
+            if self._in_use >= self.size and self._waiting >= self.max_waiting:
+                logger.warning(f"会话池排队已满: 使用中 {self._in_use}, 排队 {self._waiting}")
+                raise SparkPoolBusyError("服务繁忙，请稍后重试")
+            self._waiting += 1
+        try:
+            session = self._sessions.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            logger.warning(f"等待空闲会话超时（{self.acquire_timeout}秒）")
+            raise SparkPoolBusyError("服务繁忙，请稍后重试")
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield session
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._sessions.put(session)
+
+    def _quota_slot(self, route):
+        return self.quota.slot(route) if self.quota else contextlib.nullcontext()
+
+    def _retry_delay(self, error_code, attempt, route, produced_output=False):
+        """失败后的退避时间，不重试时返回None"""
+        if self.retry is None:
+            return None
+        return self.retry.next_delay(error_code, attempt, route, produced_output)
+
+    def _cache_key(self, messages, use_cache, route):
+        if not use_cache or self.cache is None or not self.cache.enabled:
+            return None
+        chat_params = self._reference.gen_params(messages, route)["parameter"]["chat"]
+        return self.cache.make_key(messages, chat_params)
+
+    def call_spark_api(self, messages, use_cache=True, route="unknown"):
+        """借用会话调用星火API；相同请求优先返回缓存结果"""
+        key = self._cache_key(messages, use_cache, route)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info(f"命中生成结果缓存: {key[:12]}")
+                return cached
+
+        attempt = 0
+        with self.session() as session:
+            while True:
+                check_cancelled(route)
+                with self._quota_slot(route):
+                    if self.breaker:
+                        self.breaker.before_call()
+                    try:
+                        result = session.call_spark_api(messages, route=route)
+                    finally:
+                        # 调用抛出异常时也要记录结果，否则半开状态的试探调用永远不会结束
+                        if self.breaker:
+                            self.breaker.record(session.error_code)
+                if session.succeeded:
+                    break
+                check_cancelled(route)
+                delay = self._retry_delay(session.error_code, attempt, route)
+                if delay is None:
+                    raise SparkCallFailedError(session.error_code)
+                sleep_unless_cancelled(delay)
+                attempt += 1
+            if key and result:
+                self.cache.set(key, result)
+            return result
+
+    def stream_spark_api(self, messages, use_cache=True, route="unknown", raw=False):
+        """借用会话流式调用星火API，迭代结束后归还会话；命中缓存时一次性产出完整结果
+
+        raw 为真时缓存模型的原始输出（结构化输出模式），否则缓存提取出的HTML。
+        """
+        key = self._cache_key(messages, use_cache, route)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info(f"命中生成结果缓存: {key[:12]}")
+                yield cached
+                return
+
+        attempt = 0
+        with self.session() as session:
+            while True:
+                check_cancelled(route)
+                produced = False
+                with self._quota_slot(route):
+                    if self.breaker:
+                        self.breaker.before_call()
+                    try:
+                        for chunk in session.stream_spark_api(messages, route=route):
+                            produced = True
+                            yield chunk
+                    finally:
+                        if self.breaker:
+                            self.breaker.record(session.error_code)
+                if session.succeeded:
+                    break
+                check_cancelled(route)
+                # 已推送给调用方的内容无法撤回，只有尚未产出内容时才重试；否则由调用方丢弃已收到的部分
+                delay = self._retry_delay(session.error_code, attempt, route, produced)
+                if delay is None:
+                    raise SparkCallFailedError(session.error_code)
+                sleep_unless_cancelled(delay)
+                attempt += 1
+            if key:
+                result = session.answer if raw else session.extractor.value()
+                if result:
+                    self.cache.set(key, result)
+
+    def stats(self):
+        """会话池状态"""
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "max_waiting": self.max_waiting
+            }
@@ -0,0 +1,131 @@
+"""星火API调用的容错：错误分类、重试退避和熔断器"""
+import logging
+import random
+import threading
+import time
+
+from metrics import METRIC_CIRCUIT_REJECTIONS, METRIC_CIRCUIT_STATE, METRIC_SPARK_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class SparkUnavailableError(Exception):
+    """星火API暂时无法调用，对应HTTP 503"""
+    status = 503
+
+
+class SparkPoolBusyError(SparkUnavailableError):
+    """会话池繁忙：排队请求已满或等待空闲会话超时"""
+
+
+class SparkCircuitOpenError(SparkUnavailableError):
+    """熔断器打开，调用被直接拒绝"""
+
+
+# 可重试的错误：连接失败、连接被提前关闭、长时间没有新帧，以及星火的服务繁忙/限流类错误码
+SPARK_RETRYABLE_CODES = {"connection", "closed", "idle_timeout", "10008", "10110", "10222", "11202", "11203"}
+# 计入熔断的错误：可重试错误加上超时；内容审核、参数错误等说明上游仍可用
+SPARK_UPSTREAM_FAILURE_CODES = SPARK_RETRYABLE_CODES | {"timeout"}
+# 调用方主动结束的调用（客户端断开、取消），不反映上游状态
+SPARK_CALLER_ABORT_CODES = {"aborted", "cancelled"}
+# 超时：总时长超过截止时间或长时间没有新帧
+SPARK_TIMEOUT_CODES = {"timeout", "idle_timeout"}
+
+
+class SparkCallFailedError(SparkUnavailableError):
+    """调用未正常结束且不再重试，已收到的部分内容作废；超时对应HTTP 504，其余对应502"""
+
+    def __init__(self, error_code):
+        self.error_code = error_code
+        if error_code in SPARK_TIMEOUT_CODES:
+            self.status = 504
+            message = "AI生成超时，请稍后重试"
+        else:
+            self.status = 502
+            message = f"AI生成中断（{error_code}），请重试"
+        super().__init__(message)
+
+
+class RetryPolicy:
+    """重试策略：可重试的错误最多重试 max_retries 次，每次按指数退避"""
+
+    def __init__(self, max_retries, base_delay, max_delay):
+        self.max_retries = max_retries
+        self.base_delay = base_delay  # 首次重试的退避上限（秒），之后逐次翻倍
+        self.max_delay = max_delay  # 单次退避上限（秒）
+
+    def next_delay(self, error_code, attempt, route, produced_output=False):
+        """判断失败的调用能否重试，可以时返回退避时间（秒），不可重试时返回None
+
+        已经向调用方产出过内容的流式调用不重试；退避时间在 [0, min(上限, 基数*2^attempt)] 内随机。
+        可重试的错误在重试用尽后抛出SparkUnavailableError。
+        """
+        if error_code not in SPARK_RETRYABLE_CODES or produced_output:
+            return None
+        if attempt >= self.max_retries:
+            # 重试用尽仍是服务繁忙/连接类错误，按服务暂不可用处理（503），而不是生成失败（500）
+            raise SparkUnavailableError("AI服务繁忙，请稍后重试")
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        METRIC_SPARK_RETRIES.inc(route=route, code=error_code)
+        logger.warning(f"星火API调用失败（{error_code}），{delay:.2f}秒后第{attempt + 1}次重试")
+        return delay
+
+
+class CircuitBreaker:
+    """熔断器
+
+    连续 failure_threshold 次上游失败后打开，reset_timeout 内的调用直接拒绝；冷却期结束后
+    进入半开状态，只放行一个试探调用，成功则关闭，失败则重新打开。
+    """
+
+    STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+    def __init__(self, upstream, failure_threshold, reset_timeout):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+        METRIC_CIRCUIT_STATE.set(0, upstream=upstream)
+
+    def _transition(self, state):
+        """切换状态（调用方需持有锁）"""
+        if state != self.state:
+            logger.warning(f"熔断器 {self.upstream}: {self.state} -> {state}")
+            self.state = state
+            METRIC_CIRCUIT_STATE.set(self.STATE_VALUES[state], upstream=self.upstream)
+
+    def before_call(self):
+        """发起调用前检查，熔断期间抛出SparkCircuitOpenError"""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._transition("half_open")
+                return
+        METRIC_CIRCUIT_REJECTIONS.inc(upstream=self.upstream)
+        raise SparkCircuitOpenError("AI服务暂时不可用，请稍后重试")
+
+    def record(self, error_code):
+        """记录一次调用的结果，error_code 为None表示成功"""
+        with self._lock:
+            if error_code in SPARK_CALLER_ABORT_CODES:
+                if self.state == "half_open":
+                    # 试探请求被调用方取消，下一次调用重新试探
+                    self.opened_at = time.monotonic() - self.reset_timeout
+                    self._transition("open")
+                return
+            if error_code not in SPARK_UPSTREAM_FAILURE_CODES:
+                self.failures = 0
+                self._transition("closed")
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._transition("open")
+
+    def stats(self):
+        with self._lock:
+            return {"upstream": self.upstream, "state": self.state, "failures": self.failures}
@@ -0,0 +1,646 @@
+"""结构化（JSON）输出模式：各阶段的JSON格式、流式增量校验和服务端HTML渲染
+
+模型按 STAGE_FORMATS 输出紧凑的JSON而不是HTML，省去标签后输出token明显减少。
+StructuredStream 在流式接收时逐字符解析并按格式校验，结构不符立即抛出StructuredOutputError，
+不必等到生成结束；顶层列表中每完成一项就渲染出对应的HTML片段，最终HTML与HTML模式的结构一致：
+    stream = StructuredStream("mindmap")
+    for chunk in chunks:
+        html_piece = stream.feed(chunk)
+    html, value = stream.finish()
+
+embedded_data() 从HTML模式的结果中提取雷达图和评分数据（模型常输出单引号的Python字面量），
+规范化为严格的JSON字段 chart_data / rating_data 返回给前端。
+"""
+import functools
+import json
+import re
+from html import escape, unescape
+
+
+class StructuredOutputError(ValueError):
+    """模型输出不符合JSON格式要求"""
+
+
+# ---------------------------------------------------------------------------
+# 格式定义
+# ---------------------------------------------------------------------------
+
+class Scalar:
+    """字符串或数字"""
+    kind = "scalar"
+
+
+class Obj:
+    """对象：fields 为 字段名 -> 格式，未列出的字段不校验；required 为必填字段"""
+    kind = "object"
+
+    def __init__(self, fields, required=()):
+        self.fields = fields
+        self.required = required
+
+
+class Arr:
+    """数组：item 为元素格式"""
+    kind = "array"
+
+    def __init__(self, item=None):
+        self.item = item
+
+
+class OneOf:
+    """按值的类型（字符串/数字、对象、数组）选择格式"""
+
+    def __init__(self, *options):
+        self.options = options
+
+
+def _resolve(schema, kind):
+    """值的类型为kind时适用的格式；不允许该类型时返回False，None表示不校验"""
+    if schema is None:
+        return None
+    options = schema.options if isinstance(schema, OneOf) else (schema,)
+    for option in options:
+        if option.kind == kind:
+            return option
+    return False
+
+
+SCALAR = Scalar()
+TEXT_LIST = Arr(SCALAR)
+SECTION = Obj({"title": SCALAR, "items": TEXT_LIST}, required=("title", "items"))
+
+# 思维导图的要点可以嵌套：字符串，或 {"text": 要点, "items": [下级要点]}
+MINDMAP_ITEM = OneOf(SCALAR)
+MINDMAP_ITEM.options += (Obj({"text": SCALAR, "items": Arr(MINDMAP_ITEM)}, required=("text",)),)
+
+STAGE_FORMATS = {
+    "mindmap": {
+        "container": "mindmap",
+        "list_key": "sections",
+        "schema": Obj({
+            "sections": Arr(Obj({"title": SCALAR, "items": Arr(MINDMAP_ITEM)}, required=("title", "items")))
+        }, required=("sections",)),
+        "instructions": (
+            '结构为 {"sections": [{"title": 主要主题, "items": [要点]}]}；'
+            '要点为字符串，有下级要点时写成 {"text": 要点, "items": [下级要点]}。'
+            "sections 应该包含以下部分: 课程介绍、教学目标、核心概念、关键知识点、教学方法、评估方式"
+        ),
+        "example": '{"sections":[{"title":"主题1","items":["子主题1.1",{"text":"子主题1.2","items":["要点"]}]}]}',
+    },
+    "teaching_flow": {
+        "container": "teaching-flow",
+        "list_key": "stages",
+        "schema": Obj({
+            "stages": Arr(Obj(
+                {"title": SCALAR, "minutes": SCALAR, "activities": TEXT_LIST, "resources": TEXT_LIST},
+                required=("title", "activities")
+            ))
+        }, required=("stages",)),
+        "instructions": (
+            '结构为 {"stages": [{"title": 教学环节, "minutes": 分钟数, "activities": [教学活动], '
+            '"resources": [所需资源]}]}。'
+            "stages 应该包含以下环节: 导入环节、知识讲解、互动活动、练习与实践、总结与评价"
+        ),
+        "example": '{"stages":[{"title":"一、导入环节","minutes":5,"activities":["活动1"],"resources":["资源1"]}]}',
+    },
+    "problem_simulation": {
+        "container": "problem-simulation",
+        "list_key": "sections",
+        "schema": Obj({
+            "sections": Arr(SECTION),
+            "chart": Obj({"labels": TEXT_LIST, "datasets": Arr(Obj({"label": SCALAR, "data": TEXT_LIST}))}),
+        }, required=("sections",)),
+        "instructions": (
+            '结构为 {"sections": [{"title": 部分标题, "items": [内容]}], '
+            '"chart": {"labels": [维度], "datasets": [{"label": 名称, "data": [分值]}]}}，chart 为雷达图数据。'
+            "sections 应包含以下部分: 可能出现的问题及解决方案、学生可能提出的疑问、预期学习效果、教学难点分析"
+        ),
+        "example": (
+            '{"sections":[{"title":"可能出现的问题","items":["问题1"]},{"title":"预期学习效果","items":["效果1"]}],'
+            '"chart":{"labels":["理解","应用"],"datasets":[{"label":"预期","data":[8,7]}]}}'
+        ),
+    },
+    "evaluation": {
+        "container": "evaluation",
+        "list_key": "sections",
+        "schema": Obj({
+            "sections": Arr(SECTION),
+            "rating": Obj({"score": SCALAR, "description": SCALAR}, required=("score",)),
+        }, required=("sections", "rating")),
+        "instructions": (
+            '结构为 {"sections": [{"title": 部分标题, "items": [内容]}], '
+            '"rating": {"score": 整体评分（1-10分）, "description": 评分说明}}。'
+            "sections 应包含以下部分: 教学设计优点、教学设计改进点、具体优化建议"
+        ),
+        "example": (
+            '{"sections":[{"title":"教学设计优点","items":["优点1"]},{"title":"教学设计改进点","items":["改进点1"]}],'
+            '"rating":{"score":8,"description":"评价描述"}}'
+        ),
+    },
+}
+
+
+def format_instructions(stage):
+    """系统提示中的JSON输出要求"""
+    return (
+        "输出格式要求："
+        "1. 只输出一个JSON对象，不要包含任何解释，也不要使用代码块标记"
+        f"2. {STAGE_FORMATS[stage]['instructions']}"
+    )
+
+
+def format_example(stage):
+    return "示例格式：" + STAGE_FORMATS[stage]["example"]
+
+
+# ---------------------------------------------------------------------------
+# 增量解析与校验
+# ---------------------------------------------------------------------------
+
+_TOKEN_CHARS = set("0123456789+-.eEtruefalsn")
+_KIND_NAMES = {"object": "对象", "array": "数组", "scalar": "字符串或数字"}
+
+
+class JsonStreamParser:
+    """逐字符解析流式输出的JSON并按格式校验
+
+    跳过首个'{'之前的说明文字（包括代码块标记），根对象闭合后忽略其余内容；容忍数组和对象末尾多余的逗号。
+    feed() 返回本次新完成的、根对象中 list_key 数组的元素。
+    """
+
+    def __init__(self, schema, list_key):
+        self.list_key = list_key
+        self._schema = schema
+        self._stack = []  # [容器, 格式, 当前字段名, 期望的下一个符号]
+        self._string = None  # 正在读取的字符串（原始字符）
+        self._escaped = False
+        self._token = None  # 正在读取的数字或 true/false/null
+        self._position = 0
+        self.value = None
+        self.done = False
+
+    def _fail(self, message):
+        raise StructuredOutputError(f"第{self._position}个字符: {message}")
+
+    def _slot_schema(self):
+        """下一个值适用的格式"""
+        if not self._stack:
+            return self._schema
+        container, schema, key, _ = self._stack[-1]
+        if schema is None:
+            return None
+        return schema.fields.get(key) if isinstance(container, dict) else schema.item
+
+    def _slot_name(self):
+        return f"字段 {self._stack[-1][2]} " if self._stack and isinstance(self._stack[-1][0], dict) else "数组元素"
+
+    def _begin_value(self, kind):
+        schema = _resolve(self._slot_schema(), kind)
+        if schema is False:
+            self._fail(f"{self._slot_name()}不应为{_KIND_NAMES[kind]}")
+        return schema
+
+    def _attach(self, value, completed):
+        """把已完成的值放入所在容器"""
+        if not self._stack:
+            self.value = value
+            self.done = True
+            return
+        frame = self._stack[-1]
+        container = frame[0]
+        if isinstance(container, dict):
+            container[frame[2]] = value
+        else:
+            container.append(value)
+            if len(self._stack) == 2 and self._stack[0][2] == self.list_key:
+                completed.append(value)
+        frame[3] = "comma"
+
+    def _finish_token(self, completed):
+        text = "".join(self._token)
+        self._token = None
+        try:
+            value = json.loads(text)
+        except ValueError:
+            self._fail(f"无效的值 {text[:20]}")
+        # true/false 不是字符串或数字（否则 minutes 会渲染为"True分钟"）
+        if isinstance(value, bool) and isinstance(_resolve(self._slot_schema(), "scalar"), Scalar):
+            self._fail(f"{self._slot_name()}应为{_KIND_NAMES['scalar']}，实际为 {text}")
+        self._attach(value, completed)
+
+    def _close(self, char, completed):
+        container, schema, _, expect = self._stack[-1]
+        if isinstance(container, dict) != (char == "}"):
+            self._fail(f"意外的 {char}")
+        if expect in ("colon", "value") and isinstance(container, dict):
+            self._fail("对象在字段值之前结束")
+        if isinstance(container, dict) and schema is not None:
+            missing = [key for key in schema.required if key not in container]
+            if missing:
+                self._fail(f"缺少字段 {', '.join(missing)}")
+            empty = [key for key in schema.required if container[key] in ("", [], {})]
+            if empty:
+                self._fail(f"字段 {', '.join(empty)} 为空")
+        self._stack.pop()
+        self._attach(container, completed)
+
+    def feed(self, chunk):
+        completed = []
+        for char in chunk:
+            self._position += 1
+            if self.done:
+                break
+            if self._string is not None:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._end_string(completed)
+                    continue
+                self._string.append(char)
+                continue
+            if self._token is not None:
+                if char in _TOKEN_CHARS:
+                    self._token.append(char)
+                    continue
+                self._finish_token(completed)
+            if not self._stack and self.value is None and char != "{":
+                continue  # 根对象之前的说明文字
+            if char in " \t\r\n":
+                continue
+            self._structural(char, completed)
+        return completed
+
+    def _end_string(self, completed):
+        try:
+            text = json.loads('"' + "".join(self._string) + '"', strict=False)
+        except ValueError:
+            self._fail("无效的字符串")
+        self._string = None
+        frame = self._stack[-1]
+        if frame[3] == "key":
+            frame[2] = text
+            frame[3] = "colon"
+        else:
+            self._attach(text, completed)
+
+    def _structural(self, char, completed):
+        frame = self._stack[-1] if self._stack else None
+        expect = frame[3] if frame else "value"
+        if char in "}]":
+            if frame is None:
+                self._fail(f"意外的 {char}")
+            self._close(char, completed)
+        elif expect == "comma":
+            if char != ",":
+                self._fail(f"此处应为逗号，实际为 {char}")
+            frame[3] = "key" if isinstance(frame[0], dict) else "value"
+        elif expect == "colon":
+            if char != ":":
+                self._fail(f"此处应为冒号，实际为 {char}")
+            frame[3] = "value"
+        elif expect == "key":
+            if char != '"':
+                self._fail(f"此处应为字段名，实际为 {char}")
+            self._string = []
+        elif char == "{":
+            self._stack.append([{}, self._begin_value("object"), None, "key"])
+        elif char == "[":
+            self._stack.append([[], self._begin_value("array"), None, "value"])
+        elif char == '"':
+            self._begin_value("scalar")
+            self._string = []
+        elif char in _TOKEN_CHARS:
+            self._begin_value("scalar")
+            self._token = [char]
+        else:
+            self._fail(f"意外的字符 {char}")
+
+    def close(self):
+        """输出结束：返回解析得到的根对象，不完整时抛出StructuredOutputError"""
+        if self._token is not None and len(self._stack) == 1:
+            self._finish_token([])
+        if not self.done:
+            self._fail("JSON不完整" if self._stack or self._string is not None else "没有找到JSON对象")
+        return self.value
+
+
+# ---------------------------------------------------------------------------
+# HTML渲染：结构与HTML模式的输出一致
+# ---------------------------------------------------------------------------
+
+def _text(value):
+    return escape(str(value), quote=False)
+
+
+def _list(items, tag="ul"):
+    return f"<{tag}>" + "".join(f"<li>{_text(item)}</li>" for item in items or []) + f"</{tag}>"
+
+
+def _mindmap_items(items):
+    parts = []
+    for item in items or []:
+        if isinstance(item, dict):
+            children = _mindmap_items(item.get("items")) if item.get("items") else ""
+            parts.append(f"<li>{_text(item.get('text', ''))}{children}</li>")
+        else:
+            parts.append(f"<li>{_text(item)}</li>")
+    return "<ul>" + "".join(parts) + "</ul>"
+
+
+def _render_mindmap_section(section):
+    return f"<h3>{_text(section['title'])}</h3>{_mindmap_items(section.get('items'))}"
+
+
+def _render_flow_stage(stage):
+    minutes = stage.get("minutes")
+    html = f"<h3>{_text(stage['title'])}</h3>"
+    if minutes not in (None, ""):
+        minutes = _text(minutes)
+        html += f"<p class='time'>时间：{minutes if minutes.endswith('分钟') else minutes + '分钟'}</p>"
+    html += _list(stage.get("activities"))
+    if stage.get("resources"):
+        html += "<p>所需资源：</p>" + _list(stage["resources"], "ol")
+    return html
+
+
+def _render_section(section):
+    return f"<h4>{_text(section['title'])}</h4>{_list(section.get('items'))}"
+
+
+def _render_chart(value):
+    chart = value.get("chart")
+    if not chart:
+        return ""
+    # JSON中的"</"转义为"<\/"，避免提前结束script元素
+    return "<script id='chart-data'>" + json.dumps(chart, ensure_ascii=False).replace("</", "<\\/") + "</script>"
+
+
+def _render_rating(value):
+    return "<div id='rating-data'>" + _text(json.dumps(value["rating"], ensure_ascii=False)) + "</div>"
+
+
+RENDERERS = {
+    # 阶段 -> (顶层列表元素的渲染函数, 列表之后的附加内容)
+    "mindmap": (_render_mindmap_section, None),
+    "teaching_flow": (_render_flow_stage, None),
+    "problem_simulation": (_render_section, _render_chart),
+    "evaluation": (_render_section, _render_rating),
+}
+
+
+def render_open(stage):
+    return f"<div class='{STAGE_FORMATS[stage]['container']}'>"
+
+
+def render_item(stage, item):
+    return RENDERERS[stage][0](item)
+
+
+@functools.lru_cache(maxsize=256)
+def _render_cached(stage, canonical):
+    value = json.loads(canonical)
+    render_item_html, render_tail = RENDERERS[stage]
+    items = value.get(STAGE_FORMATS[stage]["list_key"]) or []
+    tail = render_tail(value) if render_tail else ""
+    return render_open(stage) + "".join(render_item_html(item) for item in items) + tail + "</div>"
+
+
+def render_html(stage, value):
+    """把阶段的JSON结果渲染为HTML；相同内容（如命中生成缓存）直接复用渲染结果"""
+    return _render_cached(stage, json.dumps(value, ensure_ascii=False, sort_keys=True))
+
+
+class StructuredStream:
+    """流式接收一个阶段的JSON输出：边解析边校验，并增量产出渲染好的HTML片段"""
+
+    def __init__(self, stage):
+        self.stage = stage
+        spec = STAGE_FORMATS[stage]
+        self.parser = JsonStreamParser(spec["schema"], spec["list_key"])
+        self.raw = []
+        self._opened = False
+
+    def feed(self, chunk):
+        """输入一个片段，返回新渲染的HTML（可能为空串）；格式不符时抛出StructuredOutputError"""
+        self.raw.append(chunk)
+        completed = self.parser.feed(chunk)
+        html = ""
+        if not self._opened and (self.parser._stack or self.parser.done):
+            self._opened = True
+            html = render_open(self.stage)
+        return html + "".join(render_item(self.stage, item) for item in completed)
+
+    def finish(self):
+        """返回 (完整HTML, JSON结果)"""
+        value = self.parser.close()
+        return render_html(self.stage, value), value
+
+
+# ---------------------------------------------------------------------------
+# 雷达图/评分数据提取：宽松解析 + 规范化
+# ---------------------------------------------------------------------------
+
+_NUMBER_RE = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+_NAME_RE = re.compile(r'[A-Za-z_$][\w$]*')
+_ELLIPSIS_RE = re.compile(r'\.\.\.|…+')
+_LITERALS = {"true": True, "True": True, "false": False, "False": False, "null": None, "None": None}
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+
+class _LooseParser:
+    """单遍解析宽松的JSON：支持单引号字符串、未加引号的字段名、末尾多余的逗号、
+    Python的 True/False/None，以及示例中照抄的省略号占位（忽略）"""
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def _fail(self, message):
+        raise StructuredOutputError(f"第{self.pos + 1}个字符: {message}")
+
+    def _skip(self):
+        while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+            self.pos += 1
+
+    def _peek(self):
+        self._skip()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def parse(self):
+        value = self._value()
+        if self._peek() == ";":
+            self.pos += 1
+        if self._peek():
+            self._fail("多余的内容")
+        return value
+
+    def _skip_ellipsis(self):
+        self._skip()
+        match = _ELLIPSIS_RE.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+        return bool(match)
+
+    def _value(self):
+        char = self._peek()
+        if char == "{":
+            return self._object()
+        if char == "[":
+            return self._array()
+        if char in ("'", '"'):
+            return self._string()
+        match = _NUMBER_RE.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            return json.loads(match.group().rstrip(".")) if "." in match.group() else int(match.group())
+        match = _NAME_RE.match(self.text, self.pos)
+        if match and match.group() in _LITERALS:
+            self.pos = match.end()
+            return _LITERALS[match.group()]
+        self._fail("无法识别的值" if char else "内容不完整")
+
+    def _string(self):
+        quote = self.text[self.pos]
+        self.pos += 1
+        parts = []
+        while self.pos < len(self.text):
+            char = self.text[self.pos]
+            self.pos += 1
+            if char == quote:
+                return "".join(parts)
+            if char == "\\" and self.pos < len(self.text):
+                char = self.text[self.pos]
+                self.pos += 1
+                if char == "u" and re.fullmatch(r'[0-9a-fA-F]{4}', self.text[self.pos:self.pos + 4]):
+                    char = chr(int(self.text[self.pos:self.pos + 4], 16))
+                    self.pos += 4
+                else:
+                    char = _ESCAPES.get(char, char)
+            parts.append(char)
+        self._fail("字符串没有结束")
+
+    def _key(self):
+        if self._peek() in ("'", '"'):
+            return self._string()
+        match = _NAME_RE.match(self.text, self.pos)
+        if not match:
+            self._fail("此处应为字段名")
+        self.pos = match.end()
+        return match.group()
+
+    def _object(self):
+        self.pos += 1
+        result = {}
+        while True:
+            if self._skip_ellipsis() or self._peek() == ",":
+                self.pos += 1 if self._peek() == "," else 0
+                continue
+            if self._peek() == "}":
+                self.pos += 1
+                return result
+            key = self._key()
+            if self._peek() != ":":
+                self._fail("此处应为冒号")
+            self.pos += 1
+            result[key] = self._value()
+            if self._peek() not in (",", "}"):
+                self._fail("此处应为逗号")
+
+    def _array(self):
+        self.pos += 1
+        result = []
+        while True:
+            if self._skip_ellipsis() or self._peek() == ",":
+                self.pos += 1 if self._peek() == "," else 0
+                continue
+            if self._peek() == "]":
+                self.pos += 1
+                return result
+            result.append(self._value())
+            if self._peek() not in (",", "]"):
+                self._fail("此处应为逗号")
+
+
+def parse_loose_json(text):
+    """解析模型输出的JSON或近似JSON的字面量；合法JSON直接走json.loads"""
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return _LooseParser(text).parse()
+
+
+def _number(value):
+    """数值或形如 "8分"、"7.5" 的文本转换为数字"""
+    if isinstance(value, bool):
+        raise StructuredOutputError(f"无效的数值 {value}")
+    if isinstance(value, (int, float)):
+        return value
+    match = _NUMBER_RE.search(str(value))
+    if not match:
+        raise StructuredOutputError(f"无效的数值 {value}")
+    number = float(match.group())
+    return int(number) if number.is_integer() else number
+
+
+def normalize_chart(value):
+    """雷达图数据规范化为 {"labels": [文本], "datasets": [{"label": 文本, "data": [数值]}]}"""
+    if not isinstance(value, dict) or not isinstance(value.get("labels"), list):
+        raise StructuredOutputError("雷达图数据缺少 labels")
+    datasets = value.get("datasets") or []
+    if isinstance(datasets, dict):
+        datasets = [datasets]
+    return {
+        "labels": [str(label) for label in value["labels"]],
+        "datasets": [
+            {"label": str(dataset.get("label", "")), "data": [_number(item) for item in dataset.get("data") or []]}
+            for dataset in datasets if isinstance(dataset, dict)
+        ]
+    }
+
+
+def normalize_rating(value):
+    """评分数据规范化为 {"score": 数值, "description": 文本}"""
+    if isinstance(value, (int, float, str)) and not isinstance(value, bool):
+        value = {"score": value}
+    if not isinstance(value, dict) or "score" not in value:
+        raise StructuredOutputError("评分数据缺少 score")
+    return {"score": _number(value["score"]), "description": str(value.get("description") or "")}
+
+
+# 阶段 -> (HTML中的元素id, JSON模式中的字段, 规范化函数, 返回字段)
+EMBEDDED_DATA = {
+    "problem_simulation": ("chart-data", "chart", normalize_chart, "chart_data"),
+    "evaluation": ("rating-data", "rating", normalize_rating, "rating_data"),
+}
+
+
+def _element_text(html, element_id):
+    """按id取元素的文本内容（雷达图为script，评分为div），找不到时返回None"""
+    match = re.search(
+        r"<(script|div)\b[^>]*\bid\s*=\s*['\"]?" + re.escape(element_id) + r"\b[^>]*>(.*?)</\1\s*>",
+        html, re.S | re.I
+    )
+    if not match:
+        return None
+    text = match.group(2)
+    return text if match.group(1).lower() == "script" else unescape(text)
+
+
+def embedded_data(stage, html, structured=None):
+    """提取阶段结果中的内嵌数据，返回要合并到结果中的字段，如 {"chart_data": {...}}
+
+    结构化输出模式直接使用已解析的JSON；HTML模式从对应元素中解析。
+    数据缺失时字段为None，格式无法解析时抛出StructuredOutputError。
+    """
+    if stage not in EMBEDDED_DATA:
+        return {}
+    element_id, json_key, normalize, field = EMBEDDED_DATA[stage]
+    if structured is not None:
+        raw = structured.get(json_key)
+    else:
+        text = _element_text(html or "", element_id)
+        raw = parse_loose_json(text) if text and text.strip() else None
+    return {field: normalize(raw) if raw is not None else None}
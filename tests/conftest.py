@@ -0,0 +1,129 @@
+"""测试配置：导入 app 之前把日志和教案库指向临时目录，避免测试在仓库中写文件"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+
+import pytest
+
+_TMP_DIR = tempfile.mkdtemp(prefix="plan-tests-")
+os.environ["LOG_FILE"] = ""
+os.environ["PLAN_STORE_DB"] = os.path.join(_TMP_DIR, "plans.db")
+os.environ["SPARK_CACHE_DB"] = ""
+os.environ["JOB_STORE_DB"] = ""
+os.environ["SPARK_WARM_CONNECTIONS"] = "0"
+os.environ["SIMILAR_PLAN_MAX_ENTRIES"] = "0"
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """Flask应用模块（导入时创建日志、教案库等共享实例，只在需要的测试中导入）"""
+    import app
+    return app
+
+
+@pytest.fixture
+def mock_spark():
+    """在后台线程启动 mock_spark_server.MockSparkServer，返回启动函数 start(**参数) -> WebSocket地址"""
+    websockets = pytest.importorskip("websockets")
+    from mock_spark_server import MockSparkServer
+
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    servers = []
+
+    def start(**options):
+        args = argparse.Namespace(**{
+            "host": "127.0.0.1", "length": 400, "chunk_size": 8, "delay": 0.0, "first_token_delay": 0.0,
+            "jitter": 0.0, "error_rate": 0.0, "error_code": 10110, "disconnect_rate": 0.0, "stall_rate": 0.0,
+            "stall_seconds": 5, "api_key": "", "api_secret": "", "seed": 1, **options
+        })
+
+        async def serve():
+            return await websockets.serve(MockSparkServer(args).handle, args.host, 0, max_size=None)
+
+        server = asyncio.run_coroutine_threadsafe(serve(), loop).result(5)
+        servers.append(server)
+        return f"ws://{args.host}:{server.sockets[0].getsockname()[1]}/v1/x1"
+
+    async def shutdown():
+        for server in servers:
+            server.close()
+        # 客户端可能不回应关闭握手，等待片刻后直接取消剩余的连接任务
+        await asyncio.wait([asyncio.ensure_future(server.wait_closed()) for server in servers], timeout=0.5)
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    yield start
+    if servers:
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+@pytest.fixture
+def use_spark(app_module, monkeypatch):
+    """让生成阶段连接指定的模拟服务：独立的会话池，不经过缓存、配额和熔断器，超时样本从零开始"""
+    from session_pool import SparkSessionPool
+    from spark_resilience import RetryPolicy
+
+    app = app_module
+
+    def use(url):
+        pool = SparkSessionPool(
+            lambda: app.SparkWebSocket(app.APP_ID, app.API_KEY, app.API_SECRET, url),
+            size=2, max_waiting=2, acquire_timeout=5, retry=RetryPolicy(2, base_delay=0, max_delay=0)
+        )
+        monkeypatch.setattr(app, "spark_pool", pool)
+        monkeypatch.setattr(app, "spark_timeouts", app.AdaptiveTimeouts(
+            app.SPARK_TIMEOUT_WINDOW, app.SPARK_TIMEOUT_MIN_SAMPLES, app.SPARK_TIMEOUT_PERCENTILE,
+            app.SPARK_TIMEOUT_FACTOR))
+
+    return use
+
+
+@pytest.fixture
+def sse_events():
+    """解析SSE响应体的函数：返回 [(事件名, 数据)]，忽略心跳注释"""
+
+    def parse(response):
+        events = []
+        for block in response.get_data(as_text=True).split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+            if "event" in lines:
+                events.append((lines["event"], json.loads(lines["data"])))
+        return events
+
+    return parse
+
+
+@pytest.fixture
+def asgi_post(app_module):
+    """向 asgi_app.application 发送一个POST请求，返回 (状态码, 响应体)；请求体读完后客户端保持连接"""
+    import asgi_app
+
+    def post(path, body):
+        incoming = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            if incoming:
+                return incoming.pop(0)
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": path, "headers": []}
+        asyncio.run(asgi_app.application(scope, receive, send))
+        status = next(message["status"] for message in sent if message["type"] == "http.response.start")
+        body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+        return status, body
+
+    return post
@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+
+class FakeStages:
+    """替换 app.stream_stage：记录各阶段收到的输入，按预设的片段产出结果"""
+
+    def __init__(self, app, chunks=None, fail=None, waits=None):
+        self.app = app
+        self.chunks = chunks or {}
+        self.fail = fail or {}
+        self.waits = waits or {}  # 阶段 -> 产出首个片段后、结束前等待的事件
+        self.started = {stage: threading.Event() for stage in app.FULL_PLAN_STAGES}
+        self.inputs = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, stage, data):
+        spec = self.app.GENERATION_STAGES[stage]
+        with self.lock:
+            self.inputs[stage] = dict(data)
+        self.started[stage].set()
+        if stage in self.fail:
+            raise self.fail[stage]
+        chunks = self.chunks.get(stage, [f"<div class='{stage}'>{stage}</div>"])
+        yield "chunk", chunks[0]
+        if stage in self.waits:
+            assert self.waits[stage].wait(5), f"{stage} 等待超时"
+        for chunk in chunks[1:]:
+            yield "chunk", chunk
+        yield "done", {spec["result_key"]: "".join(chunks), "stage_extra": stage}
+
+
+@pytest.fixture
+def events():
+    received = []
+    lock = threading.Lock()
+
+    def emit(event, payload):
+        with lock:
+            received.append((event, payload))
+
+    emit.received = received
+    return emit
+
+
+def test_stages_run_in_dependency_order(app_module, monkeypatch, events):
+    fake = FakeStages(app_module)
+    monkeypatch.setattr(app_module, "stream_stage", fake)
+    result = app_module.run_full_plan({"course_title": "植物学"}, events)
+
+    assert fake.inputs["teaching_flow"]["mindmap"] == "<div class='mindmap'>mindmap</div>"
+    assert fake.inputs["problem_simulation"]["teaching_flow"] == "<div class='teaching_flow'>teaching_flow</div>"
+    assert fake.inputs["evaluation"]["simulation"] == "<div class='problem_simulation'>problem_simulation</div>"
+    assert fake.inputs["evaluation"]["plan_id"] == result["plan_id"]
+
+    done_order = [payload["stage"] for event, payload in events.received if event == "stage_done"]
+    assert done_order == app_module.FULL_PLAN_STAGES
+    assert list(result) == ["plan_id", "speculative", "stages", "mindmap", "teaching_flow", "simulation",
+                            "evaluation"]
+    assert result["stages"]["problem_simulation"] == {"stage_extra": "problem_simulation"}
+    assert app_module.plan_store.get(result["plan_id"])["course_title"] == "植物学"
+
+
+def test_speculative_evaluation_runs_alongside_simulation(app_module, monkeypatch, events):
+    # 问题模拟要等到评价开始后才结束：评价仍依赖问题模拟时会超时失败
+    fake = FakeStages(app_module)
+    fake.waits["problem_simulation"] = fake.started["evaluation"]
+    monkeypatch.setattr(app_module, "stream_stage", fake)
+    result = app_module.run_full_plan({"course_title": "植物学"}, events, speculative=True)
+
+    assert "simulation" not in fake.inputs["evaluation"]
+    assert fake.inputs["evaluation"]["teaching_flow"] == result["teaching_flow"]
+    assert fake.inputs["evaluation"]["speculative"] is True
+    assert result["speculative"] is True
+
+
+def test_start_on_partial_hands_off_closed_container(app_module, monkeypatch, events):
+    container = "<div class='mindmap'><h3>核心概念</h3></div>"
+    fake = FakeStages(app_module, chunks={"mindmap": [container, "多余的说明"]})
+    fake.waits["mindmap"] = fake.started["teaching_flow"]
+    monkeypatch.setattr(app_module, "stream_stage", fake)
+    result = app_module.run_full_plan({"course_title": "植物学"}, events, start_on_partial=True)
+
+    assert fake.inputs["teaching_flow"]["mindmap"] == container
+    assert result["mindmap"] == container + "多余的说明"
+
+
+def test_failed_stage_skips_downstream_stages(app_module, monkeypatch, events):
+    error = app_module.GenerationError("AI返回了无效的格式", 502)
+    fake = FakeStages(app_module, fail={"teaching_flow": error})
+    monkeypatch.setattr(app_module, "stream_stage", fake)
+    with pytest.raises(app_module.GenerationError) as raised:
+        app_module.run_full_plan({"course_title": "植物学"}, events)
+
+    assert raised.value is error
+    assert set(fake.inputs) == {"mindmap", "teaching_flow"}
+    errors = [payload for event, payload in events.received if event == "error"]
+    assert errors == [{"stage": "teaching_flow", "error": "AI返回了无效的格式", "status": 502}]
+
+
+def test_unknown_plan_id(app_module, monkeypatch, events):
+    monkeypatch.setattr(app_module, "stream_stage", FakeStages(app_module))
+    with pytest.raises(app_module.GenerationError) as raised:
+        app_module.run_full_plan({"plan_id": "missing"}, events)
+    assert raised.value.status == 404
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+MINDMAP = "<div class='mindmap'><h3>光合作用</h3></div>"
+
+
+def test_disconnect_mid_stream_ends_with_error_and_saves_nothing(app_module, mock_spark, use_spark, sse_events):
+    use_spark(mock_spark(disconnect_rate=1))
+    plan = app_module.plan_store.create(course_title="植物学", mindmap=MINDMAP)
+
+    response = app_module.app.test_client().post("/generate_teaching_flow/stream", json={"plan_id": plan["id"]})
+    events = sse_events(response)
+    assert any(event == "chunk" for event, _ in events)
+    assert [event for event, _ in events if event != "chunk"] == ["error"]
+    assert events[-1][1]["status"] == 502
+    assert app_module.plan_store.get(plan["id"])["teaching_flow"] is None
+
+
+def test_blocking_route_fails_when_every_attempt_disconnects(app_module, mock_spark, use_spark):
+    use_spark(mock_spark(disconnect_rate=1))
+    plan = app_module.plan_store.create(course_title="植物学", mindmap=MINDMAP)
+
+    response = app_module.app.test_client().post("/generate_teaching_flow", json={"plan_id": plan["id"]})
+    assert response.status_code == 503
+    assert "teaching_flow" not in response.get_json()
+    assert app_module.plan_store.get(plan["id"])["teaching_flow"] is None
+
+
+def test_upstream_error_code_fails_without_retry(app_module, mock_spark, use_spark):
+    use_spark(mock_spark(error_rate=1, error_code=10013))
+    response = app_module.app.test_client().post(
+        "/generate_teaching_flow", json={"course_title": "植物学", "mindmap": MINDMAP})
+    assert response.status_code == 502
+    assert app_module.spark_pool.stats()["in_use"] == 0
+
+
+def test_full_plan_stops_at_the_stage_that_failed(app_module, mock_spark, use_spark):
+    use_spark(mock_spark(disconnect_rate=1))
+    received = []
+    plan = app_module.plan_store.create(course_title="植物学")
+    with pytest.raises(app_module.GenerationError) as raised:
+        app_module.run_full_plan({"plan_id": plan["id"]}, lambda event, payload: received.append((event, payload)))
+    assert raised.value.status == 502
+    assert not [payload for event, payload in received if event == "stage_done"]
+    assert app_module.plan_store.get(plan["id"])["mindmap"] is None
+
+
+def generation_requests(app_module, stage, status):
+    """generation_requests_total 在 (stage, status) 标签下的当前计数"""
+    prefix = f'generation_requests_total{{route="{stage}",status="{status}"}} '
+    lines = [line for line in app_module.METRIC_GENERATION_REQUESTS.render() if line.startswith(prefix)]
+    return int(lines[0][len(prefix):]) if lines else 0
+
+
+def test_invalid_output_format_is_counted(app_module, asgi_post):
+    before = generation_requests(app_module, "mindmap", 400)
+    response = app_module.app.test_client().post(
+        "/generate_mindmap", json={"course_title": "植物学", "output_format": "xml"})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "不支持的输出格式: xml"}
+    assert generation_requests(app_module, "mindmap", 400) == before + 1
+
+    status, body = asgi_post("/generate_mindmap", b'{"course_title": "math", "output_format": "xml"}')
+    assert status == 400
+    assert json.loads(body) == {"error": "不支持的输出格式: xml"}
+    assert generation_requests(app_module, "mindmap", 400) == before + 2
+
+
+@pytest.mark.parametrize("path", ["/generate_mindmap", "/generate_mindmap/stream"])
+@pytest.mark.parametrize("body", [[{"course_title": "植物学"}], "植物学", 3])
+def test_non_object_json_body_is_rejected(app_module, path, body):
+    response = app_module.app.test_client().post(path, json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "请求体必须是JSON对象"}
+
+
+@pytest.mark.parametrize("path", ["/generate_mindmap", "/generate_mindmap/stream"])
+@pytest.mark.parametrize("body", [b'[{"course_title": "math"}]', b'"math"', b"3"])
+def test_asgi_rejects_non_object_json_body(asgi_post, path, body):
+    status, response = asgi_post(path, body)
+    assert status == 400
+    assert json.loads(response) == {"error": "请求体必须是JSON对象"}
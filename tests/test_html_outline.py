@@ -0,0 +1,70 @@
+from html_outline import HtmlStreamExtractor, compact_outline, estimate_tokens
+
+MINDMAP = (
+    "<div class='mindmap'><h3>核心概念</h3><ul><li>概念一<ul><li>细节甲</li><li>细节乙</li></ul></li>"
+    "<li>概念二</li><li>概念三</li></ul><h3>教学方法</h3><ul><li>讲授</li><li>讨论</li></ul>"
+    "<script id='chart-data'>{'labels': []}</script></div>"
+)
+
+
+def feed_all(chunks):
+    extractor = HtmlStreamExtractor()
+    confirmed = [extractor.feed(chunk) for chunk in chunks]
+    return extractor, confirmed
+
+
+def test_extractor_strips_leading_and_trailing_text():
+    extractor, confirmed = feed_all(["好的，以下是思维导图：<div><h3>标", "题</h3></div>希望对您有帮助"])
+    assert confirmed == ["<div><h3>", "标题</h3></div>"]
+    assert extractor.value() == "<div><h3>标题</h3></div>"
+
+
+def test_extractor_handles_tags_split_across_chunks():
+    html = "<div class='mindmap'><h3>标题</h3><ul><li>要点</li></ul></div>"
+    extractor, _ = feed_all([html[i:i + 3] for i in range(0, len(html), 3)])
+    assert extractor.value() == html
+    assert extractor.container() == html
+
+
+def test_extractor_tracks_first_container_close():
+    extractor, _ = feed_all(["<div><p>第一段<br></p><img src='x'/>", "</div>", "<div>说明</div>"])
+    assert extractor.container_closed
+    assert extractor.container() == "<div><p>第一段<br></p><img src='x'/></div>"
+    assert extractor.value().endswith("<div>说明</div>")
+
+
+def test_extractor_container_open_until_closed():
+    extractor, _ = feed_all(["<div class='teaching-flow'><h3>导入</h3>"])
+    assert not extractor.container_closed
+    assert extractor.container() is None
+
+
+def test_extractor_starts_at_brace_and_confirms_up_to_last_tag():
+    extractor, _ = feed_all(["说明文字{'html': '<p>", "内容</p>'} 结束"])
+    assert extractor.value() == "{'html': '<p>内容</p>"
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("光合作用") == 3
+    assert estimate_tokens("hello 42 ,") == 3
+
+
+def test_compact_outline_within_budget_keeps_everything():
+    assert compact_outline(MINDMAP, 1000) == (
+        "## 核心概念\n- 概念一\n  - 细节甲\n  - 细节乙\n- 概念二\n- 概念三\n## 教学方法\n- 讲授\n- 讨论"
+    )
+
+
+def test_compact_outline_drops_deepest_and_last_items_first():
+    outline = compact_outline(MINDMAP, 30)
+    assert outline == "## 核心概念\n- 概念一\n- 概念二\n……\n## 教学方法\n- 讲授\n……"
+    assert estimate_tokens(outline) + outline.count("\n") + 1 <= 30
+
+
+def test_compact_outline_keeps_headings_before_items():
+    assert compact_outline(MINDMAP, 15) == "## 核心概念\n## 教学方法"
+
+
+def test_compact_outline_truncates_headings_as_last_resort():
+    assert compact_outline(MINDMAP, 8) == "## 核心概念\n……"
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JOB_FINISHED_STATUSES, JobManager, JobQueueFullError, MemoryJobStore, SQLiteJobStore
+from request_context import GenerationError, check_cancelled, sleep_unless_cancelled
+
+
+def wait_finished(manager, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in JOB_FINISHED_STATUSES:
+            return job
+        manager.wait_for_change(0.05)
+    raise AssertionError(f"任务 {job_id} 未在 {timeout} 秒内结束")
+
+
+def test_job_succeeds_and_records_progress():
+    def runner(job_type, payload, on_progress):
+        on_progress("stage_done", {"stage": "mindmap"})
+        on_progress("chunk", {"stage": "teaching_flow"})
+        return {"type": job_type, "title": payload["course_title"]}
+
+    manager = JobManager(MemoryJobStore(ttl=60), workers=1, queue_depth=4, runner=runner)
+    job = wait_finished(manager, manager.submit("full_plan", {"course_title": "植物学"})["id"])
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"type": "full_plan", "title": "植物学"}
+    assert job["progress"] == ["mindmap"]
+
+
+def test_generation_error_marks_job_failed():
+    def runner(job_type, payload, on_progress):
+        raise GenerationError("AI返回了无效的格式", 502)
+
+    manager = JobManager(MemoryJobStore(ttl=60), workers=1, queue_depth=4, runner=runner)
+    job = wait_finished(manager, manager.submit("mindmap", {})["id"])
+    assert job["status"] == "failed"
+    assert job["result"] is None
+    assert job["error"] == {"error": "AI返回了无效的格式", "status": 502}
+
+
+def test_cancel_running_job():
+    started = threading.Event()
+
+    def runner(job_type, payload, on_progress):
+        started.set()
+        sleep_unless_cancelled(5)
+        check_cancelled(job_type)
+        return "不应返回"
+
+    manager = JobManager(MemoryJobStore(ttl=60), workers=1, queue_depth=4, runner=runner)
+    job_id = manager.submit("mindmap", {})["id"]
+    assert started.wait(5)
+    assert manager.cancel(job_id)
+    job = wait_finished(manager, job_id)
+    assert job["status"] == "cancelled"
+    assert job["result"] is None
+    assert not manager.cancel(job_id)
+
+
+def test_queue_full_fails_the_rejected_job():
+    release = threading.Event()
+
+    def runner(job_type, payload, on_progress):
+        release.wait(5)
+        return "ok"
+
+    manager = JobManager(MemoryJobStore(ttl=60), workers=1, queue_depth=1, runner=runner)
+    try:
+        first = manager.submit("mindmap", {})["id"]
+        deadline = time.monotonic() + 5
+        while manager.get(first)["status"] == "queued" and time.monotonic() < deadline:
+            manager.wait_for_change(0.05)
+        queued = manager.submit("mindmap", {})["id"]
+        with pytest.raises(JobQueueFullError):
+            manager.submit("mindmap", {})
+        # 排队中的任务可以直接取消
+        assert manager.cancel(queued)
+        assert manager.get(queued)["status"] == "cancelled"
+    finally:
+        release.set()
+    assert wait_finished(manager, first)["result"] == "ok"
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"), ttl=60)
+    store.create({
+        "id": "job1", "type": "mindmap", "status": "queued", "payload": {"course_title": "植物学"},
+        "result": None, "error": None, "progress": [], "created_at": time.time(),
+        "started_at": None, "finished_at": None
+    })
+    store.update("job1", status="succeeded", result={"mindmap": "<div>m</div>"}, progress=["mindmap"])
+    job = store.get("job1")
+    assert job["payload"] == {"course_title": "植物学"}
+    assert job["result"] == {"mindmap": "<div>m</div>"}
+    assert job["progress"] == ["mindmap"]
+    assert store.get("missing") is None
@@ -0,0 +1,20 @@
+from metrics import Metric
+
+
+def test_label_values_are_escaped():
+    metric = Metric("requests_total", "请求数", "counter", ("route",))
+    metric.inc(route='a\\b"c\nd')
+    assert metric.render()[-1] == 'requests_total{route="a\\\\b\\"c\\nd"} 1'
+
+
+def test_histogram_renders_buckets_sum_and_count():
+    metric = Metric("latency_seconds", "耗时", "histogram", ("stage",), buckets=(1, 5))
+    metric.observe(0.5, stage="mindmap")
+    metric.observe(3, stage="mindmap")
+    assert metric.render()[2:] == [
+        'latency_seconds_bucket{stage="mindmap",le="1"} 1',
+        'latency_seconds_bucket{stage="mindmap",le="5"} 2',
+        'latency_seconds_bucket{stage="mindmap",le="+Inf"} 2',
+        'latency_seconds_sum{stage="mindmap"} 3.5',
+        'latency_seconds_count{stage="mindmap"} 2',
+    ]
@@ -0,0 +1,100 @@
+import re
+import time
+import zipfile
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import pytest
+
+from plan_render import html_to_blocks, plan_blocks, render_document
+
+PLAN = {
+    "course_title": "植物学",
+    "course_description": "认识植物",
+    "teaching_objectives": "理解光合作用",
+    "mindmap": "<div class='mindmap'><h3>核心概念</h3><ul><li>光合作用<ul><li>叶绿体</li></ul></li></ul></div>",
+    "teaching_flow": "<div class='teaching-flow'><h3>一、导入环节</h3><p class='time'>时间：5分钟</p></div>",
+    "simulation": "<div class='problem-simulation'><h4>可能的问题</h4>"
+                  "<script id='chart-data'>{'labels': []}</script></div>",
+    "evaluation": "<div class='evaluation'><h4>优点</h4><div id='rating-data'>{'score': 8}</div></div>",
+    "generated_at": "2026年01月02日 03:04:05",
+}
+
+
+def test_html_to_blocks_keeps_text_and_list_depth():
+    assert html_to_blocks(PLAN["mindmap"]) == [("h3", "核心概念", 0), ("li", "光合作用", 1), ("li", "叶绿体", 2)]
+    assert html_to_blocks(PLAN["simulation"]) == [("h4", "可能的问题", 0)]
+
+
+def test_plan_blocks_uses_given_generation_time():
+    blocks = plan_blocks(PLAN)
+    assert blocks[0] == ("h1", "植物学 - 完整教案", 0)
+    assert [text for kind, text, _ in blocks if kind == "h2"] == [
+        "一、思维导图", "二、教学流程", "三、问题模拟与预期效果", "四、评价与优化建议"
+    ]
+    assert blocks[-1] == ("p", "生成时间：2026年01月02日 03:04:05", 0)
+
+
+def test_render_pdf():
+    pdf = render_document("pdf", PLAN)
+    assert pdf.startswith(b"%PDF-1.4")
+    assert pdf.rstrip().endswith(b"%%EOF")
+    assert b"/Count 1" in pdf
+    # 文本按UCS-2十六进制写入
+    assert "".join(f"{ord(char):04X}" for char in "植物学").encode() in pdf
+    # 交叉引用表中的偏移量指向各对象
+    xref = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+    offsets = [int(line[:10]) for line in pdf[xref:].split(b"\n") if line.endswith(b" n ")]
+    assert offsets
+    assert all(pdf[offset:].startswith(b"%d 0 obj" % number) for number, offset in enumerate(offsets, 1))
+
+
+def test_render_pdf_paginates_long_plans():
+    long_plan = {**PLAN, "mindmap": "<ul>" + "<li>要点</li>" * 200 + "</ul>"}
+    assert int(re.search(rb"/Count (\d+)", render_document("pdf", long_plan)).group(1)) > 1
+
+
+def test_render_docx():
+    docx = render_document("docx", PLAN)
+    with zipfile.ZipFile(BytesIO(docx)) as package:
+        assert set(package.namelist()) == {"[Content_Types].xml", "_rels/.rels", "word/document.xml"}
+        document = package.read("word/document.xml").decode("utf-8")
+    assert "植物学 - 完整教案" in document
+    assert "叶绿体" in document
+    assert "{'score': 8}" not in document
+
+
+def test_unknown_format():
+    with pytest.raises(KeyError):
+        render_document("odt", PLAN)
+
+
+def slow_render(fmt, plan):
+    time.sleep(30)
+
+
+def test_render_timeout_terminates_the_worker(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "_render_pool", None)
+    monkeypatch.setattr(app_module, "EXPORT_RENDER_WORKERS", 1)
+    monkeypatch.setattr(app_module, "EXPORT_RENDER_TIMEOUT", 0.5)
+    monkeypatch.setattr(app_module, "render_document", slow_render)
+    pool, stuck = app_module.submit_render("pdf", PLAN)
+    deadline = time.monotonic() + 5
+    while not stuck.running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    processes = list(pool._processes.values())
+
+    with pytest.raises(FutureTimeoutError):
+        app_module.render_plan_document("pdf", {**PLAN, "course_title": "超时"})
+    assert app_module._render_pool is None
+    for process in processes:
+        process.join(5)
+    assert processes and not any(process.is_alive() for process in processes)
+    with pytest.raises(BrokenProcessPool):
+        stuck.result(5)
+
+    # 下次渲染使用新的进程池
+    monkeypatch.setattr(app_module, "render_document", render_document)
+    assert app_module.render_plan_document("pdf", PLAN).startswith(b"%PDF-1.4")
+    app_module.retire_render_pool(app_module._render_pool)
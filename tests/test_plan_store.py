@@ -0,0 +1,121 @@
+import pytest
+
+from plan_store import PlanStore, bigram_tokens, build_search_query
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PlanStore(str(tmp_path / "plans.db"), search_candidates=100)
+
+
+def test_bigram_tokens():
+    assert bigram_tokens("光合作用 Python3 与") == ["光合", "合作", "作用", "python3", "与"]
+    assert bigram_tokens("") == []
+
+
+def test_build_search_query():
+    assert build_search_query("光合作用 植物") == '"光合 合作 作用" AND "植物"'
+    assert build_search_query("光") == '"光"*'
+    assert build_search_query("  ，。 ") == ""
+
+
+def test_create_get_update_delete(store):
+    plan = store.create(course_title="植物学", mindmap="<div><h3>光合作用</h3></div>")
+    assert plan["teaching_flow"] is None
+    assert store.get(plan["id"])["mindmap"] == "<div><h3>光合作用</h3></div>"
+
+    assert store.update(plan["id"], teaching_flow="<div>流程</div>", unknown="忽略")
+    updated = store.get(plan["id"])
+    assert updated["teaching_flow"] == "<div>流程</div>"
+    assert updated["updated_at"] >= plan["updated_at"]
+    assert not store.update("missing", course_title="x")
+
+    assert store.delete(plan["id"])
+    assert store.get(plan["id"]) is None
+    assert not store.delete(plan["id"])
+
+
+def test_keyset_pagination_covers_every_plan_once(store):
+    created = [store.create(course_title=f"课程{index}") for index in range(7)]
+    pages, cursor = [], None
+    while True:
+        page, cursor = store.list(limit=3, cursor=cursor)
+        pages.append(page)
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [3, 3, 1]
+    ids = [plan["id"] for page in pages for plan in page]
+    assert ids == [plan["id"] for plan in store.list(limit=10)[0]]
+    assert sorted(ids) == sorted(plan["id"] for plan in created)
+
+
+def test_pagination_is_stable_when_plans_are_added(store):
+    for index in range(4):
+        store.create(course_title=f"课程{index}")
+    first, cursor = store.list(limit=2)
+    store.create(course_title="新课程")
+    second, _ = store.list(limit=2, cursor=cursor)
+    assert {plan["id"] for plan in first}.isdisjoint(plan["id"] for plan in second)
+    assert "新课程" not in [plan["course_title"] for plan in second]
+
+
+def test_list_filters_by_title_prefix_and_reports_stages(store):
+    store.create(course_title="数学：函数", mindmap="<div>m</div>")
+    store.create(course_title="数学：几何")
+    store.create(course_title="语文")
+    plans, _ = store.list(title="数学")
+    assert sorted(plan["course_title"] for plan in plans) == ["数学：几何", "数学：函数"]
+    stages = {plan["course_title"]: plan["stages"] for plan in plans}
+    assert stages["数学：函数"] == ["mindmap"]
+
+
+def test_invalid_cursor(store):
+    with pytest.raises(ValueError):
+        store.list(cursor="not-a-cursor")
+
+
+def test_search_matches_titles_and_generated_content(store):
+    photosynthesis = store.create(
+        course_title="植物的生长", mindmap="<div class='mindmap'><h3>光合作用</h3><ul><li>叶绿体</li></ul></div>"
+    )
+    store.create(course_title="光学基础", course_description="透镜与成像")
+    store.create(course_title="Python Programming")
+
+    assert [plan["id"] for plan in store.search("光合作用")] == [photosynthesis["id"]]
+    assert {plan["course_title"] for plan in store.search("光")} == {"植物的生长", "光学基础"}
+    assert [plan["course_title"] for plan in store.search("植物 叶绿体")] == ["植物的生长"]
+    assert [plan["course_title"] for plan in store.search("python")] == ["Python Programming"]
+    assert store.search("化学") == []
+    assert store.search("，") == []
+
+
+def test_search_ranks_title_matches_first(store):
+    store.create(course_title="生物概论", course_description="介绍细胞结构")
+    store.create(course_title="细胞生物学")
+    assert store.search("细胞")[0]["course_title"] == "细胞生物学"
+
+
+def test_search_index_follows_updates_and_deletes(store):
+    plan = store.create(course_title="旧标题")
+    store.update(plan["id"], course_title="新标题", mindmap="<div>遗传</div>")
+    assert store.search("旧标题") == []
+    assert [item["id"] for item in store.search("遗传")] == [plan["id"]]
+    store.delete(plan["id"])
+    assert store.search("新标题") == []
+
+
+def test_existing_database_is_indexed_on_first_open(tmp_path):
+    path = str(tmp_path / "plans.db")
+    store = PlanStore(path)
+    plan = store.create(course_title="已有教案")
+    store._db.execute("DROP TABLE plans_fts")
+    store._db.commit()
+    assert [item["id"] for item in PlanStore(path).search("已有")] == [plan["id"]]
+
+
+def test_recent_returns_plans_with_section_oldest_first(store):
+    store.create(course_title="甲", mindmap="<div>a</div>")
+    store.create(course_title="乙")
+    store.create(course_title="丙", mindmap="<div>c</div>")
+    assert [plan["course_title"] for plan in store.recent(5)] == ["甲", "丙"]
+    assert [plan["course_title"] for plan in store.recent(1)] == ["丙"]
@@ -0,0 +1,97 @@
+import pytest
+
+import rate_limit
+from rate_limit import SparkQuota, TokenBucket
+from request_context import CancelToken, GenerationCancelled, cancel_token_var
+
+
+class FakeClock:
+    """替换 rate_limit 模块中的 time：sleep 只推进时钟"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def test_bucket_unlimited_when_rate_is_zero():
+    bucket = TokenBucket(0)
+    assert all(bucket.try_acquire() == 0 for _ in range(100))
+
+
+def test_bucket_allows_burst_then_waits(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.sleep(0.5)
+    assert bucket.try_acquire() == 0
+
+
+def test_bucket_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate=10, burst=2)
+    clock.sleep(60)
+    assert [bucket.try_acquire() for _ in range(2)] == [0, 0]
+    assert bucket.try_acquire() > 0
+
+
+def test_bucket_acquire_returns_waited_seconds(clock):
+    bucket = TokenBucket(rate=4, burst=1)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.25)
+
+
+def test_quota_limits_concurrent_connections():
+    quota = SparkQuota(rate=0, burst=1, max_connections=2)
+    assert quota.try_acquire() == 0
+    assert quota.try_acquire() == 0
+    assert quota.try_acquire() > 0
+    quota.release()
+    assert quota.try_acquire() == 0
+    assert quota.stats()["active"] == 2
+
+
+def test_quota_reclaims_idle_slot_when_full():
+    quota = SparkQuota(rate=0, burst=1, max_connections=1)
+    reclaimed = []
+
+    def reclaim():
+        reclaimed.append(True)
+        quota.release()
+        return True
+
+    assert quota.try_acquire() == 0
+    quota.reclaim = reclaim
+    assert quota.try_acquire() == 0
+    assert reclaimed == [True]
+    assert quota.stats()["active"] == 1
+
+
+def test_quota_slot_releases_on_exit():
+    quota = SparkQuota(rate=0, burst=1, max_connections=1)
+    with quota.slot("mindmap"):
+        assert quota.stats()["active"] == 1
+    assert quota.stats()["active"] == 0
+
+
+def test_quota_wait_stops_when_cancelled():
+    quota = SparkQuota(rate=0, burst=1, max_connections=0)
+    token = CancelToken()
+    token.cancel("disconnect")
+    reset = cancel_token_var.set(token)
+    try:
+        with pytest.raises(GenerationCancelled):
+            quota.acquire("mindmap")
+    finally:
+        cancel_token_var.reset(reset)
+    assert quota.stats()["waiting"] == 0
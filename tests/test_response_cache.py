@@ -0,0 +1,76 @@
+from metrics import Metric
+from response_cache import SparkResponseCache
+
+CHAT = {"domain": "x1", "temperature": 0.5, "max_tokens": 4096}
+MESSAGES = [{"role": "user", "content": "生成思维导图"}]
+
+
+def test_make_key_ignores_stream_flag_and_param_order():
+    key = SparkResponseCache.make_key(MESSAGES, {**CHAT, "stream": True})
+    reordered = dict(reversed(list(CHAT.items())))
+    assert key == SparkResponseCache.make_key(MESSAGES, reordered)
+    assert key != SparkResponseCache.make_key(MESSAGES, {**CHAT, "temperature": 0.7})
+
+
+def test_get_set_and_stats():
+    cache = SparkResponseCache(max_entries=4, ttl=60)
+    assert cache.get("a") is None
+    cache.set("a", "<div>A</div>")
+    assert cache.get("a") == "<div>A</div>"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_expired_entries_miss():
+    cache = SparkResponseCache(max_entries=4, ttl=0)
+    cache.set("a", "A")
+    assert cache.get("a") is None
+
+
+def test_lru_evicts_least_recently_used():
+    cache = SparkResponseCache(max_entries=2, ttl=60)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    cache.get("a")
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert cache.get("c") == "C"
+
+
+def test_disabled_without_memory_or_disk():
+    cache = SparkResponseCache(max_entries=0, ttl=60)
+    assert not cache.enabled
+    cache.set("a", "A")
+    assert cache.get("a") is None
+
+
+def test_disk_layer_survives_new_instance(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    SparkResponseCache(max_entries=4, ttl=60, db_path=db_path).set("a", "A")
+
+    metric = Metric("lookups", "测试", "counter", ("result",))
+    cache = SparkResponseCache(max_entries=4, ttl=60, db_path=db_path, metric=metric)
+    assert cache.get("a") == "A"  # 持久层命中后写回内存
+    assert cache.get("a") == "A"
+    assert cache.get("b") is None
+    lines = metric.render()
+    assert 'lookups{result="disk_hit"} 1' in lines
+    assert 'lookups{result="hit"} 1' in lines
+    assert 'lookups{result="miss"} 1' in lines
+
+
+def test_disk_layer_keeps_most_recent_entries(tmp_path):
+    cache = SparkResponseCache(max_entries=0, ttl=60, db_path=str(tmp_path / "cache.db"), db_max_entries=2)
+    for key in "abc":
+        cache.set(key, key.upper())
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
+
+
+def test_clear_removes_both_layers(tmp_path):
+    cache = SparkResponseCache(max_entries=4, ttl=60, db_path=str(tmp_path / "cache.db"))
+    cache.set("a", "A")
+    cache.clear()
+    assert cache.get("a") is None
@@ -0,0 +1,221 @@
+import threading
+
+import pytest
+
+from request_context import CancelToken, GenerationCancelled, cancel_token_var
+from response_cache import SparkResponseCache
+from session_pool import SparkSessionPool
+from spark_resilience import (
+    CircuitBreaker, RetryPolicy, SparkCallFailedError, SparkCircuitOpenError, SparkPoolBusyError,
+    SparkUnavailableError
+)
+
+MESSAGES = [{"role": "user", "content": "生成思维导图"}]
+
+
+class FakeSession:
+    """按预设结果依次返回的会话：outcomes 为 [(回答片段列表, 错误码)]，错误码为None表示成功
+
+    片段列表换成异常实例时，调用直接抛出该异常。
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.calls = 0
+        self.error_code = None
+        self.succeeded = False
+        self.answer = ""
+        self.extractor = self  # 流式调用缓存 extractor.value()
+
+    def gen_params(self, messages, route="unknown"):
+        return {"parameter": {"chat": {"domain": "x1", "temperature": 0.5, "max_tokens": 4096, "stream": True}}}
+
+    def _next(self):
+        self.calls += 1
+        parts, self.error_code = self.outcomes.pop(0)
+        self.succeeded = self.error_code is None
+        if isinstance(parts, Exception):
+            raise parts
+        self.answer = "".join(parts)
+        return parts
+
+    def call_spark_api(self, messages, route="unknown"):
+        return "".join(self._next())
+
+    def stream_spark_api(self, messages, route="unknown"):
+        yield from self._next()
+
+    def value(self):
+        return self.answer
+
+
+def make_pool(outcomes, size=1, max_waiting=4, cache=None, breaker=None, max_retries=2):
+    sessions = []
+
+    def factory():
+        session = FakeSession(outcomes)
+        sessions.append(session)
+        return session
+
+    pool = SparkSessionPool(
+        factory, size=size, max_waiting=max_waiting, acquire_timeout=0.2,
+        cache=cache, breaker=breaker, retry=RetryPolicy(max_retries, base_delay=0, max_delay=0)
+    )
+    return pool, sessions[0]
+
+
+def test_retries_retryable_errors_then_caches_result():
+    cache = SparkResponseCache(max_entries=8, ttl=60)
+    pool, session = make_pool([([""], "10110"), (["<div>ok</div>"], None)], cache=cache)
+    assert pool.call_spark_api(MESSAGES, route="mindmap") == "<div>ok</div>"
+    assert session.calls == 2
+    assert pool.call_spark_api(MESSAGES, route="mindmap") == "<div>ok</div>"
+    assert session.calls == 2  # 第二次命中缓存
+    session.outcomes.append((["<div>new</div>"], None))
+    assert pool.call_spark_api(MESSAGES, use_cache=False, route="mindmap") == "<div>new</div>"
+
+
+def test_does_not_retry_non_retryable_errors():
+    pool, session = make_pool([(["审核未通过"], "10013"), (["<div>ok</div>"], None)])
+    with pytest.raises(SparkCallFailedError) as raised:
+        pool.call_spark_api(MESSAGES, route="mindmap")
+    assert raised.value.status == 502
+    assert session.calls == 1
+
+
+def test_raises_unavailable_when_retries_are_exhausted():
+    pool, session = make_pool([([""], "connection")] * 3)
+    with pytest.raises(SparkUnavailableError):
+        pool.call_spark_api(MESSAGES, route="mindmap")
+    assert session.calls == 3
+
+
+@pytest.mark.parametrize("outcome, status", [
+    ((["<div><ul><li>"], "10013"), 502),  # 不可重试的错误码
+    ((["<div><ul><li>"], "timeout"), 504),  # 总超时
+])
+def test_failed_call_returns_and_caches_nothing(outcome, status):
+    cache = SparkResponseCache(max_entries=8, ttl=60)
+    pool, session = make_pool([outcome, (["<div>ok</div>"], None)], cache=cache)
+    with pytest.raises(SparkCallFailedError) as raised:
+        pool.call_spark_api(MESSAGES, route="mindmap")
+    assert raised.value.status == status
+    assert cache.stats()["entries"] == 0
+    # 下一次调用重新请求上游，而不是拿到缓存的半截结果
+    assert pool.call_spark_api(MESSAGES, route="mindmap") == "<div>ok</div>"
+    assert session.calls == 2
+
+
+def test_exhausted_retries_cache_nothing():
+    cache = SparkResponseCache(max_entries=8, ttl=60)
+    pool, _ = make_pool([(["<div>"], "closed")] * 3, cache=cache)
+    with pytest.raises(SparkUnavailableError):
+        pool.call_spark_api(MESSAGES, route="mindmap")
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.mark.parametrize("error_code", ["closed", "idle_timeout", "timeout", "10013"])
+def test_stream_failure_after_output_raises_and_caches_nothing(error_code):
+    cache = SparkResponseCache(max_entries=8, ttl=60)
+    pool, session = make_pool([(["<div>", "<ul><li>"], error_code), (["<div>ok</div>"], None)], cache=cache)
+    received = []
+    with pytest.raises(SparkCallFailedError):
+        for chunk in pool.stream_spark_api(MESSAGES, route="mindmap"):
+            received.append(chunk)
+    assert received == ["<div>", "<ul><li>"]
+    assert cache.stats()["entries"] == 0
+    assert list(pool.stream_spark_api(MESSAGES, route="mindmap")) == ["<div>ok</div>"]
+    assert session.calls == 2
+
+
+def test_breaker_rejects_calls_after_failures():
+    breaker = CircuitBreaker("pool-test", failure_threshold=2, reset_timeout=60)
+    pool, session = make_pool([([""], "timeout")] * 2, breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(SparkCallFailedError):
+            pool.call_spark_api(MESSAGES, route="mindmap")
+    with pytest.raises(SparkCircuitOpenError):
+        pool.call_spark_api(MESSAGES, route="mindmap")
+    assert session.calls == 2
+
+
+def test_breaker_records_calls_that_raise():
+    # 半开状态的试探调用抛出异常后，熔断器仍要记录结果，不能一直停在半开状态拒绝所有调用
+    breaker = CircuitBreaker("pool-test", failure_threshold=1, reset_timeout=0)
+    pool, session = make_pool(
+        [([""], "timeout"), (RuntimeError("连接失败"), "connection"), (["<div>ok</div>"], None)], breaker=breaker)
+    with pytest.raises(SparkCallFailedError):
+        pool.call_spark_api(MESSAGES, route="mindmap")
+    assert breaker.state == "open"
+    with pytest.raises(RuntimeError):
+        pool.call_spark_api(MESSAGES, route="mindmap")
+    assert breaker.state == "open"
+    assert pool.call_spark_api(MESSAGES, route="mindmap") == "<div>ok</div>"
+    assert breaker.state == "closed"
+
+
+def test_rejects_when_queue_is_full():
+    pool, _ = make_pool([], size=1, max_waiting=0)
+    with pool.session():
+        with pytest.raises(SparkPoolBusyError):
+            with pool.session():
+                pass
+    assert pool.stats()["in_use"] == 0
+
+
+def test_waiting_request_times_out():
+    pool, _ = make_pool([], size=1, max_waiting=4)
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with pool.session():
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait(5)
+    try:
+        with pytest.raises(SparkPoolBusyError):
+            with pool.session():
+                pass
+    finally:
+        release.set()
+        thread.join()
+    assert pool.stats() == {"size": 1, "in_use": 0, "waiting": 0, "max_waiting": 4}
+
+
+def test_stream_retries_only_before_output():
+    pool, session = make_pool([([], "closed"), (["<div>", "ok</div>"], None)])
+    assert list(pool.stream_spark_api(MESSAGES, route="mindmap")) == ["<div>", "ok</div>"]
+    assert session.calls == 2
+
+    pool, session = make_pool([(["<div>"], "closed"), (["<div>ok</div>"], None)])
+    received = []
+    with pytest.raises(SparkCallFailedError):
+        for chunk in pool.stream_spark_api(MESSAGES, route="mindmap"):
+            received.append(chunk)
+    assert received == ["<div>"]
+    assert session.calls == 1
+
+
+def test_stream_cache_hit_yields_whole_result():
+    cache = SparkResponseCache(max_entries=8, ttl=60)
+    pool, session = make_pool([(["<div>", "ok</div>"], None)], cache=cache)
+    list(pool.stream_spark_api(MESSAGES, route="mindmap"))
+    assert list(pool.stream_spark_api(MESSAGES, route="mindmap")) == ["<div>ok</div>"]
+    assert session.calls == 1
+
+
+def test_cancelled_generation_is_not_called():
+    pool, session = make_pool([(["<div>ok</div>"], None)])
+    token = CancelToken()
+    token.cancel("disconnect")
+    reset = cancel_token_var.set(token)
+    try:
+        with pytest.raises(GenerationCancelled):
+            pool.call_spark_api(MESSAGES, route="mindmap")
+    finally:
+        cancel_token_var.reset(reset)
+    assert session.calls == 0
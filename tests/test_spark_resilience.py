@@ -0,0 +1,80 @@
+import pytest
+
+from spark_resilience import CircuitBreaker, RetryPolicy, SparkCircuitOpenError, SparkUnavailableError
+
+
+def test_retry_skips_non_retryable_codes_and_produced_output():
+    policy = RetryPolicy(max_retries=2, base_delay=0.5, max_delay=8)
+    assert policy.next_delay("10013", 0, "mindmap") is None  # 内容审核等错误不重试
+    assert policy.next_delay(None, 0, "mindmap") is None
+    assert policy.next_delay("closed", 0, "mindmap", produced_output=True) is None
+
+
+def test_retry_delay_is_bounded_full_jitter():
+    policy = RetryPolicy(max_retries=20, base_delay=0.5, max_delay=8)
+    for attempt in range(10):
+        delay = policy.next_delay("10110", attempt, "mindmap")
+        assert 0 <= delay <= min(8, 0.5 * 2 ** attempt)
+
+
+def test_retry_exhausted_raises_unavailable():
+    policy = RetryPolicy(max_retries=2, base_delay=0, max_delay=0)
+    assert policy.next_delay("connection", 1, "mindmap") == 0
+    with pytest.raises(SparkUnavailableError):
+        policy.next_delay("connection", 2, "mindmap")
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test-open", failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record("timeout")
+        breaker.before_call()
+    breaker.record("idle_timeout")
+    assert breaker.state == "open"
+    with pytest.raises(SparkCircuitOpenError):
+        breaker.before_call()
+
+
+def test_breaker_success_and_caller_errors_reset_failures():
+    breaker = CircuitBreaker("test-reset", failure_threshold=2, reset_timeout=60)
+    breaker.record("closed")
+    breaker.record(None)
+    breaker.record("closed")
+    breaker.record("10013")  # 上游可用，只是请求被拒绝
+    breaker.record("closed")
+    assert breaker.state == "closed"
+    assert breaker.failures == 1
+
+
+def test_breaker_ignores_caller_aborts():
+    breaker = CircuitBreaker("test-abort", failure_threshold=1, reset_timeout=60)
+    breaker.record("cancelled")
+    breaker.record("aborted")
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_breaker_half_open_probe():
+    breaker = CircuitBreaker("test-half-open", failure_threshold=1, reset_timeout=0)
+    breaker.record("connection")
+    assert breaker.state == "open"
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(SparkCircuitOpenError):
+        breaker.before_call()  # 半开状态只放行一个试探调用
+    breaker.record("connection")
+    assert breaker.state == "open"
+    breaker.before_call()
+    breaker.record(None)
+    assert breaker.state == "closed"
+
+
+def test_breaker_cancelled_probe_allows_next_probe():
+    breaker = CircuitBreaker("test-probe-cancel", failure_threshold=1, reset_timeout=60)
+    breaker.record("connection")
+    breaker.opened_at -= 60
+    breaker.before_call()
+    breaker.record("cancelled")
+    assert breaker.state == "open"
+    breaker.before_call()
+    assert breaker.state == "half_open"
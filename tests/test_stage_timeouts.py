@@ -0,0 +1,38 @@
+MINDMAP = "<div class='mindmap'><h3>光合作用</h3></div>"
+
+
+def set_profile_timeout(app, monkeypatch, stage, timeout):
+    monkeypatch.setitem(app.SPARK_PROFILES, stage, {**app.SPARK_PROFILES[stage], "timeout": timeout})
+
+
+def test_profile_deadline_fails_the_request(app_module, monkeypatch, mock_spark, use_spark):
+    use_spark(mock_spark(delay=0.05))
+    set_profile_timeout(app_module, monkeypatch, "teaching_flow", 0.5)
+    plan = app_module.plan_store.create(course_title="植物学", mindmap=MINDMAP)
+
+    response = app_module.app.test_client().post("/generate_teaching_flow", json={"plan_id": plan["id"]})
+    assert response.status_code == 504
+    assert "teaching_flow" not in response.get_json()
+    assert app_module.plan_store.get(plan["id"])["teaching_flow"] is None
+
+
+def test_idle_cut_after_output_ends_stream_with_error(app_module, monkeypatch, mock_spark, use_spark, sse_events):
+    use_spark(mock_spark(stall_rate=1, stall_seconds=3))
+    monkeypatch.setattr(app_module, "SPARK_IDLE_TIMEOUT", 0.3)
+    plan = app_module.plan_store.create(course_title="植物学", mindmap=MINDMAP)
+
+    response = app_module.app.test_client().post("/generate_teaching_flow/stream", json={"plan_id": plan["id"]})
+    events = sse_events(response)
+    assert [event for event, _ in events if event != "chunk"] == ["error"]
+    assert events[-1][1]["status"] == 504
+    assert any(event == "chunk" for event, _ in events)
+    assert app_module.plan_store.get(plan["id"])["teaching_flow"] is None
+
+
+def test_call_within_profile_deadline_succeeds(app_module, monkeypatch, mock_spark, use_spark):
+    use_spark(mock_spark())
+    set_profile_timeout(app_module, monkeypatch, "teaching_flow", 5)
+    response = app_module.app.test_client().post(
+        "/generate_teaching_flow", json={"course_title": "植物学", "mindmap": MINDMAP})
+    assert response.status_code == 200
+    assert response.get_json()["teaching_flow"].endswith("</div>")
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from structured_output import (
+    STAGE_FORMATS, JsonStreamParser, StructuredOutputError, StructuredStream, embedded_data, parse_loose_json
+)
+
+MINDMAP = {"sections": [
+    {"title": "课程介绍", "items": ["背景", {"text": "目标", "items": ["理解概念"]}]},
+    {"title": "核心概念", "items": ["概念一"]},
+]}
+
+
+def mindmap_parser():
+    spec = STAGE_FORMATS["mindmap"]
+    return JsonStreamParser(spec["schema"], spec["list_key"])
+
+
+def test_stream_parser_yields_list_items_as_they_complete():
+    text = "好的：\n```json\n" + json.dumps(MINDMAP, ensure_ascii=False) + "\n```\n以上。"
+    parser = mindmap_parser()
+    completed = []
+    for index in range(0, len(text), 7):
+        completed.extend(parser.feed(text[index:index + 7]))
+    assert completed == MINDMAP["sections"]
+    assert parser.close() == MINDMAP
+
+
+def test_stream_parser_tolerates_trailing_commas():
+    parser = mindmap_parser()
+    parser.feed('{"sections": [{"title": "主题", "items": ["要点",],},],}')
+    assert parser.close() == {"sections": [{"title": "主题", "items": ["要点"]}]}
+
+
+def test_stream_parser_fails_fast_on_schema_mismatch():
+    parser = mindmap_parser()
+    with pytest.raises(StructuredOutputError, match="缺少字段 items"):
+        parser.feed('{"sections": [{"title": "主题"}')
+
+
+def test_stream_parser_rejects_wrong_value_kind():
+    parser = mindmap_parser()
+    with pytest.raises(StructuredOutputError, match="sections"):
+        parser.feed('{"sections": "不是数组"')
+
+
+@pytest.mark.parametrize("minutes", ["true", "false"])
+def test_stream_parser_rejects_booleans_for_scalars(minutes):
+    spec = STAGE_FORMATS["teaching_flow"]
+    parser = JsonStreamParser(spec["schema"], spec["list_key"])
+    with pytest.raises(StructuredOutputError, match=f"字段 minutes 应为字符串或数字，实际为 {minutes}"):
+        parser.feed('{"stages": [{"title": "导入", "minutes": ' + minutes + ', "activities": ["提问"]}]}')
+
+
+def test_stream_parser_reports_incomplete_output():
+    parser = mindmap_parser()
+    parser.feed('{"sections": [')
+    with pytest.raises(StructuredOutputError, match="JSON不完整"):
+        parser.close()
+    with pytest.raises(StructuredOutputError, match="没有找到JSON对象"):
+        mindmap_parser().close()
+
+
+def test_structured_stream_renders_same_html_incrementally():
+    stream = StructuredStream("mindmap")
+    text = json.dumps(MINDMAP, ensure_ascii=False)
+    pieces = [stream.feed(text[index:index + 5]) for index in range(0, len(text), 5)]
+    html, value = stream.finish()
+    assert value == MINDMAP
+    assert html.startswith("<div class='mindmap'>")
+    assert html.startswith("".join(pieces))
+    assert "<h3>课程介绍</h3>" in html and "理解概念" in html
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"score": 8, "description": "良好"}', {"score": 8, "description": "良好"}),
+    ("{'score': 8, 'description': '良好',}", {"score": 8, "description": "良好"}),
+    ("{score: 7.5, passed: True, note: None}", {"score": 7.5, "passed": True, "note": None}),
+    ("{'labels': ['理解', '应用', ...], 'data': [8, 7, …]};", {"labels": ["理解", "应用"], "data": [8, 7]}),
+    ("{'text': '第一行\\n第二行'}", {"text": "第一行\n第二行"}),
+])
+def test_parse_loose_json(text, expected):
+    assert parse_loose_json(text) == expected
+
+
+def test_parse_loose_json_rejects_garbage():
+    with pytest.raises(StructuredOutputError):
+        parse_loose_json("{'score': 8")
+
+
+def test_embedded_data_normalizes_html_mode_chart():
+    html = ("<div class='problem-simulation'><script id='chart-data'>{'labels':['理解','应用'],"
+            "'datasets':[{'label':'预期效果','data':['8分', 7]}]}</script></div>")
+    assert embedded_data("problem_simulation", html) == {"chart_data": {
+        "labels": ["理解", "应用"], "datasets": [{"label": "预期效果", "data": [8, 7]}]
+    }}
+    assert embedded_data("evaluation", "<div class='evaluation'></div>") == {"rating_data": None}
+    assert embedded_data("evaluation", "", structured={"rating": "8.5"}) == {
+        "rating_data": {"score": 8.5, "description": ""}
+    }